@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+"""
+Compare retrying many calls to a failing function with individual
+RetryingCalls against doing the same with a BatchRetryingCall, counting the
+timers created on the underlying clock and the wall-clock time taken.
+
+Usage: python benchmarks/batch.py [--calls N] [--resolution SECONDS]
+"""
+
+from __future__ import print_function
+
+import argparse
+import gc
+from random import Random
+import time
+
+from twisted.internet import defer
+from twisted.logger import globalLogBeginner
+
+from simclock import HeapClock
+from txretry.batch import BatchRetryingCall
+from txretry.retry import RetryingCall, fullJitterBackoffIterator
+
+
+class CountingClock(HeapClock):
+    """
+    A L{HeapClock} that counts the calls scheduled with it.
+    """
+    timers = 0
+
+    def callLater(self, delay, callable, *args, **kw):
+        self.timers += 1
+        return HeapClock.callLater(self, delay, callable, *args, **kw)
+
+
+def _run(clock):
+    while clock.hasPendingCalls():
+        clock.advance(1.0)
+
+
+def individual(calls, service, makeIterator):
+    # Keep the calls and collect their results, as BatchRetryingCall does,
+    # so both modes hold the same objects for the garbage collector.
+    clock = CountingClock()
+    rcs = []
+    ds = []
+    for i in range(calls):
+        rc = RetryingCall(service, i)
+        rcs.append(rc)
+        ds.append(rc.start(backoffIterator=makeIterator(), clock=clock,
+                           keepFailures=1))
+    defer.DeferredList(ds, consumeErrors=True)
+    _run(clock)
+    return clock.timers
+
+
+def batched(calls, service, makeIterator, resolution):
+    clock = CountingClock()
+    batch = BatchRetryingCall(service, [(i,) for i in range(calls)])
+    batch.start(backoffIteratorFactory=makeIterator, resolution=resolution,
+                clock=clock, keepFailures=1)
+    _run(clock)
+    return clock.timers
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--calls', type=int, default=10000)
+    parser.add_argument('--resolution', type=float, default=0.05)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    def service(i):
+        raise RuntimeError('Backend unavailable.')
+
+    # Retry log events would otherwise be buffered until logging begins,
+    # and (with every call's failures, were they all kept) would make
+    # garbage collection dominate the timings.
+    globalLogBeginner.beginLoggingTo([], redirectStandardIO=False)
+
+    print('%-12s %12s %12s' % ('mode', 'timers', 'seconds'))
+    for name, run in (
+            ('individual', lambda make: individual(args.calls, service,
+                                                   make)),
+            ('batched', lambda make: batched(args.calls, service, make,
+                                             args.resolution))):
+        rand = Random(args.seed)
+        make = lambda: fullJitterBackoffIterator(initDelay=0.5,
+                                                 randomSource=rand)
+        gc.collect()
+        start = time.time()
+        timers = run(make)
+        print('%-12s %12d %12.2f' % (name, timers, time.time() - start))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+"""
+Compare the cost of testing failures with the usual Failure.trap idiom
+against a FailureClassifier.
+
+Usage: python benchmarks/classify.py [--number N]
+"""
+
+from __future__ import print_function
+
+import argparse
+import timeit
+
+from twisted.python.failure import Failure
+
+from txretry.classify import FailureClassifier
+
+
+class _AppError(Exception):
+    pass
+
+
+class _NotFound(_AppError):
+    pass
+
+
+def trapTester(fail):
+    fail.trap(IOError, ValueError)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--number', type=int, default=100000)
+    args = parser.parse_args()
+
+    classifier = FailureClassifier(retryable=[IOError, ValueError])
+    print('%-12s %-12s %14s' % ('tester', 'failure', 'usec/call'))
+    for failName, fail in (('retryable', Failure(ValueError())),
+                           ('fatal', Failure(_NotFound()))):
+        for name, tester in (('trap', trapTester),
+                             ('classifier', classifier)):
+            def run(tester=tester, fail=fail):
+                try:
+                    tester(fail)
+                except Exception:
+                    pass
+            seconds = timeit.timeit(run, number=args.number)
+            print('%-12s %-12s %14.3f' % (name, failName,
+                                          seconds * 1e6 / args.number))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+"""
+Measure the memory held by many concurrent RetryingCalls whose attempts
+keep failing, with and without a bounded failure history.
+
+Usage: python benchmarks/failures.py [--calls N] [--failures N]
+"""
+
+from __future__ import print_function
+
+import argparse
+import gc
+import tracemalloc
+
+from simclock import HeapClock
+from txretry.retry import RetryingCall
+
+
+def _deep(depth, payload):
+    """
+    Raise an exception from C{depth} frames down, each frame holding a
+    reference to C{payload} (as a real call stack holds its locals).
+    """
+    if depth:
+        _deep(depth - 1, payload)
+    raise RuntimeError('Backend unavailable.')
+
+
+def _service():
+    _deep(5, bytearray(256))
+
+
+def measure(calls, failures, keepFailures):
+    """
+    Start C{calls} RetryingCalls and let each fail C{failures} times.
+
+    @return: the number of bytes allocated (and still held) once every call
+        is waiting for its next attempt.
+    """
+    clock = HeapClock()
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    pending = []
+    for _ in range(calls):
+        rc = RetryingCall(_service)
+        d = rc.start(backoffIterator=[1.0] * failures + [3600.0],
+                     keepFailures=keepFailures, clock=clock)
+        pending.append((rc, d))
+    for _ in range(failures):
+        clock.advance(1.0)
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    for _, d in pending:
+        d.cancel()
+        d.addErrback(lambda _: None)
+    return used
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--calls', type=int, default=10000)
+    parser.add_argument('--failures', type=int, default=8)
+    args = parser.parse_args()
+
+    print('%-22s %14s %14s' % ('failure retention', 'total MiB',
+                               'bytes/call'))
+    for name, keepFailures in (('all (list)', None), ('first + last 2', 2),
+                               ('first only', 0)):
+        used = measure(args.calls, args.failures, keepFailures)
+        print('%-22s %14.1f %14d' % (name, used / 1048576.0,
+                                     used // args.calls))
+
+
+if __name__ == '__main__':
+    main()
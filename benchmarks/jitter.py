@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+"""
+Simulate many RetryingCalls that all fail at the same moment and compare
+the peak per-tick load that each back-off strategy sends to the recovering
+service.
+
+Everything runs on a simulated clock (a twisted.internet.task.Clock), so
+no real time passes.
+
+Usage: python benchmarks/jitter.py [--clients N] [--outage SECONDS]
+"""
+
+from __future__ import print_function
+
+import argparse
+from collections import defaultdict
+from random import Random
+
+from simclock import HeapClock
+from txretry.retry import (
+    simpleBackoffIterator, fullJitterBackoffIterator,
+    equalJitterBackoffIterator, decorrelatedJitterBackoffIterator,
+    RetryingCall)
+
+
+def strategies(seed, initDelay, maxDelay, maxResults):
+    """
+    Return a C{dict} mapping strategy names to functions of no arguments
+    that each make a new back-off iterator.
+    """
+    rand = Random(seed)
+    kw = dict(maxResults=maxResults, maxDelay=maxDelay, initDelay=initDelay)
+    return {
+        'simple': lambda: simpleBackoffIterator(**kw),
+        'full': lambda: fullJitterBackoffIterator(randomSource=rand, **kw),
+        'equal': lambda: equalJitterBackoffIterator(randomSource=rand, **kw),
+        'decorrelated': lambda: decorrelatedJitterBackoffIterator(
+            randomSource=rand, **kw),
+    }
+
+
+def simulate(makeIterator, clients, outage, tick):
+    """
+    Run C{clients} synchronized L{RetryingCall}s against a service that
+    fails every call made before time C{outage}.
+
+    @return: a C{tuple} of (peak retries in any one tick, total attempts,
+        number of clients that gave up). The initial (synchronized) attempt
+        made by every client is not counted towards the peak.
+    """
+    clock = HeapClock()
+    load = defaultdict(int)
+    counts = {'attempts': 0, 'gaveUp': 0}
+
+    def service(attempts):
+        counts['attempts'] += 1
+        if attempts[0]:
+            load[int(clock.seconds() / tick)] += 1
+        attempts[0] += 1
+        if clock.seconds() < outage:
+            raise RuntimeError('Service unavailable.')
+
+    def gaveUp(fail):
+        counts['gaveUp'] += 1
+
+    for _ in range(clients):
+        rc = RetryingCall(service, [0])
+        rc.start(backoffIterator=makeIterator(), clock=clock).addErrback(
+            gaveUp)
+
+    while clock.hasPendingCalls():
+        clock.advance(tick)
+
+    return max(load.values() or [0]), counts['attempts'], counts['gaveUp']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--clients', type=int, default=2000)
+    parser.add_argument('--outage', type=float, default=5.0)
+    parser.add_argument('--tick', type=float, default=0.01)
+    parser.add_argument('--initDelay', type=float, default=0.1)
+    parser.add_argument('--maxDelay', type=float, default=30.0)
+    parser.add_argument('--maxResults', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    print('%-14s %12s %12s %10s' % ('strategy', 'peak retries', 'attempts',
+                                    'gave up'))
+    factories = strategies(args.seed, args.initDelay, args.maxDelay,
+                           args.maxResults)
+    for name in ('simple', 'full', 'equal', 'decorrelated'):
+        peak, total, gaveUp = simulate(factories[name], args.clients,
+                                       args.outage, args.tick)
+        print('%-14s %12d %12d %10d' % (name, peak, total, gaveUp))
+
+
+if __name__ == '__main__':
+    main()
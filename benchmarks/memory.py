@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+"""
+Measure the memory used per pending retry by RetryingCall and by
+CompactRetryingCall (with a back-off generator and with a shared
+BackoffSchedule). Each call's first attempt fails, leaving a retry
+scheduled on a simulated clock. Requires Python 3 (for tracemalloc).
+
+Usage: python benchmarks/memory.py [--calls N [N ...]]
+"""
+
+from __future__ import print_function
+
+import argparse
+import gc
+import tracemalloc
+
+from twisted.logger import globalLogBeginner
+
+from simclock import HeapClock
+from txretry.compact import BackoffSchedule, CompactRetryingCall
+from txretry.retry import RetryingCall, simpleBackoffIterator
+
+
+def _unavailable(i):
+    raise IOError('unavailable')
+
+
+def measure(calls, start):
+    """
+    Start a number of calls whose first attempt fails.
+
+    @param calls: the number of calls.
+    @param start: a function of a clock and an argument for the called
+        function that starts a call and returns its C{Deferred}.
+    @return: the number of bytes allocated per pending retry.
+    """
+    clock = HeapClock()
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    ds = [start(clock, i) for i in range(calls)]
+    clock.advance(0)
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    for d in ds:
+        d.addErrback(lambda fail: None)
+        d.cancel()
+    return (after - before) / float(calls)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--calls', type=int, nargs='+',
+                        default=[10000, 100000])
+    args = parser.parse_args()
+
+    # Log events are otherwise buffered until logging begins, and that
+    # buffer would be counted as part of each call.
+    globalLogBeginner.beginLoggingTo([], redirectStandardIO=False)
+
+    schedule = BackoffSchedule()
+    cases = (
+        ('RetryingCall', lambda clock, i: RetryingCall(
+            _unavailable, i).start(simpleBackoffIterator(), clock=clock)),
+        ('Compact (generator)', lambda clock, i: CompactRetryingCall(
+            _unavailable, i).start(simpleBackoffIterator(), clock=clock)),
+        ('Compact (schedule)', lambda clock, i: CompactRetryingCall(
+            _unavailable, i).start(schedule, clock=clock)),
+    )
+    print('%-20s %10s %16s' % ('class', 'calls', 'bytes/retry'))
+    for name, start in cases:
+        for calls in args.calls:
+            print('%-20s %10d %16.0f' % (name, calls,
+                                         measure(calls, start)))
+
+
+if __name__ == '__main__':
+    main()
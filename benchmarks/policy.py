@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+"""
+Compare the per-call overhead of a RetryPolicy (directly and through the
+retrying decorator) against building and starting a RetryingCall by hand.
+
+Usage: python benchmarks/policy.py [--number N]
+"""
+
+from __future__ import print_function
+
+import argparse
+import timeit
+from functools import partial
+
+from twisted.internet import defer, task
+
+from txretry.policy import RetryPolicy, retrying
+from txretry.retry import RetryingCall, simpleBackoffIterator
+
+
+def _ok(x):
+    return defer.succeed(x)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--number', type=int, default=20000)
+    args = parser.parse_args()
+
+    clock = task.Clock()
+    delays = tuple(simpleBackoffIterator())
+    generatorPolicy = RetryPolicy(clock=clock)
+    tuplePolicy = RetryPolicy(partial(iter, delays), clock=clock)
+    decorated = retrying(tuplePolicy)(_ok)
+
+    def raw():
+        RetryingCall(_ok, 1).start(simpleBackoffIterator(),
+                                   lambda fail: None, clock=clock)
+
+    cases = (
+        ('raw RetryingCall', raw),
+        ('policy (generator)', lambda: generatorPolicy.call(_ok, 1)),
+        ('policy (tuple)', lambda: tuplePolicy.call(_ok, 1)),
+        ('decorator (tuple)', lambda: decorated(1)),
+    )
+    print('%-20s %14s' % ('method', 'usec/call'))
+    for name, run in cases:
+        def batch(run=run):
+            run()
+            # Fire the first attempt so pending calls do not accumulate.
+            clock.advance(0)
+        seconds = timeit.timeit(batch, number=args.number)
+        print('%-20s %14.3f' % (name, seconds * 1e6 / args.number))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+A drop-in replacement for twisted.internet.task.Clock for simulations with
+many thousands of pending calls.
+
+task.Clock re-sorts its whole list of pending calls every time a call is
+added or the clock is advanced, which makes large simulations quadratic.
+HeapClock keeps its pending calls in a heap instead.
+"""
+
+from heapq import heappop, heappush
+from itertools import count
+
+from twisted.internet import base, task
+
+
+class HeapClock(task.Clock):
+    """
+    A L{task.Clock} whose pending calls are kept in a heap. Cancelled and
+    rescheduled calls are discarded lazily, when they reach the top of the
+    heap.
+    """
+    def __init__(self):
+        task.Clock.__init__(self)
+        self._heap = []
+        self._order = count()
+
+    def callLater(self, delay, callable, *args, **kw):
+        """
+        See L{twisted.internet.interfaces.IReactorTime.callLater}.
+        """
+        dc = base.DelayedCall(self.seconds() + delay, callable, args, kw,
+                              lambda dc: None, self._push, self.seconds)
+        self._push(dc)
+        return dc
+
+    def _push(self, dc):
+        """
+        Add a delayed call to the heap at its current scheduled time.
+
+        @param dc: a C{DelayedCall}.
+        """
+        heappush(self._heap, (dc.getTime(), next(self._order), dc))
+
+    def _prune(self):
+        """
+        Discard entries for cancelled, called or rescheduled calls from the
+        top of the heap.
+        """
+        heap = self._heap
+        while heap:
+            when, _, dc = heap[0]
+            if dc.cancelled or dc.called or when < dc.getTime():
+                heappop(heap)
+                if when < dc.getTime() and not (dc.cancelled or dc.called):
+                    # The call was delayed. Put it back at its new time.
+                    self._push(dc)
+            else:
+                return
+
+    def getDelayedCalls(self):
+        """
+        See L{twisted.internet.interfaces.IReactorTime.getDelayedCalls}.
+        """
+        return [dc for when, _, dc in self._heap
+                if not (dc.cancelled or dc.called) and when == dc.getTime()]
+
+    def hasPendingCalls(self):
+        """
+        Check cheaply whether any calls are still pending.
+
+        @return: C{True} if there is at least one pending call.
+        """
+        self._prune()
+        return bool(self._heap)
+
+    def advance(self, amount):
+        """
+        Move time forward and run all calls that become due.
+
+        @param amount: the number of seconds to move time forward by.
+        """
+        self.rightNow += amount
+        heap = self._heap
+        while True:
+            self._prune()
+            if not heap or heap[0][0] > self.rightNow:
+                return
+            dc = heappop(heap)[2]
+            dc.called = 1
+            dc.func(*dc.args, **dc.kw)
@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+"""
+Simulate many RetryingCalls against a fake backend with outages, random
+errors and variable latency, and report for each back-off strategy the
+throughput, attempts per success, time to recovery after the last outage,
+peak backend load and completion latency percentiles.
+
+Everything runs on a simulated clock, so no real time passes and results
+are reproducible for a given seed. Results are printed as a table and can
+also be written as JSON, to compare txretry releases.
+
+Usage: python benchmarks/simulate.py [--calls N] [--duration SECONDS]
+    [--outage START:END ...] [--errorRate P] [--latency MODEL]
+    [--output FILE] [--label LABEL]
+"""
+
+from __future__ import print_function
+
+import argparse
+from collections import defaultdict
+import json
+from random import Random
+
+from twisted.internet import defer
+
+from jitter import strategies
+from simclock import HeapClock
+from txretry.adaptive import AdaptiveBackoff
+from txretry.retry import RetryingCall
+
+
+STRATEGIES = ('simple', 'full', 'equal', 'decorrelated', 'adaptive')
+
+
+def latencyModel(spec, rand):
+    """
+    Make a latency distribution from a description.
+
+    @param spec: one of C{constant:SECONDS}, C{exponential:MEAN} or
+        C{lognormal:MU,SIGMA}.
+    @param rand: a C{random.Random}.
+    @return: a function of no arguments returning a latency in seconds.
+    """
+    kind, _, params = spec.partition(':')
+    values = [float(value) for value in params.split(',')]
+    if kind == 'constant':
+        return lambda: values[0]
+    if kind == 'exponential':
+        return lambda: rand.expovariate(1.0 / values[0])
+    if kind == 'lognormal':
+        return lambda: rand.lognormvariate(values[0], values[1])
+    raise ValueError('Unknown latency model %r.' % spec)
+
+
+class FakeBackend(object):
+    """
+    A service whose calls fail during outage windows and at random with a
+    given error rate, and take a random time to complete.
+
+    @ivar attempts: the total number of calls made.
+    @ivar load: a C{dict} mapping bucket numbers to the number of calls
+        made in that bucket.
+    """
+    def __init__(self, clock, rand, outages, errorRate, latency, bucket):
+        self._clock = clock
+        self._rand = rand
+        self._outages = outages
+        self._errorRate = errorRate
+        self._latency = latency
+        self._bucket = bucket
+        self.attempts = 0
+        self.load = defaultdict(int)
+
+    def down(self, now):
+        """
+        @return: C{True} if the service is in an outage at time C{now}.
+        """
+        for start, end in self._outages:
+            if start <= now < end:
+                return True
+        return False
+
+    def __call__(self):
+        now = self._clock.seconds()
+        self.attempts += 1
+        self.load[int(now / self._bucket)] += 1
+        d = defer.Deferred()
+        if self.down(now) or self._rand.random() < self._errorRate:
+            self._clock.callLater(self._latency(), d.errback,
+                                  RuntimeError('Service unavailable.'))
+        else:
+            self._clock.callLater(self._latency(), d.callback, None)
+        return d
+
+
+def percentile(values, fraction):
+    """
+    @param values: a sorted C{list} of numbers.
+    @param fraction: the percentile wanted, between 0 and 1.
+    @return: the value at that percentile, or C{None} if there are none.
+    """
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def simulate(name, args):
+    """
+    Run one simulation.
+
+    @param name: the name of the back-off strategy.
+    @param args: the parsed command line arguments.
+    @return: a C{dict} of results.
+    """
+    rand = Random(args.seed)
+    clock = HeapClock()
+    backend = FakeBackend(clock, rand, args.outage, args.errorRate,
+                          latencyModel(args.latency, rand), args.bucket)
+    if name == 'adaptive':
+        adaptive = AdaptiveBackoff(initDelay=args.initDelay,
+                                   maxDelay=args.maxDelay, randomSource=rand)
+        start = lambda: {'backoffIterator': adaptive.iterator(
+            args.maxResults), 'observer': adaptive}
+    else:
+        factory = strategies(args.seed, args.initDelay, args.maxDelay,
+                             args.maxResults)[name]
+        start = lambda: {'backoffIterator': factory()}
+
+    recoveryFrom = max([end for _, end in args.outage] or [0.0])
+    counts = {'succeeded': 0, 'gaveUp': 0}
+    latencies = []
+    lastFinish = [0.0, recoveryFrom]
+
+    def finished(result, started, succeeded):
+        now = clock.seconds()
+        if succeeded:
+            counts['succeeded'] += 1
+            latencies.append(now - started)
+        else:
+            counts['gaveUp'] += 1
+        lastFinish[0] = max(lastFinish[0], now)
+        if started < recoveryFrom:
+            lastFinish[1] = max(lastFinish[1], now)
+
+    def arrive():
+        started = clock.seconds()
+        d = RetryingCall(backend).start(clock=clock, **start())
+        d.addCallbacks(finished, finished, callbackArgs=(started, True),
+                       errbackArgs=(started, False))
+
+    when = 0.0
+    for _ in range(args.calls):
+        when += rand.expovariate(args.calls / args.duration)
+        clock.callLater(when, arrive)
+
+    while clock.hasPendingCalls():
+        clock.advance(args.tick)
+
+    latencies.sort()
+    succeeded = counts['succeeded']
+    return {
+        'calls': args.calls,
+        'succeeded': succeeded,
+        'gaveUp': counts['gaveUp'],
+        'attempts': backend.attempts,
+        'throughput': succeeded / lastFinish[0] if lastFinish[0] else 0.0,
+        'attemptsPerSuccess': (float(backend.attempts) / succeeded
+                               if succeeded else None),
+        'timeToRecovery': lastFinish[1] - recoveryFrom,
+        'peakLoad': max(backend.load.values() or [0]) / args.bucket,
+        'p50': percentile(latencies, 0.5),
+        'p99': percentile(latencies, 0.99),
+    }
+
+
+def _outage(value):
+    start, end = value.split(':')
+    return float(start), float(end)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--calls', type=int, default=5000)
+    parser.add_argument('--duration', type=float, default=60.0,
+                        help='Seconds over which calls arrive.')
+    parser.add_argument('--outage', type=_outage, action='append',
+                        help='An outage window, as START:END seconds. '
+                        'May be repeated. Default: 10:25.')
+    parser.add_argument('--errorRate', type=float, default=0.01)
+    parser.add_argument('--latency', default='exponential:0.05')
+    parser.add_argument('--strategy', choices=STRATEGIES, action='append')
+    parser.add_argument('--initDelay', type=float, default=0.1)
+    parser.add_argument('--maxDelay', type=float, default=30.0)
+    parser.add_argument('--maxResults', type=int, default=20)
+    parser.add_argument('--tick', type=float, default=0.01)
+    parser.add_argument('--bucket', type=float, default=1.0,
+                        help='Seconds over which peak load is measured.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Write results as JSON to this '
+                        'file.')
+    parser.add_argument('--label', help='A label (e.g., a release) to '
+                        'store with the JSON results.')
+    args = parser.parse_args()
+    if args.outage is None:
+        args.outage = [(10.0, 25.0)]
+
+    results = {}
+    print('%-13s %8s %8s %10s %9s %9s %9s %8s %8s' % (
+        'strategy', 'success', 'gave up', 'calls/s', 'att/succ',
+        'recovery', 'peak/s', 'p50', 'p99'))
+    for name in args.strategy or STRATEGIES:
+        r = results[name] = simulate(name, args)
+        print('%-13s %8d %8d %10.1f %9.2f %9.2f %9.0f %8.3f %8.3f' % (
+            name, r['succeeded'], r['gaveUp'], r['throughput'],
+            r['attemptsPerSuccess'] or 0.0, r['timeToRecovery'],
+            r['peakLoad'], r['p50'] or 0.0, r['p99'] or 0.0))
+
+    if args.output:
+        parameters = dict(vars(args))
+        for key in 'output', 'strategy', 'label':
+            del parameters[key]
+        with open(args.output, 'w') as f:
+            json.dump({'label': args.label, 'parameters': parameters,
+                       'results': results}, f, indent=2, sort_keys=True)
+            f.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+# Copyright 2011 Fluidinfo Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you
+# may not use this file except in compliance with the License.  You
+# may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.  See the License for the specific language governing
+# permissions and limitations under the License.
+
+import random
+
+from txretry.observer import RetryObserver
+
+
+class AdaptiveBackoff(RetryObserver):
+    """
+    A source of retry delays, shared by all the L{RetryingCall}s to one
+    target, that adapts to how the target is behaving. The delay is
+    increased multiplicatively whenever an attempt fails and decreased
+    additively whenever one succeeds quickly (AIMD), so retries slow down
+    while the target is struggling and speed up as it recovers. The
+    additive decrease is scaled by the recent success rate, and while the
+    moving average of attempt latency is above C{latencyTarget} successes
+    do not decrease the delay at all.
+
+    Use it as both the back-off iterator and the observer of each call::
+
+        backoff = AdaptiveBackoff()
+        rc.start(backoffIterator=backoff.iterator(), observer=backoff)
+
+    To also use another observer, such as a L{txretry.observer.RetryStats},
+    combine them with a L{txretry.observer.ObserverGroup}::
+
+        rc.start(backoffIterator=backoff.iterator(),
+                 observer=ObserverGroup([backoff, stats]))
+
+    @ivar delay: the current retry delay.
+    @ivar failureRate: an exponentially weighted moving average of the
+        fraction of attempts that failed.
+    @ivar latency: an exponentially weighted moving average of attempt
+        latency, or C{None} if no attempt has completed.
+    @param initDelay: the initial retry delay.
+    @param minDelay: the smallest retry delay.
+    @param maxDelay: the largest retry delay.
+    @param increaseFactor: the factor the delay is multiplied by after a
+        failure.
+    @param decreaseStep: the most the delay is reduced by after a success.
+    @param latencyTarget: if not C{None}, successes do not decrease the
+        delay while the moving average of attempt latency is above this.
+    @param smoothing: the weight given to each new observation in the
+        moving averages, between 0 and 1.
+    @param jitter: if C{True}, each delay yielded is chosen uniformly
+        between half the current delay and the current delay, so calls
+        sharing this source do not retry in lock-step.
+    @param randomSource: an object with a C{uniform} method, such as a
+        C{random.Random} instance. Default: the C{random} module.
+    """
+    def __init__(self, initDelay=0.1, minDelay=0.01, maxDelay=120.0,
+                 increaseFactor=2.0, decreaseStep=0.1, latencyTarget=None,
+                 smoothing=0.1, jitter=True, randomSource=None):
+        assert 0.0 < minDelay <= initDelay <= maxDelay
+        assert increaseFactor > 1.0
+        assert 0.0 < smoothing <= 1.0
+        self.delay = initDelay
+        self.minDelay = minDelay
+        self.maxDelay = maxDelay
+        self.increaseFactor = increaseFactor
+        self.decreaseStep = decreaseStep
+        self.latencyTarget = latencyTarget
+        self.smoothing = smoothing
+        self.jitter = jitter
+        self.failureRate = 0.0
+        self.latency = None
+        self._uniform = (randomSource or random).uniform
+
+    def iterator(self, maxResults=10, now=True):
+        """
+        Make a back-off iterator for one L{RetryingCall}. Each retry delay
+        is taken from the shared state at the moment the retry is
+        scheduled.
+
+        @param maxResults: the maximum number of delays to yield.
+        @param now: if C{True}, immediately yield a delay of zero.
+        @return: a generator that yields C{float} delays.
+        """
+        assert maxResults > 0
+        remaining = maxResults
+        if now:
+            yield 0.0
+            remaining -= 1
+        while remaining > 0:
+            if self.jitter:
+                yield self._uniform(self.delay / 2.0, self.delay)
+            else:
+                yield self.delay
+            remaining -= 1
+
+    def _observe(self, failed, latency):
+        """
+        Update the moving averages.
+
+        @param failed: C{True} if the attempt failed.
+        @param latency: the latency of the attempt.
+        """
+        weight = self.smoothing
+        self.failureRate += weight * ((1.0 if failed else 0.0) -
+                                      self.failureRate)
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += weight * (latency - self.latency)
+
+    def attemptFailed(self, func, attempt, fail, latency):
+        """
+        Update the moving averages and multiply the delay by
+        C{increaseFactor}. See L{RetryObserver.attemptFailed}.
+        """
+        self._observe(True, latency)
+        self.delay = min(self.maxDelay, self.delay * self.increaseFactor)
+
+    def succeeded(self, func, attempt, latency, elapsed):
+        """
+        Update the moving averages and, unless the average latency is
+        above C{latencyTarget}, decrease the delay. See
+        L{RetryObserver.succeeded}.
+        """
+        self._observe(False, latency)
+        if (self.latencyTarget is None or
+                self.latency <= self.latencyTarget):
+            self.delay = max(self.minDelay, self.delay - self.decreaseStep *
+                             (1.0 - self.failureRate))
@@ -0,0 +1,136 @@
+# Copyright 2011 Fluidinfo Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you
+# may not use this file except in compliance with the License.  You
+# may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.  See the License for the specific language governing
+# permissions and limitations under the License.
+
+
+import asyncio
+from inspect import isawaitable
+
+from twisted.python import failure
+
+from txretry.retry import _log, _retryAll, simpleBackoffIterator
+
+
+class AsyncRetryingCall(object):
+    """
+    The asyncio equivalent of L{RetryingCall}: calls a function (which may
+    be a coroutine function, or return any awaitable) repeatedly until it
+    succeeds, waiting between attempts for delays taken from a back-off
+    iterator. It needs neither Twisted's reactor nor C{Deferred}s, and works
+    with the same back-off iterators and failure testers. This module
+    requires Python 3.5 or later.
+
+    @ivar failures: a list of the C{Failure}s received in calling the
+        function.
+    @param func: The function to call.
+    @param args: Positional arguments to pass to the function.
+    @param kw: Keyword arguments to pass to the function.
+    """
+    def __init__(self, func, *args, **kw):
+        self._func = func
+        self._args = args
+        self._kw = kw
+        self.failures = []
+
+    async def start(self, backoffIterator=None, failureTester=None,
+                    deadline=None):
+        """
+        Try and retry, if needed, a call to the function.
+
+        Cancelling the task awaiting this coroutine cancels any attempt in
+        progress (if the function returned a future or coroutine), closes
+        the back-off iterator and raises C{asyncio.CancelledError}.
+
+        @param backoffIterator: An iterator that produces delay intervals
+            to wait between calls. Default: L{simpleBackoffIterator}C{()}.
+        @param failureTester: As for L{RetryingCall.start}: a function of
+            one argument (a C{Failure} wrapping the exception) that returns
+            a C{Failure} or raises to stop retrying, e.g. by calling
+            C{trap}.
+        @param deadline: An optional number of seconds after which no new
+            attempt may be made, as for L{RetryingCall.start}.
+        @raise Exception: the first exception raised by the function, if
+            the back-off iterator runs out or the deadline would be passed
+            (C{asyncio.TimeoutError} if it has not failed yet), or the
+            exception returned or raised by the failure tester.
+        @return: the result of the function.
+        """
+        backoffIterator = iter(backoffIterator or simpleBackoffIterator())
+        failureTester = failureTester or _retryAll
+        loop = asyncio.get_event_loop()
+        if deadline is not None:
+            deadline += loop.time()
+        attempts = 0
+        fail = None
+        try:
+            while True:
+                try:
+                    delay = next(backoffIterator)
+                except StopIteration:
+                    _log.info('RetryingCall: ran out of attempts calling '
+                              '{function!r}.', function=self._func,
+                              attempt=attempts)
+                    if not self.failures:
+                        raise ValueError('The back-off iterator produced '
+                                         'no delays.')
+                    self.failures[0].raiseException()
+                if deadline is not None and loop.time() + delay > deadline:
+                    _log.info('RetryingCall: next attempt at {function!r} '
+                              'would pass deadline.', function=self._func,
+                              attempt=attempts, delay=delay)
+                    if self.failures:
+                        self.failures[0].raiseException()
+                    raise asyncio.TimeoutError()
+                attempts += 1
+                if fail is not None:
+                    _log.info('RetryingCall: retrying {function!r} (attempt '
+                              '{attempt}) in {delay}s after '
+                              '{exceptionType!r}.', function=self._func,
+                              attempt=attempts, delay=delay,
+                              exceptionType=fail.type, failure=fail)
+                await asyncio.sleep(delay)
+                try:
+                    result = self._func(*self._args, **self._kw)
+                    if isawaitable(result):
+                        result = await result
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    fail = failure.Failure()
+                else:
+                    return result
+                self.failures.append(fail)
+                result = failureTester(fail)
+                if isinstance(result, failure.Failure):
+                    result.raiseException()
+        finally:
+            close = getattr(backoffIterator, 'close', None)
+            if close is not None:
+                close()
+
+
+async def retryCall(func, *args, backoffIterator=None, failureTester=None,
+                    deadline=None, **kw):
+    """
+    Call a function, retrying it as an L{AsyncRetryingCall} would.
+
+    @param func: The function to call.
+    @param args: Positional arguments to pass to the function.
+    @param backoffIterator: As for L{AsyncRetryingCall.start}.
+    @param failureTester: As for L{AsyncRetryingCall.start}.
+    @param deadline: As for L{AsyncRetryingCall.start}.
+    @param kw: Keyword arguments to pass to the function.
+    @return: the result of the function.
+    """
+    return await AsyncRetryingCall(func, *args, **kw).start(
+        backoffIterator, failureTester, deadline)
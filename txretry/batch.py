@@ -0,0 +1,281 @@
+# Copyright 2011 Fluidinfo Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you
+# may not use this file except in compliance with the License.  You
+# may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.  See the License for the specific language governing
+# permissions and limitations under the License.
+
+from math import ceil
+
+from twisted.internet import defer, error
+from twisted.logger import Logger
+
+from txretry.retry import RetryingCall, simpleBackoffIterator
+from txretry.scheduler import AttemptScheduler
+
+_log = Logger()
+
+
+class _CoalescedCall(object):
+    """
+    A delayed call made via a L{CoalescingClock}. This provides the parts
+    of C{IDelayedCall} that are used by C{task.deferLater} and
+    C{Deferred.addTimeout}.
+    """
+    __slots__ = ('_owner', 'time', 'func', 'args', 'kw', 'cancelled',
+                 'called', 'bucket')
+
+    def __init__(self, owner, time, func, args, kw):
+        self._owner = owner
+        self.time = time
+        self.func = func
+        self.args = args
+        self.kw = kw
+        self.cancelled = self.called = False
+        self.bucket = None
+
+    def getTime(self):
+        """
+        @return: the time at which we were asked to be called (we may be
+            called up to one clock resolution later than this).
+        """
+        return self.time
+
+    def active(self):
+        """
+        @return: C{True} if we have been neither called nor cancelled.
+        """
+        return not (self.cancelled or self.called)
+
+    def cancel(self):
+        """
+        Cancel the call.
+
+        @raise AlreadyCancelled: if the call has already been cancelled.
+        @raise AlreadyCalled: if the call has already been made.
+        """
+        if self.cancelled:
+            raise error.AlreadyCancelled()
+        if self.called:
+            raise error.AlreadyCalled()
+        self.cancelled = True
+        self._owner._remove(self)
+
+    def reset(self, secondsFromNow):
+        """
+        Reschedule the call.
+
+        @param secondsFromNow: the new delay until the call, in seconds.
+        """
+        if not self.active():
+            raise (error.AlreadyCancelled() if self.cancelled
+                   else error.AlreadyCalled())
+        self._owner._remove(self)
+        self.time = self._owner.seconds() + secondsFromNow
+        self._owner._add(self)
+
+    def delay(self, secondsLater):
+        """
+        Postpone the call.
+
+        @param secondsLater: the number of seconds to postpone it by.
+        """
+        self.reset(self.time + secondsLater - self._owner.seconds())
+
+
+class CoalescingClock(object):
+    """
+    An C{IReactorTime} provider that groups the calls scheduled with it
+    into ticks of C{resolution} seconds and makes one underlying delayed
+    call per tick. Calls are rounded up to the end of their tick, so they
+    may be made up to C{resolution} seconds later than asked.
+
+    Using one of these as the clock of many L{RetryingCall}s greatly
+    reduces the number of reactor timers created and cancelled when many
+    attempts become due at about the same time.
+
+    @param clock: the underlying C{IReactorTime} provider. Default: the
+        reactor.
+    @param resolution: the length of a tick, in seconds.
+    """
+    def __init__(self, clock=None, resolution=0.01):
+        assert resolution > 0.0
+        if clock is None:
+            from twisted.internet import reactor as clock
+        self._clock = clock
+        self.resolution = resolution
+        # Map tick numbers to [underlying delayed call, live call count,
+        # list of calls, tick number].
+        self._buckets = {}
+
+    def seconds(self):
+        """
+        @return: the current time, according to the underlying clock.
+        """
+        return self._clock.seconds()
+
+    def callLater(self, delay, callable, *args, **kw):
+        """
+        Schedule a call.
+
+        @param delay: the number of seconds to wait.
+        @param callable: the function to call.
+        @param args: positional arguments to pass to C{callable}.
+        @param kw: keyword arguments to pass to C{callable}.
+        @return: an object providing the C{IDelayedCall} methods
+            C{getTime}, C{active}, C{cancel}, C{reset} and C{delay}.
+        """
+        call = _CoalescedCall(self, self.seconds() + delay, callable, args,
+                              kw)
+        self._add(call)
+        return call
+
+    def getDelayedCalls(self):
+        """
+        @return: a C{list} of all pending calls.
+        """
+        calls = []
+        for bucket in self._buckets.values():
+            for call in bucket[2]:
+                if call.active() and call.bucket is bucket:
+                    calls.append(call)
+        return calls
+
+    def _add(self, call):
+        """
+        Put a call into the bucket for its tick.
+
+        @param call: a L{_CoalescedCall}.
+        """
+        tick = int(ceil(call.time / self.resolution))
+        bucket = self._buckets.get(tick)
+        if bucket is None:
+            delay = max(0.0, tick * self.resolution - self.seconds())
+            bucket = self._buckets[tick] = [
+                self._clock.callLater(delay, self._fire, tick), 0, [], tick]
+        bucket[1] += 1
+        bucket[2].append(call)
+        call.bucket = bucket
+
+    def _remove(self, call):
+        """
+        Note that a (cancelled or rescheduled) call has left its bucket,
+        cancelling the bucket's underlying delayed call if no live calls
+        remain. The call itself is left in the bucket's list, and skipped
+        when the bucket fires. If the bucket is firing (e.g., one of its
+        calls cancels another's timeout), there is nothing to cancel.
+
+        @param call: a L{_CoalescedCall}.
+        """
+        bucket = call.bucket
+        bucket[1] -= 1
+        if not bucket[1] and bucket[0].active():
+            bucket[0].cancel()
+            del self._buckets[bucket[3]]
+
+    def _fire(self, tick):
+        """
+        Make all the live calls in a tick's bucket. As with a reactor, an
+        error raised by one call is logged and does not stop the others.
+
+        @param tick: the tick number.
+        """
+        bucket = self._buckets.pop(tick)
+        for call in bucket[2]:
+            if call.active() and call.bucket is bucket:
+                call.called = True
+                func, args, kw = call.func, call.args, call.kw
+                # Drop references the made call no longer needs, so they
+                # can be freed early.
+                call.func = call.args = call.kw = None
+                try:
+                    func(*args, **kw)
+                except:
+                    _log.failure('CoalescingClock: error making delayed '
+                                 'call {function!r}.', function=func)
+
+
+class BatchRetryingCall(object):
+    """
+    Call a function with many different sets of positional arguments,
+    retrying each call as a L{RetryingCall} would. All the calls share a
+    L{CoalescingClock}, so attempts that become due in the same tick share
+    a single reactor timer, and the number of attempts in progress at once
+    can be limited.
+
+    @param func: The function to call.
+    @param argSets: An iterable of C{tuple}s of positional arguments, one
+        per call.
+    @param kw: Keyword arguments to pass to the function on every call.
+    """
+    def __init__(self, func, argSets, **kw):
+        self._func = func
+        self._argSets = [tuple(args) for args in argSets]
+        self._kw = kw
+        self.calls = []
+
+    def start(self, backoffIteratorFactory=None, failureTester=None,
+              maxConcurrent=None, resolution=0.01, onResult=None,
+              clock=None, **startKw):
+        """
+        Start all the calls.
+
+        @param backoffIteratorFactory: A function of no arguments that
+            returns a new back-off iterator for each call. Default:
+            L{simpleBackoffIterator}.
+        @param failureTester: As for L{RetryingCall.start}.
+        @param maxConcurrent: If not C{None}, the greatest number of
+            attempts that may be in progress at once. Due attempts beyond
+            this wait their turn in a shared
+            L{txretry.scheduler.AttemptScheduler}, which runs first
+            attempts before retries (any C{attemptTimeout} only starts once
+            an attempt runs).
+        @param resolution: The tick length, in seconds, within which due
+            attempts are grouped.
+        @param onResult: An optional function of three arguments (the index
+            of the argument set, a C{bool} success flag and the result or
+            C{Failure}) called as each call completes.
+        @param clock: The underlying C{IReactorTime} provider. Default:
+            the reactor.
+        @param startKw: Other keyword arguments to pass to the C{start}
+            method of each L{RetryingCall}.
+        @return: a C{DeferredList} that fires, once every call has
+            completed, with a C{list} of (success, result) pairs in the
+            order of the argument sets.
+        """
+        factory = backoffIteratorFactory or simpleBackoffIterator
+        coalescingClock = CoalescingClock(clock, resolution)
+        if maxConcurrent is not None:
+            startKw['scheduler'] = AttemptScheduler(maxConcurrent,
+                                                    clock=coalescingClock)
+
+        ds = []
+        for index, args in enumerate(self._argSets):
+            rc = RetryingCall(self._func, *args, **self._kw)
+            self.calls.append(rc)
+            d = rc.start(backoffIterator=factory(),
+                         failureTester=failureTester, clock=coalescingClock,
+                         **startKw)
+            if onResult is not None:
+                d.addCallbacks(self._report, self._report,
+                               callbackArgs=(onResult, index, True),
+                               errbackArgs=(onResult, index, False))
+            ds.append(d)
+        return defer.DeferredList(ds, consumeErrors=True)
+
+    @staticmethod
+    def _report(result, onResult, index, success):
+        """
+        Pass a result to the C{onResult} function given to C{start}.
+
+        @return: C{result}, so the C{DeferredList} still sees it.
+        """
+        onResult(index, success, result)
+        return result
@@ -0,0 +1,68 @@
+# Copyright 2011 Fluidinfo Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you
+# may not use this file except in compliance with the License.  You
+# may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.  See the License for the specific language governing
+# permissions and limitations under the License.
+
+
+class RetryBudget(object):
+    """
+    A token bucket that limits retries to a fraction of successful calls.
+    A single instance can be shared by any number of L{RetryingCall}
+    instances (via their C{start} method) so that, when a backend goes
+    down, the total retry traffic stays bounded instead of multiplying the
+    outage load by the length of every back-off iterator.
+
+    Each successful call deposits C{ratio} tokens into the bucket (up to
+    C{maxTokens}). Each retry must withdraw one whole token. When the bucket
+    holds less than one token, retries are denied and the retrying call
+    fails fast.
+
+    @ivar allowed: the number of retries the budget has allowed.
+    @ivar denied: the number of retries the budget has denied.
+    @param ratio: the number of tokens deposited per successful call. E.g.,
+        0.1 allows (in the steady state) one retry per ten successes.
+    @param maxTokens: the maximum number of tokens the bucket can hold.
+    @param initialTokens: the number of tokens initially in the bucket.
+        Default: C{maxTokens}.
+    """
+    def __init__(self, ratio=0.1, maxTokens=10.0, initialTokens=None):
+        assert ratio >= 0.0
+        assert maxTokens >= 1.0
+        self.ratio = ratio
+        self.maxTokens = maxTokens
+        if initialTokens is None:
+            initialTokens = maxTokens
+        self.tokens = min(initialTokens, maxTokens)
+        self.allowed = 0
+        self.denied = 0
+
+    def deposit(self):
+        """
+        Note a successful call, adding C{self.ratio} tokens to the bucket.
+        """
+        tokens = self.tokens + self.ratio
+        self.tokens = tokens if tokens < self.maxTokens else self.maxTokens
+
+    def withdraw(self):
+        """
+        Ask the budget for permission to retry.
+
+        @return: C{True} if a retry is allowed (in which case a token is
+            removed from the bucket), else C{False}.
+        """
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            self.allowed += 1
+            return True
+        else:
+            self.denied += 1
+            return False
@@ -0,0 +1,171 @@
+# Copyright 2011 Fluidinfo Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you
+# may not use this file except in compliance with the License.  You
+# may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.  See the License for the specific language governing
+# permissions and limitations under the License.
+
+from collections import deque
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised (via a failing C{Deferred}) when a call is refused because its
+    circuit breaker is open.
+    """
+
+
+class CircuitBreaker(object):
+    """
+    A circuit breaker for a single target. While the breaker is closed, the
+    outcomes of the most recent calls are recorded. If, once at least
+    C{minimumCalls} outcomes have been seen, the fraction of failures
+    reaches C{failureThreshold}, the breaker opens and refuses all calls
+    for C{resetTimeout} seconds. It then becomes half-open and lets
+    C{halfOpenCalls} probe calls through. If they all succeed the breaker
+    closes again, and if any of them fails it re-opens.
+
+    @ivar state: one of C{CLOSED}, C{OPEN} or C{HALF_OPEN}.
+    @param failureThreshold: the failure rate at which to open the breaker.
+    @param minimumCalls: the number of outcomes needed before the failure
+        rate is considered.
+    @param windowSize: the number of most recent outcomes to consider.
+    @param resetTimeout: the number of seconds to stay open before
+        allowing probe calls.
+    @param halfOpenCalls: the number of successful probe calls needed to
+        close the breaker.
+    @param clock: a provider of C{IReactorTime}. Default: the reactor.
+    """
+    def __init__(self, failureThreshold=0.5, minimumCalls=10, windowSize=20,
+                 resetTimeout=30.0, halfOpenCalls=3, clock=None):
+        assert 0.0 < failureThreshold <= 1.0
+        assert 0 < minimumCalls <= windowSize
+        assert halfOpenCalls > 0
+        self.failureThreshold = failureThreshold
+        self.minimumCalls = minimumCalls
+        self.resetTimeout = resetTimeout
+        self.halfOpenCalls = halfOpenCalls
+        if clock is None:
+            from twisted.internet import reactor as clock
+        self.clock = clock
+        self.state = CLOSED
+        self._outcomes = deque(maxlen=windowSize)
+        self._failures = 0
+        self._openedAt = None
+        self._probes = 0
+        self._probeSuccesses = 0
+
+    def allowRequest(self):
+        """
+        Ask whether a call may be made now. In the half-open state each
+        permitted call is counted as a probe.
+
+        @return: C{True} if the call may go ahead, else C{False}.
+        """
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN:
+            if self.clock.seconds() - self._openedAt < self.resetTimeout:
+                return False
+            self.state = HALF_OPEN
+            self._probes = 0
+            self._probeSuccesses = 0
+        if self._probes < self.halfOpenCalls:
+            self._probes += 1
+            return True
+        return False
+
+    def cancelRequest(self):
+        """
+        Note that a call permitted by L{allowRequest} was abandoned before
+        its outcome was known, freeing its probe slot if we are half-open.
+        """
+        if self.state == HALF_OPEN and self._probes > 0:
+            self._probes -= 1
+
+    def recordSuccess(self):
+        """
+        Note a successful call.
+        """
+        if self.state == HALF_OPEN:
+            self._probeSuccesses += 1
+            if self._probeSuccesses >= self.halfOpenCalls:
+                self._close()
+        elif self.state == CLOSED:
+            self._record(False)
+
+    def recordFailure(self):
+        """
+        Note a failed call.
+        """
+        if self.state == HALF_OPEN:
+            self._open()
+        elif self.state == CLOSED:
+            self._record(True)
+            if (len(self._outcomes) >= self.minimumCalls and
+                    self._failures >= (self.failureThreshold *
+                                       len(self._outcomes))):
+                self._open()
+
+    def _record(self, failed):
+        """
+        Add an outcome to our window of recent outcomes.
+
+        @param failed: C{True} if the call failed, else C{False}.
+        """
+        outcomes = self._outcomes
+        if len(outcomes) == outcomes.maxlen and outcomes[0]:
+            self._failures -= 1
+        outcomes.append(failed)
+        if failed:
+            self._failures += 1
+
+    def _open(self):
+        """
+        Open the breaker.
+        """
+        self.state = OPEN
+        self._openedAt = self.clock.seconds()
+
+    def _close(self):
+        """
+        Close the breaker, forgetting all previous outcomes.
+        """
+        self.state = CLOSED
+        self._outcomes.clear()
+        self._failures = 0
+
+
+class CircuitBreakerRegistry(object):
+    """
+    Hold one L{CircuitBreaker} per target, creating them on demand.
+
+    @param kw: keyword arguments for the L{CircuitBreaker} constructor.
+    """
+    def __init__(self, **kw):
+        self._kw = kw
+        self._breakers = {}
+
+    def breakerFor(self, key):
+        """
+        Get the circuit breaker for a target.
+
+        @param key: a hashable identifier for the target (e.g., a host name).
+        @return: the L{CircuitBreaker} for C{key}.
+        """
+        try:
+            return self._breakers[key]
+        except KeyError:
+            breaker = self._breakers[key] = CircuitBreaker(**self._kw)
+            return breaker
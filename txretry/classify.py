@@ -0,0 +1,163 @@
+# Copyright 2011 Fluidinfo Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you
+# may not use this file except in compliance with the License.  You
+# may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.  See the License for the specific language governing
+# permissions and limitations under the License.
+
+RETRY = 'retry'
+FAIL = 'fail'
+
+
+class FailureClassifier(object):
+    """
+    A declarative failure tester for L{RetryingCall}. Exception types are
+    declared retryable or fatal, and predicates can be attached to types to
+    decide from an exception instance (e.g., from an error code) whether to
+    retry.
+
+    An instance is callable with a C{Failure} and returns C{None} (retry)
+    or the C{Failure} (give up), so it can be passed anywhere a
+    C{failureTester} is accepted. The rules are compiled, once per
+    exception type seen, into a cached decision, so classifying a failure
+    is normally a single dictionary lookup, without the MRO scans and
+    exception re-raising that C{Failure.trap} and C{Failure.check} do.
+
+    For a given exception, the predicates attached to its type and its base
+    classes are consulted first, most specific type first. A predicate
+    returns C{True} (retry), C{False} (give up) or C{None} (no opinion).
+    If no predicate decides, the most specific of the exception's classes
+    that is declared retryable or fatal decides. Otherwise C{default}
+    does.
+
+    Hint rules attach functions to types that extract a suggested delay
+    before the next attempt (e.g., from a throttling error). They are
+    compiled and cached in the same way, and L{retryAfter} can be given
+    to a L{txretry.hints.RetryAfterHints} as an extractor::
+
+        classifier = FailureClassifier(
+            retryable=[ThrottledError],
+            hints=[(ThrottledError, lambda exc: exc.wait)])
+        d = RetryingCall(f).start(
+            failureTester=classifier,
+            retryAfter=RetryAfterHints([classifier.retryAfter]))
+
+    @param retryable: an iterable of exception types to retry.
+    @param fatal: an iterable of exception types not to retry.
+    @param predicates: an iterable of (exception type, predicate) pairs.
+        Each predicate is a function of one argument (the exception).
+    @param hints: an iterable of (exception type, hint) pairs. Each hint
+        is a function of one argument (the exception) returning a delay in
+        seconds, or C{None} if the exception carries no hint.
+    @param default: the decision, C{RETRY} or C{FAIL}, for exceptions no
+        rule applies to.
+    """
+    def __init__(self, retryable=(), fatal=(), predicates=(), default=FAIL,
+                 hints=()):
+        assert default in (RETRY, FAIL)
+        self._decisions = {}
+        for excType in retryable:
+            self._decisions[excType] = RETRY
+        for excType in fatal:
+            self._decisions[excType] = FAIL
+        self._predicates = {}
+        for excType, predicate in predicates:
+            self._predicates.setdefault(excType, []).append(predicate)
+        self._hints = {}
+        for excType, hint in hints:
+            self._hints.setdefault(excType, []).append(hint)
+        self._default = default
+        self._cache = {}
+        self._hintCache = {}
+
+    def _compile(self, excType):
+        """
+        Work out how to classify exceptions of a given type.
+
+        @param excType: an exception type.
+        @return: C{RETRY} or C{FAIL} if the type alone decides, else a
+            C{tuple} of (predicates, fallback decision).
+        """
+        decision = None
+        predicates = []
+        for cls in getattr(excType, '__mro__', (excType,)):
+            predicates.extend(self._predicates.get(cls, ()))
+            if decision is None:
+                decision = self._decisions.get(cls)
+        if decision is None:
+            decision = self._default
+        if predicates:
+            return (tuple(predicates), decision)
+        return decision
+
+    def _compileHints(self, excType):
+        """
+        Work out which hint rules apply to a type.
+
+        @param excType: an exception type.
+        @return: a C{tuple} of hint functions, most specific type first.
+        """
+        hints = []
+        for cls in getattr(excType, '__mro__', (excType,)):
+            hints.extend(self._hints.get(cls, ()))
+        return tuple(hints)
+
+    def classify(self, fail):
+        """
+        Decide whether to retry after a failure.
+
+        @param fail: a C{Failure}.
+        @return: C{RETRY} or C{FAIL}.
+        """
+        excType = fail.type
+        try:
+            decision = self._cache[excType]
+        except KeyError:
+            decision = self._cache[excType] = self._compile(excType)
+        if decision is RETRY or decision is FAIL:
+            return decision
+        predicates, decision = decision
+        value = fail.value
+        for predicate in predicates:
+            verdict = predicate(value)
+            if verdict is not None:
+                return RETRY if verdict else FAIL
+        return decision
+
+    def retryAfter(self, fail):
+        """
+        Find the retry hint (if any) that our hint rules extract from a
+        failure.
+
+        @param fail: a C{Failure}.
+        @return: the first hint (in seconds) found, or C{None}.
+        """
+        excType = fail.type
+        try:
+            hints = self._hintCache[excType]
+        except KeyError:
+            hints = self._hintCache[excType] = self._compileHints(excType)
+        value = fail.value
+        for hint in hints:
+            delay = hint(value)
+            if delay is not None:
+                return delay
+        return None
+
+    def __call__(self, fail):
+        """
+        Test a failure, as a L{RetryingCall} failure tester.
+
+        @param fail: a C{Failure}.
+        @return: C{None} if the call should be retried, else C{fail}.
+        """
+        if self.classify(fail) is RETRY:
+            return None
+        return fail
@@ -0,0 +1,184 @@
+# Copyright 2011 Fluidinfo Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you
+# may not use this file except in compliance with the License.  You
+# may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.  See the License for the specific language governing
+# permissions and limitations under the License.
+
+
+from collections import OrderedDict
+
+from twisted.internet import defer
+from twisted.python import failure
+
+from txretry.retry import RetryingCall, simpleBackoffIterator
+
+
+class CoalescingRetrier(object):
+    """
+    Retry calls of idempotent functions, sharing the work between
+    concurrent callers. While a call of a function with a given set of
+    arguments is being retried, further calls with equal arguments do not
+    start a retry loop of their own but wait for the result of the one in
+    progress. Results can also be kept for a short time in a bounded cache
+    so that callers arriving just after a call completes are answered
+    without calling the function at all.
+
+    Calls whose arguments cannot be hashed are neither coalesced nor
+    cached.
+
+    @ivar calls: the number of calls made.
+    @ivar loops: the number of L{RetryingCall}s started.
+    @ivar coalesced: the number of calls that joined one in progress.
+    @ivar cacheHits: the number of calls answered from the cache.
+    @param backoffIteratorFactory: A function of no arguments that returns
+        a new back-off iterator for each L{RetryingCall}. Default:
+        L{simpleBackoffIterator}.
+    @param failureTester: As for L{RetryingCall.start}.
+    @param ttl: If not C{None}, the number of seconds for which a
+        successful result is cached.
+    @param maxSize: The greatest number of cached results. When it is
+        reached, the least recently used result is evicted.
+    @param cacheFailures: If C{True} (and C{ttl} is not C{None}), failures
+        from calls that gave up are cached too.
+    @param clock: The C{IReactorTime} provider used to expire cached
+        results and passed to each L{RetryingCall}. Default: the reactor.
+    @param startKw: Other keyword arguments to pass to the C{start} method
+        of each L{RetryingCall}.
+    """
+    def __init__(self, backoffIteratorFactory=None, failureTester=None,
+                 ttl=None, maxSize=1000, cacheFailures=False, clock=None,
+                 **startKw):
+        if clock is None:
+            from twisted.internet import reactor as clock
+        self._factory = backoffIteratorFactory or simpleBackoffIterator
+        self._failureTester = failureTester
+        self._ttl = ttl
+        self._maxSize = maxSize
+        self._cacheFailures = cacheFailures
+        self._clock = clock
+        self._startKw = startKw
+        self._inFlight = {}
+        self._cache = OrderedDict()
+        self.calls = 0
+        self.loops = 0
+        self.coalesced = 0
+        self.cacheHits = 0
+
+    def call(self, func, *args, **kw):
+        """
+        Call a function, retrying it as a L{RetryingCall} would, or join a
+        call of it with equal arguments that is already in progress.
+
+        @param func: The function to call.
+        @param args: Positional arguments to pass to the function.
+        @param kw: Keyword arguments to pass to the function.
+        @return: a C{Deferred} that fires with the function result or
+            errbacks with the failure the L{RetryingCall} gave up with.
+            Cancelling it detaches this caller only; the shared call is
+            cancelled once none of its callers are left.
+        @raise Exception: whatever starting a new L{RetryingCall} raises
+            (e.g., a C{TypeError} for bad C{startKw}).
+        """
+        self.calls += 1
+        key = (func, args, tuple(sorted(kw.items())))
+        try:
+            hash(key)
+        except TypeError:
+            return self._start(func, args, kw)
+
+        cached = self._cache.pop(key, None)
+        if cached is not None:
+            expires, success, result = cached
+            if self._clock.seconds() < expires:
+                # Re-insert to mark the entry as the most recently used.
+                self._cache[key] = cached
+                self.cacheHits += 1
+                if success:
+                    return defer.succeed(result)
+                return defer.fail(result)
+
+        entry = self._inFlight.get(key)
+        if entry is not None:
+            self.coalesced += 1
+            d = defer.Deferred(lambda d: self._detach(d, entry))
+            entry[1].append(d)
+            return d
+
+        # The waiter is added before the call is started, in case it gives
+        # up at once (e.g., because a circuit breaker is open).
+        entry = self._inFlight[key] = [None, []]
+        d = defer.Deferred(lambda d: self._detach(d, entry))
+        entry[1].append(d)
+        try:
+            entry[0] = self._start(func, args, kw)
+        except:
+            # Don't leave an entry that later callers would wait on for
+            # ever.
+            del self._inFlight[key]
+            raise
+        entry[0].addBoth(self._finished, key, entry)
+        return d
+
+    def cacheSize(self):
+        """
+        @return: the number of results in the cache (some of which may
+            have expired).
+        """
+        return len(self._cache)
+
+    def _start(self, func, args, kw):
+        """
+        Start a new L{RetryingCall}.
+
+        @return: the C{Deferred} returned by its C{start} method.
+        """
+        self.loops += 1
+        startKw = dict(self._startKw)
+        startKw.setdefault('clock', self._clock)
+        return RetryingCall(func, *args, **kw).start(
+            backoffIterator=self._factory(),
+            failureTester=self._failureTester, **startKw)
+
+    def _finished(self, result, key, entry):
+        """
+        Hand the result of a shared call to each of its waiting callers,
+        and cache it if appropriate.
+        """
+        del self._inFlight[key]
+        success = not isinstance(result, failure.Failure)
+        if self._ttl is not None and (success or (
+                self._cacheFailures and
+                not result.check(defer.CancelledError))):
+            self._store(key, success, result)
+        for d in entry[1]:
+            if success:
+                d.callback(result)
+            else:
+                d.errback(result)
+
+    def _store(self, key, success, result):
+        """
+        Cache a result, evicting the least recently used entries to make
+        room.
+        """
+        while len(self._cache) >= self._maxSize:
+            self._cache.popitem(last=False)
+        self._cache[key] = (self._clock.seconds() + self._ttl, success,
+                            result)
+
+    def _detach(self, d, entry):
+        """
+        Remove a cancelled caller, cancelling the shared call if it was the
+        last one.
+        """
+        entry[1].remove(d)
+        if not entry[1]:
+            entry[0].cancel()
@@ -0,0 +1,204 @@
+# Copyright 2011 Fluidinfo Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you
+# may not use this file except in compliance with the License.  You
+# may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.  See the License for the specific language governing
+# permissions and limitations under the License.
+
+
+from twisted.internet import defer
+from twisted.python import failure
+
+from txretry.retry import _defaultClock, _log, simpleBackoffIterator
+
+
+class BackoffSchedule(object):
+    """
+    A fixed schedule of back-off delays, computed once and shared by any
+    number of calls. A L{CompactRetryingCall} looks its delays up by
+    attempt number, so it does not need a generator of its own. A schedule
+    can also be iterated, so it can be passed as the back-off iterator of
+    a L{RetryingCall}.
+
+    The arguments are as for L{simpleBackoffIterator}, and the schedule
+    has exactly the delays it would yield. Schedules with random jitter
+    cannot be shared in this way; use an iterator for those.
+
+    @ivar delays: a C{tuple} of the delays.
+    """
+    __slots__ = ('delays',)
+
+    def __init__(self, maxResults=10, maxDelay=120.0, now=True,
+                 initDelay=0.01, incFunc=None):
+        self.delays = tuple(simpleBackoffIterator(maxResults, maxDelay, now,
+                                                  initDelay, incFunc))
+
+    def __iter__(self):
+        return iter(self.delays)
+
+    def __len__(self):
+        return len(self.delays)
+
+
+_defaultSchedule = BackoffSchedule()
+
+
+class CompactRetryingCall(object):
+    """
+    A memory-lean version of L{RetryingCall}, for when very many calls are
+    retried at once. It keeps its state in slots, calls its function
+    directly from a delayed call (rather than via a C{Deferred} made by
+    C{deferLater}) and, given a L{BackoffSchedule}, needs no per-call
+    back-off iterator. Its list of failures is only made once a call
+    fails.
+
+    It behaves as a L{RetryingCall} whose C{start} method is passed only a
+    back-off iterator, a failure tester and a clock, and logs the same
+    events. Use L{RetryingCall} for budgets, circuit breakers, deadlines,
+    observers and the other options.
+
+    @ivar clock: a provider of C{IReactorTime} used for scheduling when no
+        clock is passed to C{start}. Default: the reactor.
+    @param func: The function to call.
+    @param args: Positional arguments to pass to the function.
+    @param kw: Keyword arguments to pass to the function.
+    """
+    __slots__ = ('_func', '_args', '_kw', '_failures', '_backoff',
+                 '_attempts', '_failureTester', '_clock', '_deferred',
+                 '_attempt')
+
+    clock = None
+
+    def __init__(self, func, *args, **kw):
+        self._func = func
+        self._args = args
+        self._kw = kw
+        self._failures = None
+
+    @property
+    def failures(self):
+        """
+        The failures received in calling the function.
+        """
+        if self._failures is None:
+            self._failures = []
+        return self._failures
+
+    def start(self, backoffIterator=None, failureTester=None, clock=None):
+        """
+        Start trying and retrying, if needed, a call to the function.
+
+        @param backoffIterator: A L{BackoffSchedule}, or an iterator that
+            produces delay intervals to wait between calls. Default (as
+            for L{RetryingCall}, also used if this is empty): a schedule
+            equal to L{simpleBackoffIterator}C{()}.
+        @param failureTester: As for L{RetryingCall.start}.
+        @param clock: A provider of C{IReactorTime} used for scheduling
+            attempts. Default: C{self.clock}, or the reactor if that is not
+            set.
+        @return: a C{Deferred}, as for L{RetryingCall.start}.
+        """
+        if not backoffIterator:
+            backoffIterator = _defaultSchedule
+        elif not isinstance(backoffIterator, BackoffSchedule):
+            backoffIterator = iter(backoffIterator)
+        self._backoff = backoffIterator
+        self._attempts = 0
+        self._failureTester = failureTester
+        self._clock = clock or self.clock or _defaultClock()
+        self._attempt = None
+        self._deferred = defer.Deferred(self._cancel)
+        self._call()
+        return self._deferred
+
+    def _call(self, fail=None):
+        """
+        After the next delay amount, call our function.
+
+        @param fail: the C{Failure} from the previous attempt if this is a
+            retry, else C{None}.
+        """
+        backoff = self._backoff
+        if isinstance(backoff, BackoffSchedule):
+            delays = backoff.delays
+            delay = (delays[self._attempts] if self._attempts < len(delays)
+                     else None)
+        else:
+            delay = next(backoff, None)
+        if delay is None:
+            _log.info('RetryingCall: ran out of attempts calling '
+                      '{function!r}.', function=self._func,
+                      attempt=self._attempts)
+            self._deferred.errback(self._failures[0] if self._failures
+                                   else failure.Failure(StopIteration()))
+            return
+        self._attempts += 1
+        if fail is not None:
+            _log.info('RetryingCall: retrying {function!r} (attempt '
+                      '{attempt}) in {delay}s after {exceptionType!r}.',
+                      function=self._func, attempt=self._attempts,
+                      delay=delay, exceptionType=fail.type, failure=fail)
+        self._attempt = self._clock.callLater(delay, self._run)
+
+    def _run(self):
+        """
+        Call our function.
+        """
+        d = self._attempt = defer.maybeDeferred(self._func, *self._args,
+                                                **self._kw)
+        d.addCallbacks(self._succeed, self._err)
+
+    def _succeed(self, result):
+        """
+        A callback function for a successful function call.
+        """
+        # A cancelled call has no back-off.
+        if self._backoff is not None:
+            self._deferred.callback(result)
+
+    def _err(self, fail):
+        """
+        An errback function for the function call. See
+        L{RetryingCall._err}.
+        """
+        if self._backoff is None:
+            return
+        self.failures.append(fail)
+        if self._failureTester is None:
+            result = None
+        else:
+            try:
+                result = self._failureTester(fail)
+            except:
+                self._deferred.errback(failure.Failure())
+                return
+        if isinstance(result, failure.Failure):
+            self._deferred.errback(result)
+        else:
+            self._call(fail)
+
+    def _cancel(self, deferred):
+        """
+        Cancel any scheduled or in-flight attempt to call our function. Our
+        deferred will then fail with C{defer.CancelledError}.
+
+        @param deferred: our deferred, which is being cancelled.
+        """
+        close = getattr(self._backoff, 'close', None)
+        if close is not None:
+            close()
+        self._backoff = None
+        attempt = self._attempt
+        if isinstance(attempt, defer.Deferred):
+            if not attempt.called or isinstance(attempt.result,
+                                                defer.Deferred):
+                attempt.cancel()
+        elif attempt is not None and attempt.active():
+            attempt.cancel()
@@ -0,0 +1,173 @@
+# Copyright 2011 Fluidinfo Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you
+# may not use this file except in compliance with the License.  You
+# may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.  See the License for the specific language governing
+# permissions and limitations under the License.
+
+from twisted.internet import defer
+from twisted.python import failure
+
+from txretry.observer import LatencyHistogram
+
+
+class Hedging(object):
+    """
+    A hedging policy for L{RetryingCall} attempts (pass it as the
+    C{hedging} argument to C{start}). If an attempt has not finished after
+    a hedge delay, a duplicate call of the function is made in parallel,
+    and so on up to C{maxHedges} duplicates. The first copy to succeed
+    provides the result of the attempt and the others are cancelled. The
+    attempt fails when every copy launched so far has failed (any
+    remaining duplicates are then not launched).
+
+    The hedge delay is either fixed, or the given C{percentile} of the
+    latency of successful copies seen so far (once C{minSamples} of them
+    have been seen). A single instance can be shared by all calls to the
+    same target, so that they share latency observations and statistics.
+
+    Hedging only makes sense for idempotent functions.
+
+    @ivar attempts: the number of attempts made.
+    @ivar hedged: the number of attempts for which at least one duplicate
+        was launched.
+    @ivar hedges: the total number of duplicates launched.
+    @ivar hedgeWins: the number of attempts whose result came from a
+        duplicate rather than from the original call.
+    @ivar latency: a L{txretry.observer.LatencyHistogram} of the latency of
+        successful copies.
+    @param delay: the hedge delay, in seconds, used when no percentile is
+        given or not enough latencies have been seen.
+    @param maxHedges: the greatest number of duplicates per attempt.
+    @param percentile: if not C{None}, a fraction (e.g., 0.95) giving the
+        latency percentile to use as the hedge delay.
+    @param minSamples: the number of latencies needed before the
+        percentile is used.
+    """
+    def __init__(self, delay=0.1, maxHedges=1, percentile=None,
+                 minSamples=100):
+        assert maxHedges >= 0
+        assert percentile is None or 0.0 < percentile < 1.0
+        self.delay = delay
+        self.maxHedges = maxHedges
+        self.percentile = percentile
+        self.minSamples = minSamples
+        self.attempts = 0
+        self.hedged = 0
+        self.hedges = 0
+        self.hedgeWins = 0
+        self.latency = LatencyHistogram()
+
+    def hedgeDelay(self):
+        """
+        @return: the delay before launching a duplicate call.
+        """
+        if (self.percentile is not None and
+                self.latency.total >= self.minSamples):
+            delay = self.latency.percentile(self.percentile)
+            if delay is not None:
+                return delay
+        return self.delay
+
+    def run(self, clock, func):
+        """
+        Make a hedged attempt to call a function.
+
+        @param clock: a provider of C{IReactorTime}.
+        @param func: a function of no arguments.
+        @return: a C{Deferred} that fires with the first successful result
+            of calling C{func}, or fails with the failure of the last copy
+            to fail. Cancelling it cancels every copy in progress.
+        """
+        return _HedgedAttempt(self, clock, func).deferred
+
+
+class _HedgedAttempt(object):
+    """
+    A single hedged attempt, made according to a L{Hedging} policy.
+    """
+    def __init__(self, policy, clock, func):
+        self._policy = policy
+        self._clock = clock
+        self._func = func
+        self._copies = []
+        self._inProgress = 0
+        self._timer = None
+        self._done = False
+        self.deferred = defer.Deferred(self._cancel)
+        policy.attempts += 1
+        self._launch()
+
+    def _launch(self):
+        """
+        Launch a copy of the call and, if more duplicates are allowed,
+        schedule the next one.
+        """
+        self._timer = None
+        policy = self._policy
+        index = len(self._copies)
+        if index:
+            policy.hedges += 1
+            if index == 1:
+                policy.hedged += 1
+        if index < policy.maxHedges:
+            self._timer = self._clock.callLater(policy.hedgeDelay(),
+                                                self._launch)
+        self._inProgress += 1
+        copy = defer.maybeDeferred(self._func)
+        self._copies.append(copy)
+        copy.addBoth(self._finished, index, self._clock.seconds())
+
+    def _finished(self, result, index, started):
+        """
+        A copy has finished.
+
+        @param result: the result of the copy, or a C{Failure}.
+        @param index: the index of the copy (0 for the original call).
+        @param started: the time at which the copy was launched.
+        """
+        self._inProgress -= 1
+        if self._done:
+            # Another copy has already decided the attempt.
+            return
+        if isinstance(result, failure.Failure):
+            if self._inProgress:
+                # Wait for the other copies.
+                return
+            self._done = True
+            self._stop()
+            self.deferred.errback(result)
+        else:
+            policy = self._policy
+            policy.latency.record(self._clock.seconds() - started)
+            if index:
+                policy.hedgeWins += 1
+            self._done = True
+            self._stop()
+            self.deferred.callback(result)
+
+    def _stop(self):
+        """
+        Cancel the pending hedge timer and all copies still in progress.
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        for copy in self._copies:
+            if not copy.called or isinstance(copy.result, defer.Deferred):
+                copy.cancel()
+
+    def _cancel(self, deferred):
+        """
+        Cancel the attempt.
+
+        @param deferred: our deferred, which is being cancelled.
+        """
+        self._stop()
@@ -0,0 +1,79 @@
+# Copyright 2011 Fluidinfo Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you
+# may not use this file except in compliance with the License.  You
+# may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.  See the License for the specific language governing
+# permissions and limitations under the License.
+
+
+def retryAfterAttribute(fail):
+    """
+    Extract a retry hint from the C{retryAfter} attribute of a failure's
+    exception, if it has one. Exceptions that carry a server's suggested
+    wait (e.g., from an HTTP C{Retry-After} header or a throttling error)
+    can provide this attribute to have it honored.
+
+    @param fail: a C{Failure}.
+    @return: the hinted delay in seconds, or C{None}.
+    """
+    return getattr(fail.value, 'retryAfter', None)
+
+
+class RetryAfterHints(object):
+    """
+    Let failures adjust the delay before the next attempt of a
+    L{RetryingCall} (pass an instance as the C{retryAfter} argument to
+    C{start}). Each extractor is asked in turn for a hint, and the first
+    hint found is capped at C{maxDelay} and then either raises the delay
+    from the back-off iterator to at least the hint, or (if C{override} is
+    C{True}) replaces it.
+
+    @ivar seen: the number of failures that carried a hint.
+    @ivar used: the number of hints that changed the delay.
+    @ivar capped: the number of hints that were larger than C{maxDelay}.
+    @param extractors: an iterable of functions of one argument (a
+        C{Failure}) returning a delay in seconds, or C{None} if the failure
+        carries no hint. Default: L{retryAfterAttribute} alone.
+    @param maxDelay: the largest delay a hint may cause.
+    @param override: if C{True} a hint replaces the back-off delay, even if
+        it is shorter. Otherwise it can only lengthen it.
+    """
+    def __init__(self, extractors=None, maxDelay=300.0, override=False):
+        if extractors is None:
+            extractors = (retryAfterAttribute,)
+        self._extractors = tuple(extractors)
+        self.maxDelay = maxDelay
+        self.override = override
+        self.seen = 0
+        self.used = 0
+        self.capped = 0
+
+    def adjust(self, fail, delay):
+        """
+        Adjust a delay according to the hint (if any) carried by a failure.
+
+        @param fail: the C{Failure} from the previous attempt.
+        @param delay: the delay from the back-off iterator.
+        @return: the delay to use.
+        """
+        for extractor in self._extractors:
+            hint = extractor(fail)
+            if hint is not None:
+                break
+        else:
+            return delay
+        self.seen += 1
+        if hint > self.maxDelay:
+            self.capped += 1
+            hint = self.maxDelay
+        if hint > delay or (self.override and hint != delay):
+            self.used += 1
+            return hint
+        return delay
@@ -0,0 +1,92 @@
+# Copyright 2011 Fluidinfo Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you
+# may not use this file except in compliance with the License.  You
+# may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.  See the License for the specific language governing
+# permissions and limitations under the License.
+
+from collections import deque
+from itertools import chain, islice
+
+
+class FailureHistory(object):
+    """
+    A bounded record of the failures encountered by a L{RetryingCall}. The
+    first failure (which is the one a retrying call fails with when it
+    gives up) and the C{keepLast} most recent failures are retained, each
+    with its traceback frames cleaned (see C{Failure.cleanFailure}) so that
+    no stack frames are kept alive. Every failure is counted, by exception
+    type.
+
+    This can be used in place of the (unbounded) list of failures that a
+    L{RetryingCall} normally keeps. Like that list, it can be tested for
+    truth, indexed, iterated over (oldest first) and has a length (the
+    number of retained failures).
+
+    @ivar total: the total number of failures recorded.
+    @ivar counts: a C{dict} mapping exception types to the number of
+        failures of that type recorded.
+    @param keepLast: the number of most recent failures to retain, in
+        addition to the first.
+    """
+    def __init__(self, keepLast=1):
+        assert keepLast >= 0
+        self.total = 0
+        self.counts = {}
+        self._first = None
+        self._recent = deque(maxlen=keepLast)
+
+    def append(self, fail):
+        """
+        Record a failure.
+
+        @param fail: a C{Failure}.
+        """
+        fail.cleanFailure()
+        self.total += 1
+        self.counts[fail.type] = self.counts.get(fail.type, 0) + 1
+        if self._first is None:
+            self._first = fail
+        else:
+            self._recent.append(fail)
+
+    def __len__(self):
+        """
+        @return: the number of retained failures.
+        """
+        if self._first is None:
+            return 0
+        return 1 + len(self._recent)
+
+    def __iter__(self):
+        """
+        @return: an iterator over the retained failures, oldest first.
+        """
+        if self._first is None:
+            return iter(())
+        return chain((self._first,), self._recent)
+
+    def __getitem__(self, index):
+        """
+        Get a retained failure (or a list of them, given a slice).
+
+        @param index: an C{int} or a C{slice}.
+        @raise IndexError: if there is no retained failure at C{index}.
+        @return: a C{Failure} or a C{list} of them.
+        """
+        if isinstance(index, slice):
+            return list(self)[index]
+        if index < 0:
+            index += len(self)
+        if index < 0:
+            raise IndexError(index)
+        for fail in islice(self, index, None):
+            return fail
+        raise IndexError(index)
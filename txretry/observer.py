@@ -0,0 +1,264 @@
+# Copyright 2011 Fluidinfo Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you
+# may not use this file except in compliance with the License.  You
+# may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.  See the License for the specific language governing
+# permissions and limitations under the License.
+
+from bisect import bisect_left
+
+# Upper bounds (in seconds) of the buckets used by LatencyHistogram.
+DEFAULT_BOUNDS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                  1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+class RetryObserver(object):
+    """
+    A base class for objects that are told what a L{RetryingCall} is
+    doing. Pass an instance as the C{observer} argument to the C{start}
+    method of a L{RetryingCall}. Every method does nothing, so subclasses
+    need only implement those they are interested in.
+
+    Attempts are numbered from one. Times are in seconds, measured with the
+    clock of the retrying call.
+    """
+    def attemptStarted(self, func, attempt):
+        """
+        An attempt to call C{func} is being made.
+
+        @param func: the function being retried.
+        @param attempt: the attempt number.
+        """
+
+    def attemptFailed(self, func, attempt, fail, latency):
+        """
+        An attempt to call C{func} failed.
+
+        @param func: the function being retried.
+        @param attempt: the attempt number.
+        @param fail: the C{Failure}.
+        @param latency: the duration of the attempt.
+        """
+
+    def retryScheduled(self, func, attempt, delay):
+        """
+        Another attempt to call C{func} has been scheduled.
+
+        @param func: the function being retried.
+        @param attempt: the number of the scheduled attempt.
+        @param delay: the delay before the attempt will be made.
+        """
+
+    def succeeded(self, func, attempt, latency, elapsed):
+        """
+        An attempt to call C{func} succeeded.
+
+        @param func: the function being retried.
+        @param attempt: the number of the successful attempt.
+        @param latency: the duration of the successful attempt.
+        @param elapsed: the time since the retrying call was started.
+        """
+
+    def gaveUp(self, func, attempt, fail, elapsed):
+        """
+        The retrying call gave up (or was cancelled).
+
+        @param func: the function being retried.
+        @param attempt: the number of the last attempt scheduled.
+        @param fail: the C{Failure} the retrying call is failing with.
+        @param elapsed: the time since the retrying call was started.
+        """
+
+
+class ObserverGroup(RetryObserver):
+    """
+    A L{RetryObserver} that passes everything it is told on to each of a
+    group of observers, in order. Use one to give a L{RetryingCall} more
+    than one observer.
+
+    @ivar observers: a C{tuple} of the observers in the group.
+    @param observers: an iterable of L{RetryObserver}s.
+    """
+    def __init__(self, observers):
+        self.observers = tuple(observers)
+
+    def attemptStarted(self, func, attempt):
+        """See L{RetryObserver.attemptStarted}."""
+        for observer in self.observers:
+            observer.attemptStarted(func, attempt)
+
+    def attemptFailed(self, func, attempt, fail, latency):
+        """See L{RetryObserver.attemptFailed}."""
+        for observer in self.observers:
+            observer.attemptFailed(func, attempt, fail, latency)
+
+    def retryScheduled(self, func, attempt, delay):
+        """See L{RetryObserver.retryScheduled}."""
+        for observer in self.observers:
+            observer.retryScheduled(func, attempt, delay)
+
+    def succeeded(self, func, attempt, latency, elapsed):
+        """See L{RetryObserver.succeeded}."""
+        for observer in self.observers:
+            observer.succeeded(func, attempt, latency, elapsed)
+
+    def gaveUp(self, func, attempt, fail, elapsed):
+        """See L{RetryObserver.gaveUp}."""
+        for observer in self.observers:
+            observer.gaveUp(func, attempt, fail, elapsed)
+
+
+class LatencyHistogram(object):
+    """
+    Count durations in buckets.
+
+    @ivar bounds: the upper bounds of the buckets (a final bucket holds
+        everything larger than the last bound).
+    @ivar counts: a C{list} of the number of durations in each bucket.
+    @ivar total: the number of durations recorded.
+    @ivar sum: the sum of the durations recorded.
+    @param bounds: an ascending sequence of bucket upper bounds.
+    """
+    def __init__(self, bounds=DEFAULT_BOUNDS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0
+        self.sum = 0.0
+
+    def record(self, duration):
+        """
+        Record a duration.
+
+        @param duration: the duration, in seconds.
+        """
+        self.counts[bisect_left(self.bounds, duration)] += 1
+        self.total += 1
+        self.sum += duration
+
+    def percentile(self, fraction):
+        """
+        Estimate a percentile.
+
+        @param fraction: the percentile wanted, between 0 and 1.
+        @return: the upper bound of the bucket holding the percentile (or
+            C{None} if it lies in the final, unbounded, bucket or nothing
+            has been recorded).
+        """
+        if not self.total:
+            return None
+        wanted = fraction * self.total
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= wanted:
+                return bound
+        return None
+
+
+class FunctionRetryStats(object):
+    """
+    Counters and latency histograms for the retrying calls of a single
+    function.
+
+    @ivar attempts: the number of attempts started.
+    @ivar failures: the number of failed attempts.
+    @ivar retries: the number of retries scheduled.
+    @ivar successes: the number of retrying calls that succeeded.
+    @ivar giveUps: the number of retrying calls that gave up.
+    @ivar backoff: the total time spent waiting between attempts.
+    @ivar exceptions: a C{dict} mapping exception types to the number of
+        failed attempts they caused.
+    @ivar attemptLatency: a L{LatencyHistogram} of attempt durations.
+    @ivar callLatency: a L{LatencyHistogram} of the time taken by
+        retrying calls (successful or not).
+    """
+    def __init__(self, bounds=DEFAULT_BOUNDS):
+        self.attempts = 0
+        self.failures = 0
+        self.retries = 0
+        self.successes = 0
+        self.giveUps = 0
+        self.backoff = 0.0
+        self.exceptions = {}
+        self.attemptLatency = LatencyHistogram(bounds)
+        self.callLatency = LatencyHistogram(bounds)
+
+
+class RetryStats(RetryObserver):
+    """
+    A L{RetryObserver} that aggregates, in memory, what happens to all the
+    retrying calls it observes, per function.
+
+    @param bounds: the bucket bounds to use for latency histograms.
+    """
+    def __init__(self, bounds=DEFAULT_BOUNDS):
+        self._bounds = bounds
+        self._stats = {}
+
+    def forFunction(self, func):
+        """
+        Get the statistics for a function.
+
+        @param func: a function.
+        @return: the L{FunctionRetryStats} for C{func}.
+        """
+        try:
+            return self._stats[func]
+        except KeyError:
+            stats = self._stats[func] = FunctionRetryStats(self._bounds)
+            return stats
+
+    def functions(self):
+        """
+        @return: a C{list} of the functions that have been observed.
+        """
+        return list(self._stats)
+
+    def attemptStarted(self, func, attempt):
+        """Count an attempt. See L{RetryObserver.attemptStarted}."""
+        self.forFunction(func).attempts += 1
+
+    def attemptFailed(self, func, attempt, fail, latency):
+        """
+        Count a failed attempt and its exception type, and record its
+        latency. See L{RetryObserver.attemptFailed}.
+        """
+        stats = self.forFunction(func)
+        stats.failures += 1
+        stats.exceptions[fail.type] = stats.exceptions.get(fail.type, 0) + 1
+        stats.attemptLatency.record(latency)
+
+    def retryScheduled(self, func, attempt, delay):
+        """
+        Count a retry and add its delay to the back-off total. See
+        L{RetryObserver.retryScheduled}.
+        """
+        stats = self.forFunction(func)
+        stats.retries += 1
+        stats.backoff += delay
+
+    def succeeded(self, func, attempt, latency, elapsed):
+        """
+        Count a success and record the latencies of its attempt and of the
+        whole call. See L{RetryObserver.succeeded}.
+        """
+        stats = self.forFunction(func)
+        stats.successes += 1
+        stats.attemptLatency.record(latency)
+        stats.callLatency.record(elapsed)
+
+    def gaveUp(self, func, attempt, fail, elapsed):
+        """
+        Count a give-up and record the latency of the whole call. See
+        L{RetryObserver.gaveUp}.
+        """
+        stats = self.forFunction(func)
+        stats.giveUps += 1
+        stats.callLatency.record(elapsed)
@@ -0,0 +1,379 @@
+# Copyright 2011 Fluidinfo Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you
+# may not use this file except in compliance with the License.  You
+# may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.  See the License for the specific language governing
+# permissions and limitations under the License.
+
+
+import json
+import sqlite3
+
+from twisted.internet import defer
+from twisted.logger import Logger
+from twisted.python import failure
+
+from txretry.compact import BackoffSchedule
+from txretry.retry import _defaultClock, _retryAll
+
+_log = Logger()
+
+
+class SQLiteRetryStore(object):
+    """
+    A durable store of pending retries, kept in an SQLite database and
+    indexed by the time each retry is due. Changes are committed (and so
+    synced to disk) in batches: when C{batchSize} changes have been made,
+    or when L{flush} is called.
+
+    Each retry is stored as a function name, its arguments (which must be
+    serializable as JSON), the index of its next attempt and the time that
+    attempt is due.
+
+    All database access, including each commit (which, with SQLite's
+    C{synchronous = FULL}, waits for an fsync), happens in the calling
+    thread, so when used from the reactor thread every flush blocks the
+    reactor for the duration of one fsync. Batching keeps the number of
+    flushes down; choose C{batchSize} (and the queue's C{flushInterval})
+    with this in mind, or put the database on fast storage.
+
+    @ivar unflushed: the number of changes not yet committed.
+    @ivar flushes: the number of commits made.
+    @param path: the path of the database file.
+    @param batchSize: the number of changes after which to commit.
+    """
+    def __init__(self, path, batchSize=100):
+        self._db = sqlite3.connect(path)
+        self._db.execute('PRAGMA synchronous = FULL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS retries ('
+                         'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                         'function TEXT NOT NULL, arguments TEXT NOT NULL, '
+                         'attempt INTEGER NOT NULL, due REAL NOT NULL)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS retriesByDue '
+                         'ON retries (due)')
+        self._db.commit()
+        self.batchSize = batchSize
+        self.unflushed = 0
+        self.flushes = 0
+
+    def add(self, function, args, kw, attempt, due):
+        """
+        Store a new pending retry.
+
+        @param function: the name of the function to call.
+        @param args: a C{tuple} of positional arguments.
+        @param kw: a C{dict} of keyword arguments.
+        @param attempt: the index of the next attempt.
+        @param due: the time the next attempt is due.
+        @return: the C{int} identifier of the retry.
+        """
+        cursor = self._db.execute(
+            'INSERT INTO retries (function, arguments, attempt, due) '
+            'VALUES (?, ?, ?, ?)',
+            (function, json.dumps([list(args), kw]), attempt, due))
+        self._changed()
+        return cursor.lastrowid
+
+    def update(self, retryId, attempt, due):
+        """
+        Record the next attempt of a pending retry.
+
+        @param retryId: the identifier of the retry.
+        @param attempt: the index of the next attempt.
+        @param due: the time the next attempt is due.
+        """
+        self._db.execute('UPDATE retries SET attempt = ?, due = ? '
+                         'WHERE id = ?', (attempt, due, retryId))
+        self._changed()
+
+    def remove(self, retryId):
+        """
+        Remove a retry that has succeeded or been given up.
+
+        @param retryId: the identifier of the retry.
+        """
+        self._db.execute('DELETE FROM retries WHERE id = ?', (retryId,))
+        self._changed()
+
+    def pending(self):
+        """
+        Get all the stored retries (including any changes not yet flushed),
+        in the order they are due.
+
+        @return: an iterator of (identifier, function name, positional
+            arguments, keyword arguments, attempt index, due time) tuples.
+        """
+        for retryId, function, arguments, attempt, due in self._db.execute(
+                'SELECT id, function, arguments, attempt, due FROM retries '
+                'ORDER BY due'):
+            args, kw = json.loads(arguments)
+            yield retryId, function, tuple(args), kw, attempt, due
+
+    def flush(self):
+        """
+        Commit any outstanding changes.
+        """
+        if self.unflushed:
+            self._db.commit()
+            self.unflushed = 0
+            self.flushes += 1
+
+    def close(self):
+        """
+        Flush outstanding changes and close the database.
+        """
+        self.flush()
+        self._db.close()
+
+    def _changed(self):
+        """
+        Count a change, and flush if a batch is complete.
+        """
+        self.unflushed += 1
+        if self.unflushed >= self.batchSize:
+            self.flush()
+
+
+class _PendingRetry(object):
+    """
+    The in-memory state of one retry in a L{PersistentRetryQueue}.
+    """
+    __slots__ = ('retryId', 'function', 'args', 'kw', 'attempt',
+                 'call', 'deferred', 'firstFailure')
+
+    def __init__(self, retryId, function, args, kw, attempt, deferred):
+        self.retryId = retryId
+        self.function = function
+        self.args = args
+        self.kw = kw
+        self.attempt = attempt
+        self.call = None
+        self.deferred = deferred
+        self.firstFailure = None
+
+
+class PersistentRetryQueue(object):
+    """
+    Retry calls of registered functions, recording each pending retry in a
+    durable store so that it survives a restart of the process. After a
+    restart, register the same functions and call L{resume} to reschedule
+    the stored retries.
+
+    Because an attempt can be made again after a restart, the functions
+    should be idempotent. Their arguments must be serializable as JSON.
+
+    The delay before each attempt is looked up by attempt number in a
+    L{txretry.compact.BackoffSchedule}, so no iterator state needs to be
+    stored. Store changes are flushed at least every C{flushInterval}
+    seconds. A retry that is due at a given time may be lost if the
+    process stops within C{flushInterval} of it being stored.
+
+    @param store: a L{SQLiteRetryStore}.
+    @param schedule: a L{txretry.compact.BackoffSchedule}. Default:
+        C{BackoffSchedule()}.
+    @param failureTester: As for L{RetryingCall.start}.
+    @param flushInterval: the longest time, in seconds, that changes are
+        left unflushed.
+    @param onResult: An optional function of five arguments (the function
+        name, positional arguments, keyword arguments, a C{bool} success
+        flag and the result or C{Failure}) called as each call completes.
+        This is the only way to learn the outcome of resumed calls.
+    @param clock: A provider of C{IReactorTime} whose C{seconds} gives the
+        wall-clock time. Default: the reactor.
+    """
+    def __init__(self, store, schedule=None, failureTester=None,
+                 flushInterval=1.0, onResult=None, clock=None):
+        self._store = store
+        self._delays = (schedule or BackoffSchedule()).delays
+        self._failureTester = failureTester or _retryAll
+        self._flushInterval = flushInterval
+        self._onResult = onResult
+        self._clock = clock or _defaultClock()
+        self._functions = {}
+        self._pending = {}
+        self._flushTimer = None
+
+    @property
+    def pending(self):
+        """
+        The number of retries scheduled by this queue.
+        """
+        return len(self._pending)
+
+    def register(self, name, func):
+        """
+        Register a function that can be called through the queue.
+
+        @param name: a C{str} name for the function that stays the same
+            across restarts.
+        @param func: the function.
+        """
+        self._functions[name] = func
+
+    def call(self, name, *args, **kw):
+        """
+        Call a registered function, retrying it until it succeeds.
+
+        @param name: the name of a registered function.
+        @param args: Positional arguments to pass to the function.
+        @param kw: Keyword arguments to pass to the function.
+        @raise KeyError: if no function is registered with that name.
+        @return: a C{Deferred} that fires with the result of the function,
+            or fails with the first failure when the schedule runs out or
+            the failure tester says to stop. Cancelling it removes the
+            retry from the store.
+        """
+        if name not in self._functions:
+            raise KeyError(name)
+        delay = self._delays[0]
+        retryId = self._store.add(name, args, kw, 0,
+                                  self._clock.seconds() + delay)
+        retry = _PendingRetry(retryId, name, args, kw, 0, None)
+        retry.deferred = defer.Deferred(lambda d: self._cancel(retry))
+        self._schedule(retry, delay)
+        self._changed()
+        return retry.deferred
+
+    def resume(self):
+        """
+        Schedule all the retries in the store, in the order they are due.
+        Retries that are overdue are made at once. Retries of functions
+        that are not registered are left in the store.
+
+        @return: the number of retries scheduled.
+        """
+        now = self._clock.seconds()
+        count = 0
+        for retryId, name, args, kw, attempt, due in self._store.pending():
+            if retryId in self._pending:
+                continue
+            if name not in self._functions:
+                _log.warn('Not resuming retry of unregistered function '
+                          '{function!r}.', function=name, retryId=retryId)
+                continue
+            retry = _PendingRetry(retryId, name, args, kw, attempt, None)
+            self._schedule(retry, max(0.0, due - now))
+            count += 1
+        return count
+
+    def flush(self):
+        """
+        Flush any outstanding changes to the store.
+        """
+        if self._flushTimer is not None:
+            if self._flushTimer.active():
+                self._flushTimer.cancel()
+            self._flushTimer = None
+        self._store.flush()
+
+    def stop(self):
+        """
+        Stop making attempts, and flush the store. Pending retries stay in
+        the store, to be resumed later. The outcome of any attempt still in
+        progress is ignored, and the C{Deferred}s of unfinished calls do
+        not fire.
+        """
+        for retry in self._pending.values():
+            call = retry.call
+            if not isinstance(call, defer.Deferred) and call.active():
+                call.cancel()
+        self._pending.clear()
+        self.flush()
+
+    def _schedule(self, retry, delay):
+        """
+        Schedule the next attempt of a retry.
+        """
+        self._pending[retry.retryId] = retry
+        retry.call = self._clock.callLater(delay, self._attempt, retry)
+
+    def _attempt(self, retry):
+        """
+        Make an attempt.
+        """
+        d = retry.call = defer.maybeDeferred(
+            self._functions[retry.function], *retry.args, **retry.kw)
+        d.addCallbacks(self._succeeded, self._failed, callbackArgs=(retry,),
+                       errbackArgs=(retry,))
+
+    def _succeeded(self, result, retry):
+        """
+        An attempt succeeded. Remove the retry and report the result.
+        """
+        if self._pending.pop(retry.retryId, None) is not retry:
+            # The queue was stopped or the call cancelled.
+            return
+        self._finish(retry, True, result)
+
+    def _failed(self, fail, retry):
+        """
+        An attempt failed. Schedule the next one, or give up.
+        """
+        if self._pending.get(retry.retryId) is not retry:
+            return
+        if retry.firstFailure is None:
+            retry.firstFailure = fail
+        try:
+            result = self._failureTester(fail)
+        except:
+            result = failure.Failure()
+        retry.attempt += 1
+        if isinstance(result, failure.Failure):
+            del self._pending[retry.retryId]
+            self._finish(retry, False, result)
+        elif retry.attempt >= len(self._delays):
+            del self._pending[retry.retryId]
+            self._finish(retry, False, retry.firstFailure)
+        else:
+            delay = self._delays[retry.attempt]
+            self._store.update(retry.retryId, retry.attempt,
+                               self._clock.seconds() + delay)
+            self._changed()
+            self._schedule(retry, delay)
+
+    def _finish(self, retry, success, result):
+        """
+        Remove a completed retry from the store and report its result.
+        """
+        self._store.remove(retry.retryId)
+        self._changed()
+        if self._onResult is not None:
+            self._onResult(retry.function, retry.args, retry.kw, success,
+                           result)
+        if retry.deferred is not None:
+            if success:
+                retry.deferred.callback(result)
+            else:
+                retry.deferred.errback(result)
+
+    def _cancel(self, retry):
+        """
+        Cancel a call, removing its retry from the store.
+
+        @param retry: the L{_PendingRetry} of the call.
+        """
+        if self._pending.pop(retry.retryId, None) is not retry:
+            return
+        call = retry.call
+        if isinstance(call, defer.Deferred):
+            if not call.called or isinstance(call.result, defer.Deferred):
+                call.cancel()
+        elif call.active():
+            call.cancel()
+        self._store.remove(retry.retryId)
+        self._changed()
+
+    def _changed(self):
+        """
+        Make sure store changes are flushed within the flush interval.
+        """
+        if self._store.unflushed and self._flushTimer is None:
+            self._flushTimer = self._clock.callLater(self._flushInterval,
+                                                     self.flush)
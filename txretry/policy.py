@@ -0,0 +1,110 @@
+# Copyright 2011 Fluidinfo Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you
+# may not use this file except in compliance with the License.  You
+# may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.  See the License for the specific language governing
+# permissions and limitations under the License.
+
+
+from functools import wraps
+
+from txretry.retry import RetryingCall, simpleBackoffIterator, _retryAll
+
+
+class RetryPolicy(object):
+    """
+    An immutable description of how to retry calls: the back-off schedule,
+    the failure tester and any other arguments to L{RetryingCall.start}
+    (limits such as C{deadline} and C{attemptTimeout}, a shared C{budget}
+    or C{circuitBreaker}, and so on). A policy is built once and can then
+    be used for any number of calls, via L{call} or the L{retrying}
+    decorator.
+
+    @param backoffIteratorFactory: A function of no arguments that returns
+        a new back-off iterator for each call. Default:
+        L{simpleBackoffIterator}. If the schedule has no randomness, it is
+        cheapest to compute it once and pass C{partial(iter, delays)}
+        where C{delays} is a C{tuple}.
+    @param failureTester: As for L{RetryingCall.start} (e.g., a
+        L{txretry.classify.FailureClassifier}).
+    @param startKw: Other keyword arguments to pass to
+        L{RetryingCall.start} for every call.
+    @raise TypeError: if C{startKw} includes C{backoffIterator}, which
+        cannot be shared between calls.
+    """
+    __slots__ = ('backoffIteratorFactory', 'failureTester', '_startKw')
+
+    def __init__(self, backoffIteratorFactory=None, failureTester=None,
+                 **startKw):
+        if 'backoffIterator' in startKw:
+            raise TypeError('A RetryPolicy needs a backoffIteratorFactory, '
+                            'not a backoffIterator.')
+        object.__setattr__(self, 'backoffIteratorFactory',
+                           backoffIteratorFactory or simpleBackoffIterator)
+        object.__setattr__(self, 'failureTester', failureTester or _retryAll)
+        object.__setattr__(self, '_startKw', startKw)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('RetryPolicy instances are immutable.')
+
+    def __repr__(self):
+        return '<RetryPolicy %r %r %r>' % (
+            self.backoffIteratorFactory, self.failureTester,
+            sorted(self._startKw.items()))
+
+    def options(self):
+        """
+        @return: a new C{dict} of the other arguments passed to
+            L{RetryingCall.start} by this policy.
+        """
+        return dict(self._startKw)
+
+    def replace(self, **changes):
+        """
+        Make a new policy that differs from this one.
+
+        @param changes: keyword arguments, as for L{RetryPolicy}, to change.
+        @return: a new L{RetryPolicy}.
+        """
+        kw = dict(self._startKw, backoffIteratorFactory=(
+            self.backoffIteratorFactory), failureTester=self.failureTester)
+        kw.update(changes)
+        return RetryPolicy(**kw)
+
+    def call(self, func, *args, **kw):
+        """
+        Call a function, retrying it according to this policy.
+
+        @param func: The function to call.
+        @param args: Positional arguments to pass to the function.
+        @param kw: Keyword arguments to pass to the function.
+        @return: the C{Deferred} returned by L{RetryingCall.start}.
+        """
+        return RetryingCall(func, *args, **kw).start(
+            self.backoffIteratorFactory(), self.failureTester,
+            **self._startKw)
+
+
+def retrying(policy):
+    """
+    Make a decorator for functions whose calls are to be retried according
+    to a policy. Each call of the decorated function makes a
+    L{RetryingCall} and returns the C{Deferred} from its C{start} method.
+
+    @param policy: a L{RetryPolicy}.
+    @return: a decorator.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kw):
+            return policy.call(func, *args, **kw)
+        wrapper.retryPolicy = policy
+        return wrapper
+    return decorator
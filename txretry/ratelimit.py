@@ -0,0 +1,91 @@
+# Copyright 2011 Fluidinfo Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you
+# may not use this file except in compliance with the License.  You
+# may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.  See the License for the specific language governing
+# permissions and limitations under the License.
+
+import random
+
+
+class EventRateLimiter(object):
+    """
+    Allow at most C{maxEvents} events per key in each C{interval} seconds.
+    A L{RetryingCall} given one of these (via the C{logLimiter} argument to
+    its C{start} method) uses its function as the key, so sharing a limiter
+    between calls limits log events per function, while giving each call
+    its own limiter limits them per call.
+
+    @ivar suppressed: a C{dict} mapping keys to the number of events that
+        have been suppressed for them.
+    @param maxEvents: the number of events to allow per key per interval.
+    @param interval: the length of an interval, in seconds.
+    @param clock: a provider of C{IReactorTime}. Default: the reactor.
+    """
+    def __init__(self, maxEvents=10, interval=60.0, clock=None):
+        assert maxEvents > 0
+        if clock is None:
+            from twisted.internet import reactor as clock
+        self.maxEvents = maxEvents
+        self.interval = interval
+        self.clock = clock
+        self.suppressed = {}
+        self._windows = {}
+
+    def allow(self, key):
+        """
+        Ask whether an event for C{key} should be emitted.
+
+        @param key: a hashable key (e.g., a function).
+        @return: C{True} if the event should be emitted, else C{False}.
+        """
+        now = self.clock.seconds()
+        try:
+            windowStart, count = self._windows[key]
+        except KeyError:
+            windowStart, count = now, 0
+        if now - windowStart >= self.interval:
+            windowStart, count = now, 0
+        if count < self.maxEvents:
+            self._windows[key] = (windowStart, count + 1)
+            return True
+        self._windows[key] = (windowStart, count)
+        self.suppressed[key] = self.suppressed.get(key, 0) + 1
+        return False
+
+
+class EventSampler(object):
+    """
+    Allow a random fraction of events. This has the same interface as
+    L{EventRateLimiter}, so either can be given to a L{RetryingCall}.
+
+    @ivar suppressed: a C{dict} mapping keys to the number of events that
+        have been suppressed for them.
+    @param rate: the fraction of events to allow, between 0 and 1.
+    @param randomSource: an object with a C{random} method, such as a
+        C{random.Random} instance. Default: the C{random} module.
+    """
+    def __init__(self, rate=0.01, randomSource=None):
+        assert 0.0 <= rate <= 1.0
+        self.rate = rate
+        self.suppressed = {}
+        self._random = (randomSource or random).random
+
+    def allow(self, key):
+        """
+        Ask whether an event for C{key} should be emitted.
+
+        @param key: a hashable key (e.g., a function).
+        @return: C{True} if the event should be emitted, else C{False}.
+        """
+        if self._random() < self.rate:
+            return True
+        self.suppressed[key] = self.suppressed.get(key, 0) + 1
+        return False
@@ -14,11 +14,38 @@
 
 from operator import mul
 from functools import partial
-import time
+import random
 
 import six
-from twisted.internet import reactor, defer, task
-from twisted.python import log, failure
+from twisted.internet import defer, task
+from twisted.logger import Logger
+from twisted.python import failure
+
+from txretry.circuit import CircuitOpenError
+from txretry.history import FailureHistory
+
+
+_log = Logger()
+
+
+def _defaultClock():
+    """
+    Get the global reactor. It is imported only when first needed, so that
+    importing txretry does not install the default reactor.
+
+    @return: the global reactor.
+    """
+    from twisted.internet import reactor
+    return reactor
+
+
+def _retryAll(fail):
+    """
+    The default failure tester: retry every failure.
+
+    @param fail: a C{Failure}.
+    @return: C{None}.
+    """
 
 
 def simpleBackoffIterator(maxResults=10, maxDelay=120.0, now=True,
@@ -54,6 +81,91 @@ def simpleBackoffIterator(maxResults=10, maxDelay=120.0, now=True,
         remaining -= 1
 
 
+def fullJitterBackoffIterator(maxResults=10, maxDelay=120.0, now=True,
+                              initDelay=0.01, incFunc=None,
+                              randomSource=None):
+    """
+    Return a generator that produces "full jitter" back-off delays: each
+    delay is chosen uniformly between zero and the corresponding delay of
+    a L{simpleBackoffIterator} with the same arguments. Spreading retries
+    out like this stops many calls that failed together from all retrying
+    at the same moments.
+
+    @param maxResults: the maximum number of delays to yield.
+    @param maxDelay: the longest delay (in seconds) to yield.
+    @param now: if C{True}, immediately yield a delay of zero.
+    @param initDelay: the initial (un-jittered) delay.
+    @param incFunc: a function of one argument (the latest un-jittered
+        delay), which returns the next one. Default: double the previous
+        delay.
+    @param randomSource: an object with a C{uniform} method, such as a
+        C{random.Random} instance. Default: the C{random} module.
+    @return: a generator function that yields C{float} delays.
+    """
+    uniform = (randomSource or random).uniform
+    for delay in simpleBackoffIterator(maxResults, maxDelay, now,
+                                       initDelay, incFunc):
+        yield uniform(0.0, delay) if delay else 0.0
+
+
+def equalJitterBackoffIterator(maxResults=10, maxDelay=120.0, now=True,
+                               initDelay=0.01, incFunc=None,
+                               randomSource=None):
+    """
+    Return a generator that produces "equal jitter" back-off delays: each
+    delay is half the corresponding delay of a L{simpleBackoffIterator}
+    with the same arguments, plus a random amount between zero and the
+    other half.
+
+    @param maxResults: the maximum number of delays to yield.
+    @param maxDelay: the longest delay (in seconds) to yield.
+    @param now: if C{True}, immediately yield a delay of zero.
+    @param initDelay: the initial (un-jittered) delay.
+    @param incFunc: a function of one argument (the latest un-jittered
+        delay), which returns the next one. Default: double the previous
+        delay.
+    @param randomSource: an object with a C{uniform} method, such as a
+        C{random.Random} instance. Default: the C{random} module.
+    @return: a generator function that yields C{float} delays.
+    """
+    uniform = (randomSource or random).uniform
+    for delay in simpleBackoffIterator(maxResults, maxDelay, now,
+                                       initDelay, incFunc):
+        half = delay / 2.0
+        yield half + uniform(0.0, half) if delay else 0.0
+
+
+def decorrelatedJitterBackoffIterator(maxResults=10, maxDelay=120.0,
+                                      now=True, initDelay=0.01,
+                                      randomSource=None):
+    """
+    Return a generator that produces "decorrelated jitter" back-off
+    delays: each delay is chosen uniformly between C{initDelay} and three
+    times the previous delay, capped at C{maxDelay}.
+
+    @param maxResults: the maximum number of delays to yield.
+    @param maxDelay: the longest delay (in seconds) to yield.
+    @param now: if C{True}, immediately yield a delay of zero.
+    @param initDelay: the smallest non-zero delay.
+    @param randomSource: an object with a C{uniform} method, such as a
+        C{random.Random} instance. Default: the C{random} module.
+    @return: a generator function that yields C{float} delays.
+    """
+    assert maxResults > 0
+    uniform = (randomSource or random).uniform
+    remaining = maxResults
+    delay = initDelay
+
+    if now:
+        yield 0.0
+        remaining -= 1
+
+    while remaining > 0:
+        delay = min(maxDelay, uniform(initDelay, delay * 3.0))
+        yield delay
+        remaining -= 1
+
+
 class RetryingCall(object):
     """
     Calls a function repeatedly, passing it args and kw args. Failures are
@@ -65,16 +177,25 @@ class RetryingCall(object):
     result can be obtained before the delay backoff iterator raises
     StopIteration.
 
-    @ival failures: a list of failures received in calling the function.
+    @ivar failures: a list of failures received in calling the function
+        (or a L{txretry.history.FailureHistory} if C{start} was passed
+        C{keepFailures}).
+    @ivar clock: a provider of C{IReactorTime} used for scheduling and
+        timing when no clock is passed to C{start}. Default: the reactor.
+    @ivar stormDetector: a L{txretry.storm.StormDetector} used when none is
+        passed to C{start}. Set this on the class to watch for retry storms
+        across the whole process. Default: C{None}.
     @param func: The function to call.
     @param args: Positional arguments to pass to the function.
     @param kw: Keyword arguments to pass to the function.
     """
+    clock = None
+    stormDetector = None
+
     def __init__(self, func, *args, **kw):
         self._func = func
         self._args = args
         self._kw = kw
-        self._start = time.time()
         self.failures = []
 
     def _err(self, fail):
@@ -82,38 +203,253 @@ class RetryingCall(object):
 
         If calling the failure tester raises an error or if the failure
         tester returns a failure, trigger our deferred with the failure.
-        Otherwise, arrange for our function to be called again.
+        Otherwise (or if our attempt timeout expired), arrange for our function
+        to be called again.
         """
+        if self._cancelled:
+            return
         self.failures.append(fail)
-        try:
-            result = self._failureTester(fail)
-        except:
-            self._deferred.errback()
+        if self._circuitBreaker is not None:
+            self._circuitBreaker.recordFailure()
+        if self._stormDetector is not None:
+            self._stormDetector.recordFailure()
+        if self._observer is not None:
+            self._observer.attemptFailed(
+                self._func, self._attempts, fail,
+                self._clock.seconds() - self._attemptStart)
+        if self._attemptTimedOut and fail.check(defer.TimeoutError):
+            # Our attemptTimeout expired. That is always worth a retry.
+            result = None
         else:
-            if isinstance(result, failure.Failure):
-                # The failure tester returned a failure. We're done.
-                # Give the failure to our deferred.
-                self._deferred.errback(result)
-            else:
-                # Schedule another call.
-                log.msg('RetryingCall: Ignoring failure %s' % (fail,))
-                self._call()
+            try:
+                result = self._failureTester(fail)
+            except:
+                self._giveUp(failure.Failure())
+                return
+        if isinstance(result, failure.Failure):
+            # The failure tester returned a failure. We're done.
+            # Give the failure to our deferred.
+            self._giveUp(result)
+        else:
+            # Schedule another call.
+            self._call(fail)
 
-    def _call(self):
+    def _succeed(self, result):
+        """A callback function for a successful function call.
+
+        Credit our retry budget and circuit breaker (if any) and fire our
+        deferred with the result.
+        """
+        if self._cancelled:
+            return
+        if self._budget is not None:
+            self._budget.deposit()
+        if self._circuitBreaker is not None:
+            self._circuitBreaker.recordSuccess()
+        if self._stormDetector is not None:
+            self._stormDetector.recordSuccess()
+        if self._observer is not None:
+            now = self._clock.seconds()
+            self._observer.succeeded(self._func, self._attempts,
+                                     now - self._attemptStart,
+                                     now - self._start)
+        self._deferred.callback(result)
+
+    def _giveUp(self, fail):
+        """
+        Stop trying, and fail our deferred.
+
+        @param fail: the C{Failure} to fail our deferred with.
+        """
+        if self._observer is not None:
+            self._observer.gaveUp(self._func, self._attempts, fail,
+                                  self._clock.seconds() - self._start)
+        self._deferred.errback(fail)
+
+    def _call(self, fail=None):
         """
         After the next delay amount, call our function.
+
+        @param fail: the C{Failure} from the previous attempt if this is a
+            retry, else C{None}.
         """
         try:
             delay = six.next(self._backoffIterator)
         except StopIteration:
-            log.msg('StopIteration in RetryingCall: ran out of attempts.')
-            self._deferred.errback(self.failures[0] if self.failures else None)
+            self._logEvent('RetryingCall: ran out of attempts calling '
+                           '{function!r}.', attempt=self._attempts)
+            self._giveUp(self.failures[0] if self.failures
+                         else failure.Failure())
+        else:
+            if fail is not None and self._retryAfter is not None:
+                delay = self._retryAfter.adjust(fail, delay)
+            if fail is not None and self._stormDetector is not None:
+                if self._stormDetector.shouldShed(self._attempts + 1):
+                    self._logEvent('RetryingCall: shedding retry of '
+                                   '{function!r} during a retry storm.',
+                                   attempt=self._attempts)
+                    self._giveUp(self.failures[0])
+                    return
+                delay = self._stormDetector.stretch(delay)
+            if (self._deadline is not None and
+                    self._clock.seconds() + delay > self._start +
+                    self._deadline):
+                self._logEvent('RetryingCall: next attempt at {function!r} '
+                               'would pass deadline.',
+                               attempt=self._attempts, delay=delay)
+                self._giveUp(self.failures[0] if self.failures
+                             else failure.Failure(defer.TimeoutError()))
+                return
+            # Consulted only once nothing else can stop the attempt, as a
+            # half-open breaker counts each call it allows as a probe.
+            if (self._circuitBreaker is not None and
+                    not self._circuitBreaker.allowRequest()):
+                self._logEvent('RetryingCall: circuit breaker is open for '
+                               '{function!r}.', attempt=self._attempts)
+                self._giveUp(failure.Failure(CircuitOpenError()))
+                return
+            if (fail is not None and self._budget is not None and
+                    not self._budget.withdraw()):
+                # The shared retry budget is exhausted. Fail fast.
+                self._logEvent('RetryingCall: retry budget exhausted '
+                               'calling {function!r}.',
+                               attempt=self._attempts)
+                if self._circuitBreaker is not None:
+                    self._circuitBreaker.cancelRequest()
+                self._giveUp(self.failures[0])
+                return
+            self._attempts += 1
+            if fail is not None:
+                self._logEvent('RetryingCall: retrying {function!r} (attempt '
+                               '{attempt}) in {delay}s after '
+                               '{exceptionType!r}.', attempt=self._attempts,
+                               delay=delay, exceptionType=fail.type,
+                               failure=fail)
+                if self._observer is not None:
+                    self._observer.retryScheduled(self._func, self._attempts,
+                                                  delay)
+            if self._scheduler is not None:
+                d = self._later(delay, self._scheduler.run, self._attempts,
+                                self._wrappedCall)
+            elif (self._attemptTimeout is None and self._observer is None and
+                  self._hedging is None):
+                d = self._later(delay, self._func, *self._args, **self._kw)
+            else:
+                d = self._later(delay, self._wrappedCall)
+            if self._stormDetector is not None:
+                # Counted once scheduled, so that if this attempt starts a
+                # storm, it is stretched too.
+                self._stormDetector.recordAttempt(fail is not None)
+            self._attempt = d
+            d.addCallbacks(self._succeed, self._err)
+
+    def _logEvent(self, format, **kw):
+        """
+        Emit a log event about our function, unless our log limiter (if
+        any) suppresses it.
+
+        @param format: the format string of the event.
+        @param kw: other fields of the event.
+        """
+        if self._logLimiter is None or self._logLimiter.allow(self._func):
+            _log.info(format, function=self._func, **kw)
+
+    def _later(self, delay, func, *args, **kw):
+        """
+        Call a function after a delay, as C{task.deferLater} does on our
+        clock. If we have a storm detector, the delayed call is handed to
+        it, so that its delay can be stretched (though not past our
+        deadline) if a storm begins while it waits.
+
+        @return: a C{Deferred} that fires with the result of the call.
+            Cancelling it cancels the delayed call.
+        """
+        if self._stormDetector is None:
+            return task.deferLater(self._clock, delay, func, *args, **kw)
+        d = defer.Deferred(lambda d: call.cancel())
+        d.addCallback(lambda _: func(*args, **kw))
+        call = self._clock.callLater(delay, d.callback, None)
+        if self._deadline is None:
+            self._stormDetector.track(call, self._clock)
         else:
-            d = task.deferLater(reactor, delay,
-                                self._func, *self._args, **self._kw)
-            d.addCallbacks(self._deferred.callback, self._err)
+            self._stormDetector.track(call, self._clock,
+                                      self._start + self._deadline)
+        return d
+
+    def _wrappedCall(self):
+        """
+        Call our function (hedging the call, if we have a hedging policy),
+        telling our observer (if any) that an attempt has started, and
+        cancelling the attempt (so that it fails with
+        C{defer.TimeoutError}) if it does not finish within
+        C{self._attemptTimeout} seconds (if set).
+
+        @return: a C{Deferred} that fires with the result of the attempt.
+        """
+        if self._observer is not None:
+            self._attemptStart = self._clock.seconds()
+            self._observer.attemptStarted(self._func, self._attempts)
+        self._attemptTimedOut = False
+        if self._hedging is None:
+            d = defer.maybeDeferred(self._func, *self._args, **self._kw)
+        else:
+            d = self._hedging.run(self._clock, partial(self._func,
+                                                       *self._args,
+                                                       **self._kw))
+        if self._attemptTimeout is not None:
+            d.addTimeout(self._attemptTimeout, self._clock,
+                         onTimeoutCancel=self._timedOut)
+        return d
+
+    def _timedOut(self, result, timeout):
+        """
+        Turn the cancellation of an attempt that took longer than
+        C{self._attemptTimeout} into a C{defer.TimeoutError}, noting that
+        it came from our timeout rather than from the function.
+
+        @param result: the result of the cancelled attempt.
+        @param timeout: the number of seconds the attempt was allowed.
+        @raise defer.TimeoutError: if the attempt was cancelled.
+        @return: C{result}, if the attempt was not cancelled.
+        """
+        if (isinstance(result, failure.Failure) and
+                result.check(defer.CancelledError)):
+            self._attemptTimedOut = True
+            raise defer.TimeoutError(timeout, 'Deferred')
+        return result
+
+    def _cancel(self, deferred):
+        """
+        Cancel our deferred, along with any scheduled or in-flight attempt to
+        call our function. The deferred will then fail with
+        C{defer.CancelledError}.
+
+        @param deferred: our deferred, which is being cancelled.
+        """
+        self._cancelled = True
+        close = getattr(self._backoffIterator, 'close', None)
+        if close is not None:
+            close()
+        attempt = self._attempt
+        # An attempt is outstanding if its delay has not yet elapsed, or if
+        # it is waiting on a deferred returned by our function.
+        if attempt is not None and (not attempt.called or
+                                    isinstance(attempt.result,
+                                               defer.Deferred)):
+            if self._circuitBreaker is not None:
+                self._circuitBreaker.cancelRequest()
+            attempt.cancel()
+        if self._observer is not None:
+            self._observer.gaveUp(
+                self._func, self._attempts,
+                failure.Failure(defer.CancelledError()),
+                self._clock.seconds() - self._start)
 
-    def start(self, backoffIterator=None, failureTester=None):
+    def start(self, backoffIterator=None, failureTester=None, budget=None,
+              circuitBreaker=None, deadline=None, attemptTimeout=None,
+              clock=None, keepFailures=None, logLimiter=None,
+              observer=None, scheduler=None, hedging=None,
+              retryAfter=None, stormDetector=None):
         """
         Start trying and retrying, if needed, a call to the self._func
         function.
@@ -123,13 +459,82 @@ class RetryingCall(object):
         @param failureTester: A function of one
             argument (a C{failure.Failure}) that we can use to check
             whether a failed call should be retried.
+        @param budget: An optional L{txretry.budget.RetryBudget} (possibly
+            shared with other L{RetryingCall} instances) that must allow
+            each retry. If the budget denies a retry, the returned
+            C{Deferred} fails immediately with the first failure.
+        @param circuitBreaker: An optional
+            L{txretry.circuit.CircuitBreaker} (normally shared by all calls
+            to the same target) that is told the outcome of every attempt.
+            If the breaker refuses an attempt, the function is not called
+            and the returned C{Deferred} fails immediately with
+            L{txretry.circuit.CircuitOpenError}.
+        @param deadline: An optional number of seconds after which no new
+            attempt may be made. If the next delay would take us past the
+            deadline, we give up immediately, failing with the first
+            failure (or C{defer.TimeoutError} if there has been none).
+        @param attemptTimeout: An optional number of seconds to allow each
+            attempt. A slow attempt is cancelled and treated as a
+            retryable C{defer.TimeoutError} failure. (A
+            C{defer.TimeoutError} from the function itself is given to
+            the failure tester as usual.)
+        @param clock: A provider of C{IReactorTime} used for scheduling
+            attempts and for timing. Default: C{self.clock}, or the reactor
+            if that is not set.
+        @param keepFailures: If not C{None}, the number of most recent
+            failures to keep (in addition to the first) in
+            C{self.failures}, which becomes a
+            L{txretry.history.FailureHistory}. Retained failures have their
+            traceback frames cleaned. By default, all failures are kept.
+        @param logLimiter: An optional L{txretry.ratelimit.EventRateLimiter}
+            or L{txretry.ratelimit.EventSampler} (or anything with an
+            C{allow} method taking our function) that decides which log
+            events (of retries and of giving up) are emitted. By default,
+            all are.
+        @param observer: An optional L{txretry.observer.RetryObserver}
+            that is told about every attempt, retry, success and give-up.
+        @param scheduler: An optional L{txretry.scheduler.AttemptScheduler}
+            (normally shared with other L{RetryingCall} instances) that
+            limits the number of attempts in progress at once. An attempt
+            that is due when the limit is reached waits for its turn, and
+            any C{attemptTimeout} only starts once it does.
+        @param hedging: An optional L{txretry.hedge.Hedging} policy. Each
+            attempt that is slow to finish is then hedged with duplicate
+            calls of the function, and the first to succeed is used.
+        @param retryAfter: An optional L{txretry.hints.RetryAfterHints}
+            that lets a hint carried by a failure (e.g., a server's
+            suggested wait) lengthen or replace the next delay.
+        @param stormDetector: An optional L{txretry.storm.StormDetector}
+            (normally shared by every call in the process) that is told of
+            every attempt and outcome, and stretches or sheds retries
+            during a retry storm. Default: C{self.stormDetector}.
         @return: a C{Deferred} that will fire with the result of calling
             self._func with self._args and self._kw as arguments, or fail
-            with the first failure encountered.
+            with the first failure encountered. Cancelling it cancels any
+            pending or in-flight attempt and stops further retries.
         """
         self._backoffIterator = iter(backoffIterator or
                                      simpleBackoffIterator())
-        self._failureTester = failureTester or (lambda _: None)
-        self._deferred = defer.Deferred()
+        self._failureTester = failureTester or _retryAll
+        self._budget = budget
+        self._circuitBreaker = circuitBreaker
+        self._deadline = deadline
+        self._attemptTimeout = attemptTimeout
+        self._clock = clock or self.clock or _defaultClock()
+        self._start = self._clock.seconds()
+        if keepFailures is not None:
+            self.failures = FailureHistory(keepFailures)
+        self._logLimiter = logLimiter
+        self._observer = observer
+        self._scheduler = scheduler
+        self._hedging = hedging
+        self._retryAfter = retryAfter
+        self._stormDetector = stormDetector or self.stormDetector
+        self._attemptStart = None
+        self._attemptTimedOut = False
+        self._attempt = None
+        self._attempts = 0
+        self._cancelled = False
+        self._deferred = defer.Deferred(self._cancel)
         self._call()
         return self._deferred
@@ -0,0 +1,146 @@
+# Copyright 2011 Fluidinfo Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you
+# may not use this file except in compliance with the License.  You
+# may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.  See the License for the specific language governing
+# permissions and limitations under the License.
+
+from heapq import heappop, heappush
+from itertools import count
+
+from twisted.internet import defer
+from twisted.python import failure
+
+from txretry.observer import LatencyHistogram
+
+# Indices into the lists used as queue entries by AttemptScheduler. Entries
+# are ordered by priority and then by arrival.
+_PRIORITY, _ORDER, _QUEUED_AT, _DEFERRED, _FUNC, _ATTEMPT = range(6)
+
+
+class AttemptScheduler(object):
+    """
+    Limit the number of attempts that are in progress at once. A single
+    scheduler can be shared by many L{RetryingCall}s (via the C{scheduler}
+    argument to their C{start} method). Attempts that become due while the
+    limit is reached wait in a queue, ordered by attempt number, so first
+    attempts run before retries.
+
+    @ivar inFlight: the number of attempts in progress.
+    @ivar started: the number of attempts started.
+    @ivar maxQueueDepth: the greatest number of attempts that have been
+        waiting at once.
+    @ivar waitTimes: a L{txretry.observer.LatencyHistogram} of the time
+        attempts spent waiting to start.
+    @param maxInFlight: the greatest number of attempts that may be in
+        progress at once.
+    @param clock: a provider of C{IReactorTime}, used to time waits.
+        Default: the reactor.
+    """
+    def __init__(self, maxInFlight, clock=None):
+        assert maxInFlight > 0
+        if clock is None:
+            from twisted.internet import reactor as clock
+        self.maxInFlight = maxInFlight
+        self.clock = clock
+        self.inFlight = 0
+        self.started = 0
+        self.maxQueueDepth = 0
+        self.waitTimes = LatencyHistogram()
+        self._queue = []
+        self._queued = 0
+        self._order = count()
+        self._draining = False
+
+    @property
+    def queueDepth(self):
+        """
+        @return: the number of attempts waiting to start.
+        """
+        return self._queued
+
+    def run(self, priority, func):
+        """
+        Call a function now, or when there is room.
+
+        @param priority: the priority of the call. Lower numbers run first.
+            L{RetryingCall} uses the attempt number.
+        @param func: a function of no arguments.
+        @return: a C{Deferred} that fires with the result of calling
+            C{func}. Cancelling it removes a waiting call from the queue,
+            or cancels one in progress.
+        """
+        entry = [priority, next(self._order), self.clock.seconds(), None,
+                 func, None]
+
+        def cancel(d):
+            if entry[_ATTEMPT] is None:
+                # Still queued. The entry is discarded when it reaches the
+                # front of the queue.
+                entry[_FUNC] = None
+                self._queued -= 1
+            else:
+                entry[_ATTEMPT].cancel()
+
+        entry[_DEFERRED] = defer.Deferred(cancel)
+        if self.inFlight < self.maxInFlight:
+            self._start(entry)
+        else:
+            heappush(self._queue, entry)
+            self._queued += 1
+            if self._queued > self.maxQueueDepth:
+                self.maxQueueDepth = self._queued
+        return entry[_DEFERRED]
+
+    def _start(self, entry):
+        """
+        Start a call.
+
+        @param entry: the queue entry for the call.
+        """
+        self.inFlight += 1
+        self.started += 1
+        self.waitTimes.record(self.clock.seconds() - entry[_QUEUED_AT])
+        attempt = entry[_ATTEMPT] = defer.maybeDeferred(entry[_FUNC])
+        attempt.addBoth(self._finished, entry)
+
+    def _finished(self, result, entry):
+        """
+        A call has finished. Start waiting calls that there is now room for,
+        and then pass on the result.
+
+        @param result: the result of the call, or a C{Failure}.
+        @param entry: the queue entry for the call.
+        """
+        self.inFlight -= 1
+        self._drain()
+        d = entry[_DEFERRED]
+        if isinstance(result, failure.Failure):
+            d.errback(result)
+        else:
+            d.callback(result)
+
+    def _drain(self):
+        """
+        Start as many waiting calls as there is room for.
+        """
+        if self._draining:
+            # We were called as a result of a call started below finishing
+            # synchronously. The loop below will carry on.
+            return
+        self._draining = True
+        try:
+            while self._queue and self.inFlight < self.maxInFlight:
+                entry = heappop(self._queue)
+                if entry[_FUNC] is not None:
+                    self._queued -= 1
+                    self._start(entry)
+        finally:
+            self._draining = False
@@ -0,0 +1,231 @@
+# Copyright 2011 Fluidinfo Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you
+# may not use this file except in compliance with the License.  You
+# may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.  See the License for the specific language governing
+# permissions and limitations under the License.
+
+
+from collections import deque
+
+from twisted.logger import Logger
+
+_log = Logger()
+
+# Indices into the lists used as window buckets by StormDetector.
+_INDEX, _ATTEMPTS, _RETRIES, _FAILURES, _SUCCESSES = range(5)
+
+
+class StormDetector(object):
+    """
+    Detect retry storms across all the L{RetryingCall}s of a process, and
+    damp them. Pass a single detector as the C{stormDetector} argument to
+    C{start}, or set it as the C{stormDetector} attribute of
+    L{RetryingCall} to use it for every call.
+
+    The detector counts attempts, retries, failures and successes over a
+    sliding window. A storm begins when, with at least C{minAttempts}
+    attempts in the window, the fraction of attempts that are retries
+    exceeds C{retryThreshold}. While it lasts, the delay before each retry
+    is multiplied by C{multiplier} (retries already waiting when the storm
+    begins have their remaining delay stretched too, though not past
+    their call's deadline), and retries beyond
+    attempt number C{shedAfter} are shed: their calls give up at once. The
+    storm ends when the fraction of completed attempts in the window that
+    failed falls to C{recoveryThreshold}.
+
+    @ivar storming: C{True} during a storm.
+    @ivar storms: the number of storms detected.
+    @ivar stretched: the number of retry delays stretched.
+    @ivar shed: the number of retries shed.
+    @param window: the length of the sliding window, in seconds.
+    @param buckets: the number of buckets the window is divided into.
+    @param retryThreshold: the fraction of attempts that are retries above
+        which a storm begins.
+    @param recoveryThreshold: the failure rate at or below which a storm
+        ends.
+    @param minAttempts: the number of attempts in the window needed before
+        a storm can begin.
+    @param multiplier: the factor retry delays are stretched by during a
+        storm.
+    @param shedAfter: if not C{None}, the attempt number after which
+        retries are shed during a storm (so 2 sheds third and later
+        attempts).
+    @param clock: a provider of C{IReactorTime}, used to time the sliding
+        window. Retries are still scheduled with each L{RetryingCall}'s own
+        clock. Default: the reactor.
+    """
+    def __init__(self, window=10.0, buckets=10, retryThreshold=0.5,
+                 recoveryThreshold=0.1, minAttempts=20, multiplier=4.0,
+                 shedAfter=None, clock=None):
+        assert window > 0.0 and buckets > 0
+        assert 0.0 <= recoveryThreshold <= 1.0
+        assert multiplier >= 1.0
+        if clock is None:
+            from twisted.internet import reactor as clock
+        self._bucketLength = float(window) / buckets
+        self._buckets = buckets
+        self.retryThreshold = retryThreshold
+        self.recoveryThreshold = recoveryThreshold
+        self.minAttempts = minAttempts
+        self.multiplier = multiplier
+        self.shedAfter = shedAfter
+        self.clock = clock
+        self.storming = False
+        self.storms = 0
+        self.stretched = 0
+        self.shed = 0
+        self._window = deque()
+        self._totals = [None, 0, 0, 0, 0]
+        self._waiting = {}
+        self._pruneAt = 64
+
+    def _bucket(self):
+        """
+        Drop buckets that have left the window.
+
+        @return: the current bucket.
+        """
+        index = int(self.clock.seconds() / self._bucketLength)
+        window = self._window
+        totals = self._totals
+        while window and window[0][_INDEX] <= index - self._buckets:
+            old = window.popleft()
+            for i in _ATTEMPTS, _RETRIES, _FAILURES, _SUCCESSES:
+                totals[i] -= old[i]
+        if not window or window[-1][_INDEX] != index:
+            window.append([index, 0, 0, 0, 0])
+        return window[-1]
+
+    def _count(self, *fields):
+        """
+        Count an event in the current bucket, then check for the start or
+        end of a storm.
+
+        @param fields: the indices of the counts to increment.
+        """
+        bucket = self._bucket()
+        for i in fields:
+            bucket[i] += 1
+            self._totals[i] += 1
+        self._check()
+
+    def _check(self):
+        """
+        Start or end a storm, if the counts in the window say so.
+        """
+        totals = self._totals
+        if self.storming:
+            if self.failureRate() <= self.recoveryThreshold:
+                self.storming = False
+                _log.info('RetryingCall: retry storm over.',
+                          failureRate=self.failureRate())
+        elif (totals[_ATTEMPTS] >= self.minAttempts and
+              totals[_RETRIES] > self.retryThreshold * totals[_ATTEMPTS]):
+            self.storming = True
+            self.storms += 1
+            _log.warn('RetryingCall: retry storm detected ({retries} of '
+                      '{attempts} recent attempts were retries).',
+                      retries=totals[_RETRIES], attempts=totals[_ATTEMPTS])
+            self._stretchWaiting()
+
+    def failureRate(self):
+        """
+        @return: the fraction of attempts completed in the window that
+            failed, or 0.0 if none have completed.
+        """
+        self._bucket()
+        completed = self._totals[_FAILURES] + self._totals[_SUCCESSES]
+        if not completed:
+            return 0.0
+        return float(self._totals[_FAILURES]) / completed
+
+    def recordAttempt(self, retry):
+        """
+        Count an attempt being scheduled.
+
+        @param retry: C{True} if the attempt is a retry.
+        """
+        if retry:
+            self._count(_ATTEMPTS, _RETRIES)
+        else:
+            self._count(_ATTEMPTS)
+
+    def recordFailure(self):
+        """
+        Count a failed attempt.
+        """
+        self._count(_FAILURES)
+
+    def recordSuccess(self):
+        """
+        Count a successful attempt.
+        """
+        self._count(_SUCCESSES)
+
+    def shouldShed(self, attempt):
+        """
+        Decide whether to shed a retry.
+
+        @param attempt: the attempt number the retry would have.
+        @return: C{True} if the retry should not be made.
+        """
+        if (self.storming and self.shedAfter is not None and
+                attempt > self.shedAfter):
+            self.shed += 1
+            return True
+        return False
+
+    def stretch(self, delay):
+        """
+        @param delay: a retry delay.
+        @return: the delay to use, which is longer during a storm.
+        """
+        if self.storming:
+            self.stretched += 1
+            return delay * self.multiplier
+        return delay
+
+    def track(self, call, clock, latest=None):
+        """
+        Keep track of a waiting retry, so that its delay can be stretched if
+        a storm begins.
+
+        @param call: the C{IDelayedCall} of the retry.
+        @param clock: the C{IReactorTime} provider the call was scheduled
+            with.
+        @param latest: if not C{None}, the time (on C{clock}) the retry
+            must not be stretched beyond, such as its call's deadline.
+        """
+        waiting = self._waiting
+        waiting[call] = (clock, latest)
+        if len(waiting) >= self._pruneAt:
+            # Forget calls that have been made or cancelled, from time to
+            # time, so the mapping stays in proportion to the waiting
+            # retries.
+            for old in [old for old in waiting if not old.active()]:
+                del waiting[old]
+            self._pruneAt = max(64, 2 * len(waiting))
+
+    def _stretchWaiting(self):
+        """
+        Stretch the remaining delay of every waiting retry, up to the
+        latest time allowed for it.
+        """
+        for call, (clock, latest) in self._waiting.items():
+            if call.active():
+                extra = ((call.getTime() - clock.seconds()) *
+                         (self.multiplier - 1.0))
+                if latest is not None:
+                    extra = min(extra, latest - call.getTime())
+                if extra > 0.0:
+                    call.delay(extra)
+                    self.stretched += 1
+        self._waiting.clear()
@@ -0,0 +1,143 @@
+from random import Random
+
+import six
+from twisted.trial import unittest
+from twisted.internet import defer, task
+
+from txretry.adaptive import AdaptiveBackoff
+from txretry.observer import ObserverGroup, RetryStats
+from txretry.retry import RetryingCall
+
+
+class TestAdaptiveBackoff(unittest.TestCase):
+    """Test the AdaptiveBackoff class."""
+
+    def testIterator(self):
+        """The iterator yields zero first (if asked to), and then the
+        current delay, up to C{maxResults} delays."""
+        backoff = AdaptiveBackoff(initDelay=1.0, jitter=False)
+        self.assertEqual([0.0, 1.0, 1.0], list(backoff.iterator(3)))
+        self.assertEqual([1.0, 1.0], list(backoff.iterator(2, now=False)))
+
+    def testDelayReadWhenNeeded(self):
+        """Each delay reflects the state when it is asked for."""
+        backoff = AdaptiveBackoff(initDelay=1.0, jitter=False)
+        bi = backoff.iterator(now=False)
+        self.assertEqual(1.0, six.next(bi))
+        backoff.attemptFailed(None, 1, None, 0.1)
+        self.assertEqual(2.0, six.next(bi))
+
+    def testMultiplicativeIncrease(self):
+        """Failures multiply the delay, up to C{maxDelay}."""
+        backoff = AdaptiveBackoff(initDelay=1.0, maxDelay=5.0,
+                                  increaseFactor=2.0)
+        backoff.attemptFailed(None, 1, None, 0.1)
+        self.assertEqual(2.0, backoff.delay)
+        backoff.attemptFailed(None, 1, None, 0.1)
+        backoff.attemptFailed(None, 1, None, 0.1)
+        self.assertEqual(5.0, backoff.delay)
+
+    def testAdditiveDecrease(self):
+        """Successes reduce the delay, scaled by the success rate, down to
+        C{minDelay}."""
+        backoff = AdaptiveBackoff(initDelay=1.0, minDelay=0.5,
+                                  decreaseStep=0.2, smoothing=0.5)
+        backoff.succeeded(None, 1, 0.1, 0.1)
+        self.assertAlmostEqual(0.8, backoff.delay)
+        backoff.attemptFailed(None, 1, None, 0.1)
+        self.assertAlmostEqual(0.5, backoff.failureRate)
+        self.assertAlmostEqual(1.6, backoff.delay)
+        backoff.succeeded(None, 1, 0.1, 0.1)
+        self.assertAlmostEqual(0.25, backoff.failureRate)
+        self.assertAlmostEqual(1.45, backoff.delay)
+        for _ in range(20):
+            backoff.succeeded(None, 1, 0.1, 0.1)
+        self.assertEqual(0.5, backoff.delay)
+
+    def testLatencyTarget(self):
+        """Successes do not reduce the delay while the moving average of
+        latency is above the target, even if they are fast."""
+        backoff = AdaptiveBackoff(initDelay=1.0, latencyTarget=0.5,
+                                  smoothing=0.5)
+        backoff.succeeded(None, 1, 2.0, 2.0)
+        self.assertEqual(1.0, backoff.delay)
+        self.assertEqual(2.0, backoff.latency)
+        backoff.succeeded(None, 1, 0.1, 0.1)
+        backoff.succeeded(None, 1, 0.1, 0.1)
+        self.assertEqual(1.0, backoff.delay)
+        self.assertAlmostEqual(0.575, backoff.latency)
+        backoff.succeeded(None, 1, 0.1, 0.1)
+        self.assertAlmostEqual(0.3375, backoff.latency)
+        self.assertAlmostEqual(0.9, backoff.delay)
+
+    def testSlowSuccessAfterFastOnes(self):
+        """A single slow success does not stop the delay decreasing while
+        the moving average of latency is within the target."""
+        backoff = AdaptiveBackoff(initDelay=1.0, latencyTarget=0.5,
+                                  smoothing=0.1)
+        backoff.succeeded(None, 1, 0.1, 0.1)
+        backoff.succeeded(None, 1, 2.0, 2.0)
+        self.assertAlmostEqual(0.29, backoff.latency)
+        self.assertAlmostEqual(0.8, backoff.delay)
+
+    def testJitter(self):
+        """With jitter, delays lie between half the delay and the delay."""
+        backoff = AdaptiveBackoff(initDelay=2.0, randomSource=Random(0))
+        for delay in backoff.iterator(50, now=False):
+            self.assertTrue(1.0 <= delay <= 2.0)
+
+
+class TestRetryingCallAdaptiveBackoff(unittest.TestCase):
+    """Test the use of an AdaptiveBackoff by RetryingCall."""
+
+    def testSharedState(self):
+        """Failures seen by one call lengthen the delays of another."""
+        clock = task.Clock()
+        backoff = AdaptiveBackoff(initDelay=1.0, jitter=False)
+        failing = RetryingCall(lambda: 1 / 0)
+        d1 = failing.start(backoffIterator=backoff.iterator(2),
+                           observer=backoff, clock=clock)
+        d1.addErrback(lambda fail: fail.trap(ZeroDivisionError))
+        clock.advance(0.0)
+        clock.advance(2.0)
+        self.assertEqual(4.0, backoff.delay)
+        calls = []
+
+        def _f():
+            calls.append(clock.seconds())
+            if len(calls) == 1:
+                raise ValueError()
+
+        d2 = RetryingCall(_f).start(backoffIterator=backoff.iterator(),
+                                    observer=backoff, clock=clock)
+        clock.advance(0.0)
+        self.assertEqual(8.0, backoff.delay)
+        clock.advance(8.0)
+        self.assertEqual([2.0, 10.0], calls)
+        self.assertTrue(backoff.delay < 8.0)
+        return defer.gatherResults([d1, d2])
+
+    def testWithRetryStats(self):
+        """Grouped with a L{RetryStats}, an AdaptiveBackoff still adapts
+        and the stats are still kept."""
+        clock = task.Clock()
+        backoff = AdaptiveBackoff(initDelay=1.0, jitter=False)
+        stats = RetryStats()
+        failing = [ValueError]
+
+        def _f():
+            if failing:
+                raise failing.pop()()
+            return 5
+
+        d = RetryingCall(_f).start(
+            backoffIterator=backoff.iterator(),
+            observer=ObserverGroup([backoff, stats]), clock=clock)
+        clock.advance(0.0)
+        self.assertEqual(2.0, backoff.delay)
+        clock.advance(2.0)
+        self.assertTrue(backoff.delay < 2.0)
+        f = stats.forFunction(_f)
+        self.assertEqual((2, 1, 1), (f.attempts, f.failures, f.successes))
+        d.addCallback(lambda result: self.assertEqual(5, result))
+        return d
@@ -0,0 +1,140 @@
+from twisted.trial import unittest
+
+try:
+    import asyncio
+    from txretry.aio import AsyncRetryingCall, retryCall
+except (ImportError, SyntaxError):
+    skip = 'asyncio retrying requires Python 3.5 or later.'
+else:
+    skip = None
+
+
+class _Failing(object):
+    """A function that raises the given exceptions in turn, then returns
+    a result (wrapped in a future if C{future} is C{True})."""
+    def __init__(self, exceptions, result=None, future=False):
+        self.exceptions = list(exceptions)
+        self.result = result
+        self.future = future
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.exceptions:
+            raise self.exceptions.pop(0)()
+        if self.future:
+            f = asyncio.get_event_loop().create_future()
+            f.set_result(self.result)
+            return f
+        return self.result
+
+
+class TestAsyncRetryingCall(unittest.TestCase):
+    """Test the AsyncRetryingCall class and retryCall."""
+    skip = skip
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def _complete(self, coroutine):
+        """Run a coroutine on our event loop and return its result."""
+        return self.loop.run_until_complete(coroutine)
+
+    def testSuccess(self):
+        """The result of the function is returned."""
+        self.assertEqual(3, self._complete(
+            retryCall(lambda x, y: x + y, 1, y=2)))
+
+    def testRetries(self):
+        """Failures are retried until the function succeeds."""
+        f = _Failing([ValueError, ValueError], result=5)
+        rc = AsyncRetryingCall(f)
+        self.assertEqual(5, self._complete(rc.start((0.0, 0.0, 0.0))))
+        self.assertEqual(3, f.calls)
+        self.assertEqual([ValueError, ValueError],
+                         [fail.type for fail in rc.failures])
+
+    def testAwaitable(self):
+        """An awaitable returned by the function is awaited."""
+        f = _Failing([ValueError], result=5, future=True)
+        self.assertEqual(5, self._complete(retryCall(
+            f, backoffIterator=(0.0, 0.0))))
+
+    def testExhausted(self):
+        """When the back-off iterator runs out, the first exception is
+        raised."""
+        f = _Failing([KeyError, ValueError, ValueError])
+        self.assertRaises(KeyError, self._complete,
+                          retryCall(f, backoffIterator=(0.0, 0.0)))
+        self.assertEqual(2, f.calls)
+
+    def testNoDelays(self):
+        """An empty back-off iterator is an error."""
+        self.assertRaises(ValueError, self._complete,
+                          retryCall(lambda: None, backoffIterator=iter(())))
+
+    def testFailureTesterReturnsFailure(self):
+        """A failure returned by the failure tester is raised, as for
+        RetryingCall."""
+        f = _Failing([ValueError, KeyError])
+        self.assertRaises(KeyError, self._complete, retryCall(
+            f, backoffIterator=(0.0, 0.0, 0.0),
+            failureTester=lambda fail: fail.trap(ValueError)))
+        self.assertEqual(2, f.calls)
+
+    def testFailureTesterRaises(self):
+        """An exception raised by the failure tester is raised."""
+        def _tester(fail):
+            raise IndexError()
+        self.assertRaises(IndexError, self._complete, retryCall(
+            _Failing([ValueError]), failureTester=_tester))
+
+    def testDeadline(self):
+        """No attempt is made after the deadline."""
+        f = _Failing([ValueError] * 5)
+        self.assertRaises(ValueError, self._complete, retryCall(
+            f, backoffIterator=(0.0, 0.01, 10.0), deadline=1.0))
+        self.assertEqual(2, f.calls)
+
+    def testDeadlineBeforeFirstAttempt(self):
+        """If the first attempt would pass the deadline, a timeout is
+        raised."""
+        self.assertRaises(asyncio.TimeoutError, self._complete, retryCall(
+            lambda: None, backoffIterator=(10.0,), deadline=1.0))
+
+    def testCancelWhileWaiting(self):
+        """Cancelling the task while it waits to retry stops further
+        attempts and closes the back-off iterator."""
+        f = _Failing([ValueError] * 5)
+        closed = []
+
+        def _backoff():
+            try:
+                yield 0.0
+                yield 60.0
+            finally:
+                closed.append(True)
+
+        task = self.loop.create_task(retryCall(f,
+                                               backoffIterator=_backoff()))
+        self.loop.call_later(0.01, task.cancel)
+        self.assertRaises(asyncio.CancelledError, self._complete, task)
+        self.assertEqual(1, f.calls)
+        self.assertEqual([True], closed)
+
+    def testCancelInFlight(self):
+        """Cancelling the task cancels the attempt in progress, which is
+        not treated as a failure."""
+        futures = []
+
+        def _f():
+            futures.append(self.loop.create_future())
+            return futures[-1]
+
+        rc = AsyncRetryingCall(_f)
+        task = self.loop.create_task(rc.start())
+        self.loop.call_later(0.01, task.cancel)
+        self.assertRaises(asyncio.CancelledError, self._complete, task)
+        self.assertTrue(futures[0].cancelled())
+        self.assertEqual(([], 1), (rc.failures, len(futures)))
@@ -0,0 +1,235 @@
+from twisted.trial import unittest
+from twisted.internet import defer, error, task
+
+from txretry.batch import BatchRetryingCall, CoalescingClock
+from txretry.retry import RetryingCall
+
+
+class TestCoalescingClock(unittest.TestCase):
+    """Test the CoalescingClock class."""
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.coalescing = CoalescingClock(self.clock, resolution=1.0)
+
+    def testSeconds(self):
+        """The time is that of the underlying clock."""
+        self.clock.advance(7.0)
+        self.assertEqual(7.0, self.coalescing.seconds())
+
+    def testGrouping(self):
+        """Calls due in the same tick share one underlying delayed call,
+        and are made at the end of the tick."""
+        calls = []
+        self.coalescing.callLater(0.2, calls.append, 1)
+        self.coalescing.callLater(0.7, calls.append, 2)
+        self.coalescing.callLater(1.5, calls.append, 3)
+        self.assertEqual(2, len(self.clock.getDelayedCalls()))
+        self.assertEqual(3, len(self.coalescing.getDelayedCalls()))
+        self.clock.advance(0.9)
+        self.assertEqual([], calls)
+        self.clock.advance(0.1)
+        self.assertEqual([1, 2], calls)
+        self.clock.advance(1.0)
+        self.assertEqual([1, 2, 3], calls)
+        self.assertEqual([], self.coalescing.getDelayedCalls())
+
+    def testCancel(self):
+        """A cancelled call is not made, and the underlying delayed call is
+        cancelled once no calls remain in its tick."""
+        calls = []
+        first = self.coalescing.callLater(0.2, calls.append, 1)
+        second = self.coalescing.callLater(0.7, calls.append, 2)
+        first.cancel()
+        self.assertFalse(first.active())
+        self.assertEqual(1, len(self.clock.getDelayedCalls()))
+        second.cancel()
+        self.assertEqual([], self.clock.getDelayedCalls())
+        self.assertRaises(error.AlreadyCancelled, second.cancel)
+        self.clock.advance(1.0)
+        self.assertEqual([], calls)
+
+    def testAlreadyCalled(self):
+        """A call that has been made cannot be cancelled."""
+        call = self.coalescing.callLater(0.2, lambda: None)
+        self.clock.advance(1.0)
+        self.assertRaises(error.AlreadyCalled, call.cancel)
+
+    def testReset(self):
+        """A call can be moved to another tick."""
+        calls = []
+        call = self.coalescing.callLater(0.2, calls.append, 1)
+        call.reset(2.5)
+        self.assertEqual(2.5, call.getTime())
+        self.assertEqual(1, len(self.clock.getDelayedCalls()))
+        self.clock.advance(1.0)
+        self.assertEqual([], calls)
+        self.clock.advance(2.0)
+        self.assertEqual([1], calls)
+
+    def testDeferLater(self):
+        """The clock works with C{task.deferLater}, including
+        cancellation."""
+        d = task.deferLater(self.coalescing, 0.5, lambda: 4)
+        d.cancel()
+        self.assertEqual([], self.clock.getDelayedCalls())
+        self.failUnlessFailure(d, defer.CancelledError)
+        return d
+
+
+    def testCancelWhileFiring(self):
+        """A call can cancel another call in the same tick."""
+        calls = []
+        later = []
+        self.coalescing.callLater(0.2, lambda: later[0].cancel())
+        later.append(self.coalescing.callLater(0.7, calls.append, 1))
+        self.clock.advance(1.0)
+        self.assertEqual([], calls)
+        self.assertEqual([], self.coalescing.getDelayedCalls())
+
+    def testResetWhileFiring(self):
+        """A call can reschedule another call in the same tick."""
+        calls = []
+        later = []
+        self.coalescing.callLater(0.2, lambda: later[0].reset(1.5))
+        later.append(self.coalescing.callLater(0.7, calls.append, 1))
+        self.clock.advance(1.0)
+        self.assertEqual([], calls)
+        self.clock.advance(2.0)
+        self.assertEqual([1], calls)
+
+    def testAttemptTimeoutSameTick(self):
+        """An attempt that succeeds in the same tick as its timeout is due
+        succeeds (its timeout is cancelled while the tick fires)."""
+        def _f():
+            d = defer.Deferred()
+            self.coalescing.callLater(0.5, d.callback, 3)
+            return d
+
+        d = RetryingCall(_f).start(backoffIterator=(0.0,),
+                                   attemptTimeout=0.6,
+                                   clock=self.coalescing)
+        self.clock.advance(0.0)
+        self.clock.advance(1.0)
+        d.addCallback(self.assertEqual, 3)
+        return d
+
+    def testErrorLogged(self):
+        """An error raised by a call is logged, and the other calls in its
+        tick are still made."""
+        calls = []
+        self.coalescing.callLater(0.2, lambda: 1 / 0)
+        self.coalescing.callLater(0.7, calls.append, 1)
+        self.clock.advance(1.0)
+        self.assertEqual([1], calls)
+        self.assertEqual([], self.coalescing.getDelayedCalls())
+        self.assertEqual(1, len(self.flushLoggedErrors(ZeroDivisionError)))
+
+
+class TestBatchRetryingCall(unittest.TestCase):
+    """Test the BatchRetryingCall class."""
+
+    def setUp(self):
+        self.clock = task.Clock()
+
+    def testResults(self):
+        """Results are returned in the order of the argument sets, with
+        failures for calls that gave up."""
+        def _f(x, y=0):
+            if x < 0:
+                raise ValueError()
+            return x + y
+
+        batch = BatchRetryingCall(_f, [(1,), (-1,), (3,)], y=10)
+        d = batch.start(backoffIteratorFactory=lambda: (0.0, 0.5),
+                        clock=self.clock)
+        self.clock.pump([0.01, 0.5])
+
+        def _check(results):
+            self.assertEqual([(True, 11), (True, 13)],
+                             [results[0], results[2]])
+            self.assertFalse(results[1][0])
+            self.assertTrue(results[1][1].check(ValueError))
+
+        return d.addCallback(_check)
+
+    def testSharedTimers(self):
+        """Retries that become due in the same tick share a timer."""
+        failing = set([1, 2, 3])
+
+        def _f(x):
+            if x in failing:
+                failing.discard(x)
+                raise ValueError()
+            return x
+
+        batch = BatchRetryingCall(_f, [(1,), (2,), (3,)])
+        d = batch.start(backoffIteratorFactory=lambda: (0.0, 0.5, 0.5),
+                        resolution=0.1, clock=self.clock)
+        self.assertEqual(1, len(self.clock.getDelayedCalls()))
+        self.clock.advance(0.0)
+        self.assertEqual(3, sum(len(rc.failures) for rc in batch.calls))
+        self.assertEqual(1, len(self.clock.getDelayedCalls()))
+        self.clock.advance(0.5)
+        d.addCallback(lambda results: self.assertEqual(
+            [(True, 1), (True, 2), (True, 3)], results))
+        return d
+
+    def testOnResult(self):
+        """C{onResult} is called as each call completes."""
+        reported = []
+        batch = BatchRetryingCall(lambda x: x * 2, [(1,), (2,)])
+        d = batch.start(onResult=lambda *r: reported.append(r),
+                        clock=self.clock)
+        self.clock.advance(0.01)
+        self.assertEqual([(0, True, 2), (1, True, 4)], reported)
+        return d
+
+    def testMaxConcurrent(self):
+        """No more than C{maxConcurrent} attempts are in progress at
+        once."""
+        pending = []
+
+        def _f(x):
+            pending.append(defer.Deferred())
+            return pending[-1]
+
+        batch = BatchRetryingCall(_f, [(i,) for i in range(5)])
+        d = batch.start(maxConcurrent=2, clock=self.clock)
+        self.clock.advance(0.01)
+        self.assertEqual(2, len(pending))
+        pending[0].callback(0)
+        self.assertEqual(3, len(pending))
+        for attempt in pending[1:]:
+            attempt.callback(None)
+        self.assertEqual(5, len(pending))
+        pending[3].callback(None)
+        pending[4].callback(None)
+        d.addCallback(lambda results: self.assertEqual(5, len(results)))
+        return d
+
+    def testMaxConcurrentKeepsFunction(self):
+        """Limiting concurrency does not replace the function each call
+        reports (e.g., to observers and in log events)."""
+        def _f(x):
+            return x
+
+        batch = BatchRetryingCall(_f, [(1,), (2,)])
+        d = batch.start(maxConcurrent=1, clock=self.clock)
+        self.assertEqual([_f, _f], [rc._func for rc in batch.calls])
+        self.clock.advance(0.01)
+        return d
+
+    def testStartKeywords(self):
+        """Other keyword arguments are passed to each call's C{start}."""
+        batch = BatchRetryingCall(defer.Deferred, [(), ()])
+        d = batch.start(backoffIteratorFactory=lambda: (0.0,),
+                        attemptTimeout=1.0, clock=self.clock)
+        self.clock.pump([0.01, 1.0])
+
+        def _check(results):
+            for success, fail in results:
+                self.assertFalse(success)
+                self.assertTrue(fail.check(defer.TimeoutError))
+
+        return d.addCallback(_check)
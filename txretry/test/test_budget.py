@@ -0,0 +1,116 @@
+from twisted.trial import unittest
+from twisted.internet import defer
+
+from txretry.budget import RetryBudget
+from txretry.retry import RetryingCall
+
+
+class TestRetryBudget(unittest.TestCase):
+    """Test the RetryBudget class."""
+
+    def testInitiallyFull(self):
+        """By default a budget starts with C{maxTokens} tokens."""
+        budget = RetryBudget(maxTokens=3.0)
+        self.assertEqual(3.0, budget.tokens)
+
+    def testInitialTokens(self):
+        """The initial number of tokens can be given explicitly."""
+        budget = RetryBudget(maxTokens=3.0, initialTokens=1.0)
+        self.assertEqual(1.0, budget.tokens)
+
+    def testWithdraw(self):
+        """Withdrawals are allowed until the bucket holds less than one
+        token, and the allowed and denied counts are kept."""
+        budget = RetryBudget(maxTokens=2.0)
+        self.assertTrue(budget.withdraw())
+        self.assertTrue(budget.withdraw())
+        self.assertFalse(budget.withdraw())
+        self.assertEqual(2, budget.allowed)
+        self.assertEqual(1, budget.denied)
+
+    def testDeposit(self):
+        """Each deposit adds C{ratio} tokens to the bucket."""
+        budget = RetryBudget(ratio=0.5, initialTokens=0.0)
+        self.assertFalse(budget.withdraw())
+        budget.deposit()
+        self.assertFalse(budget.withdraw())
+        budget.deposit()
+        self.assertTrue(budget.withdraw())
+
+    def testDepositLimit(self):
+        """Deposits never take the bucket above C{maxTokens}."""
+        budget = RetryBudget(ratio=1.0, maxTokens=2.0)
+        budget.deposit()
+        self.assertEqual(2.0, budget.tokens)
+
+
+class TestRetryingCallBudget(unittest.TestCase):
+    """Test the use of a RetryBudget by RetryingCall."""
+
+    def testRetriesAllowed(self):
+        """A call that needs fewer retries than the budget holds succeeds,
+        and the successful call is credited to the budget."""
+        budget = RetryBudget(ratio=0.5, maxTokens=5.0)
+        calls = []
+
+        def _f():
+            calls.append(None)
+            if len(calls) < 3:
+                raise ValueError()
+            return 6
+
+        rc = RetryingCall(_f)
+        d = rc.start(backoffIterator=(0.0, 0.0, 0.0), budget=budget)
+        d.addCallback(lambda result: self.assertEqual(6, result))
+        d.addCallback(lambda _: self.assertEqual(2, budget.allowed))
+        d.addCallback(lambda _: self.assertEqual(3.5, budget.tokens))
+        return d
+
+    def testBudgetExhaustedFailsFast(self):
+        """When the budget is empty, the call fails immediately with its
+        first failure rather than being retried."""
+        budget = RetryBudget(initialTokens=1.0)
+        calls = []
+
+        def _f():
+            calls.append(None)
+            raise ValueError()
+
+        rc = RetryingCall(_f)
+        d = rc.start(backoffIterator=(0.0,) * 10, budget=budget)
+        self.failUnlessFailure(d, ValueError)
+        d.addCallback(lambda _: self.assertEqual(2, len(calls)))
+        d.addCallback(lambda _: self.assertEqual(1, budget.allowed))
+        d.addCallback(lambda _: self.assertEqual(1, budget.denied))
+        return d
+
+    def testSharedBudget(self):
+        """A budget shared by several calls limits their total retries."""
+        budget = RetryBudget(initialTokens=2.0)
+        ds = []
+        for _ in range(3):
+            rc = RetryingCall(lambda: defer.fail(ValueError()))
+            d = rc.start(backoffIterator=(0.0,) * 5, budget=budget)
+            ds.append(self.failUnlessFailure(d, ValueError))
+
+        def _check(_):
+            self.assertEqual(2, budget.allowed)
+            self.assertEqual(3, budget.denied)
+
+        return defer.gatherResults(ds).addCallback(_check)
+
+    def testNoWithdrawalWithoutRetry(self):
+        """Nothing is withdrawn for a failure that is not retried because
+        the back-off iterator is exhausted."""
+        budget = RetryBudget()
+        ds = []
+        for _ in range(3):
+            rc = RetryingCall(lambda: defer.fail(ValueError()))
+            d = rc.start(backoffIterator=(0.0,), budget=budget)
+            ds.append(self.failUnlessFailure(d, ValueError))
+
+        def _check(_):
+            self.assertEqual(0, budget.allowed)
+            self.assertEqual(0, budget.denied)
+
+        return defer.gatherResults(ds).addCallback(_check)
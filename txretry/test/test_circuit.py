@@ -0,0 +1,209 @@
+from twisted.trial import unittest
+from twisted.internet import defer, task
+
+from txretry.circuit import (
+    CircuitBreaker, CircuitBreakerRegistry, CircuitOpenError, CLOSED, OPEN,
+    HALF_OPEN)
+from txretry.retry import RetryingCall
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    """Test the CircuitBreaker class."""
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.breaker = CircuitBreaker(failureThreshold=0.5, minimumCalls=4,
+                                      windowSize=4, resetTimeout=10.0,
+                                      halfOpenCalls=2, clock=self.clock)
+
+    def _trip(self):
+        """Record enough failures to open the breaker."""
+        for _ in range(4):
+            self.breaker.recordFailure()
+
+    def testInitiallyClosed(self):
+        """A new breaker is closed and allows requests."""
+        self.assertEqual(CLOSED, self.breaker.state)
+        self.assertTrue(self.breaker.allowRequest())
+
+    def testMinimumCalls(self):
+        """The breaker stays closed until C{minimumCalls} outcomes have
+        been recorded."""
+        for _ in range(3):
+            self.breaker.recordFailure()
+        self.assertEqual(CLOSED, self.breaker.state)
+
+    def testOpens(self):
+        """The breaker opens when the failure rate reaches the threshold."""
+        self.breaker.recordSuccess()
+        self.breaker.recordSuccess()
+        self.breaker.recordFailure()
+        self.assertEqual(CLOSED, self.breaker.state)
+        self.breaker.recordFailure()
+        self.assertEqual(OPEN, self.breaker.state)
+        self.assertFalse(self.breaker.allowRequest())
+
+    def testWindow(self):
+        """Only the most recent C{windowSize} outcomes are considered."""
+        self.breaker.recordFailure()
+        for _ in range(4):
+            self.breaker.recordSuccess()
+        self.breaker.recordFailure()
+        self.assertEqual(CLOSED, self.breaker.state)
+
+    def testHalfOpenAfterTimeout(self):
+        """After C{resetTimeout} seconds, the breaker lets
+        C{halfOpenCalls} probes through."""
+        self._trip()
+        self.clock.advance(9.9)
+        self.assertFalse(self.breaker.allowRequest())
+        self.clock.advance(0.1)
+        self.assertTrue(self.breaker.allowRequest())
+        self.assertEqual(HALF_OPEN, self.breaker.state)
+        self.assertTrue(self.breaker.allowRequest())
+        self.assertFalse(self.breaker.allowRequest())
+
+    def testHalfOpenCloses(self):
+        """Enough successful probes close the breaker."""
+        self._trip()
+        self.clock.advance(10.0)
+        self.breaker.allowRequest()
+        self.breaker.recordSuccess()
+        self.assertEqual(HALF_OPEN, self.breaker.state)
+        self.breaker.allowRequest()
+        self.breaker.recordSuccess()
+        self.assertEqual(CLOSED, self.breaker.state)
+
+    def testCancelRequestFreesProbe(self):
+        """Cancelling a probe lets another probe through."""
+        self._trip()
+        self.clock.advance(10.0)
+        self.breaker.allowRequest()
+        self.breaker.allowRequest()
+        self.assertFalse(self.breaker.allowRequest())
+        self.breaker.cancelRequest()
+        self.assertTrue(self.breaker.allowRequest())
+
+    def testHalfOpenReopens(self):
+        """A failed probe re-opens the breaker."""
+        self._trip()
+        self.clock.advance(10.0)
+        self.breaker.allowRequest()
+        self.breaker.recordFailure()
+        self.assertEqual(OPEN, self.breaker.state)
+        self.assertFalse(self.breaker.allowRequest())
+
+
+class TestCircuitBreakerRegistry(unittest.TestCase):
+    """Test the CircuitBreakerRegistry class."""
+
+    def testSameKey(self):
+        """The same breaker is returned for the same key."""
+        registry = CircuitBreakerRegistry()
+        self.assertIs(registry.breakerFor('a'), registry.breakerFor('a'))
+
+    def testDifferentKeys(self):
+        """Different keys get different breakers, made with the registry's
+        arguments."""
+        registry = CircuitBreakerRegistry(resetTimeout=3.0)
+        breaker = registry.breakerFor('a')
+        self.assertIsNot(breaker, registry.breakerFor('b'))
+        self.assertEqual(3.0, breaker.resetTimeout)
+
+
+class TestRetryingCallCircuitBreaker(unittest.TestCase):
+    """Test the use of a CircuitBreaker by RetryingCall."""
+
+    def testOpenCircuitFailsFast(self):
+        """When the circuit is open, the function is not called and the
+        call fails with C{CircuitOpenError}."""
+        breaker = CircuitBreaker(minimumCalls=1, windowSize=1)
+        breaker.recordFailure()
+        calls = []
+        rc = RetryingCall(lambda: calls.append(None))
+        d = rc.start(circuitBreaker=breaker)
+        self.failUnlessFailure(d, CircuitOpenError)
+        d.addCallback(lambda _: self.assertEqual([], calls))
+        return d
+
+    def testRetriesTripCircuit(self):
+        """Failed attempts are recorded and stop further retries once the
+        circuit opens."""
+        breaker = CircuitBreaker(minimumCalls=3, windowSize=3)
+        calls = []
+
+        def _f():
+            calls.append(None)
+            raise ValueError()
+
+        rc = RetryingCall(_f)
+        d = rc.start(backoffIterator=(0.0,) * 10, circuitBreaker=breaker)
+        self.failUnlessFailure(d, CircuitOpenError)
+        d.addCallback(lambda _: self.assertEqual(3, len(calls)))
+        d.addCallback(lambda _: self.assertEqual(OPEN, breaker.state))
+        return d
+
+    def testSuccessRecorded(self):
+        """A successful call is recorded by the breaker."""
+        clock = task.Clock()
+        breaker = CircuitBreaker(minimumCalls=1, windowSize=1,
+                                 halfOpenCalls=1, clock=clock)
+        breaker.recordFailure()
+        clock.advance(breaker.resetTimeout)
+        rc = RetryingCall(lambda: defer.succeed(3))
+        d = rc.start(circuitBreaker=breaker)
+        d.addCallback(lambda result: self.assertEqual(3, result))
+        d.addCallback(lambda _: self.assertEqual(CLOSED, breaker.state))
+        return d
+
+    def testDeadlineReleasesProbe(self):
+        """A call that gives up at its deadline does not take a half-open
+        breaker's probe."""
+        clock = task.Clock()
+        breaker = self._halfOpen(clock)
+        rc = RetryingCall(lambda: None)
+        d = rc.start(backoffIterator=(5.0,), deadline=1.0,
+                     circuitBreaker=breaker, clock=clock)
+        self.failUnlessFailure(d, defer.TimeoutError)
+        d.addCallback(lambda _: self.assertTrue(breaker.allowRequest()))
+        return d
+
+    def _halfOpen(self, clock):
+        """
+        Make a breaker that is half-open and allows a single probe.
+
+        @param clock: the C{task.Clock} the breaker should use.
+        @return: the L{CircuitBreaker}.
+        """
+        breaker = CircuitBreaker(minimumCalls=1, windowSize=1,
+                                 halfOpenCalls=1, clock=clock)
+        breaker.recordFailure()
+        clock.advance(breaker.resetTimeout)
+        return breaker
+
+    def testExhaustedReleasesProbe(self):
+        """A call whose back-off iterator is exhausted does not take a
+        half-open breaker's probe."""
+        breaker = self._halfOpen(task.Clock())
+        rc = RetryingCall(lambda: None)
+        d = rc.start(backoffIterator=iter([]), circuitBreaker=breaker)
+        self.failUnlessFailure(d, StopIteration)
+        d.addCallback(lambda _: self.assertTrue(breaker.allowRequest()))
+        return d
+
+    def testRefusedLeavesProbe(self):
+        """A call refused by a half-open breaker does not use up the probe
+        already taken by another call, which is released when that call
+        is cancelled."""
+        clock = task.Clock()
+        breaker = self._halfOpen(clock)
+        d1 = RetryingCall(lambda: None).start(
+            backoffIterator=(1.0,), circuitBreaker=breaker, clock=clock)
+        d2 = RetryingCall(lambda: None).start(
+            backoffIterator=(1.0,), circuitBreaker=breaker, clock=clock)
+        self.failUnlessFailure(d2, CircuitOpenError)
+        d1.cancel()
+        self.failUnlessFailure(d1, defer.CancelledError)
+        d = defer.gatherResults([d1, d2])
+        d.addCallback(lambda _: self.assertTrue(breaker.allowRequest()))
+        return d
@@ -0,0 +1,187 @@
+import errno
+
+from twisted.trial import unittest
+from twisted.internet import defer, task
+from twisted.python.failure import Failure
+
+from txretry.classify import FailureClassifier, RETRY, FAIL
+from txretry.hints import RetryAfterHints
+from txretry.retry import RetryingCall
+
+
+class _CodedError(Exception):
+    """An exception carrying an error code."""
+    def __init__(self, code):
+        Exception.__init__(self, code)
+        self.code = code
+
+
+class _SubValueError(ValueError):
+    """A subclass of C{ValueError}."""
+
+
+def _failure(exception):
+    """Make a C{Failure} for an exception instance."""
+    return Failure(exception)
+
+
+class TestFailureClassifier(unittest.TestCase):
+    """Test the FailureClassifier class."""
+
+    def testRetryable(self):
+        """Retryable types (and their subclasses) are retried."""
+        classifier = FailureClassifier(retryable=[ValueError])
+        self.assertEqual(RETRY, classifier.classify(_failure(ValueError())))
+        self.assertEqual(RETRY,
+                         classifier.classify(_failure(_SubValueError())))
+
+    def testDefault(self):
+        """Types no rule applies to get the default decision."""
+        self.assertEqual(FAIL, FailureClassifier().classify(
+            _failure(KeyError())))
+        self.assertEqual(RETRY, FailureClassifier(default=RETRY).classify(
+            _failure(KeyError())))
+
+    def testMostSpecificTypeWins(self):
+        """A fatal subclass of a retryable type is not retried."""
+        classifier = FailureClassifier(retryable=[Exception],
+                                       fatal=[ValueError])
+        self.assertEqual(FAIL,
+                         classifier.classify(_failure(_SubValueError())))
+        self.assertEqual(RETRY, classifier.classify(_failure(KeyError())))
+
+    def testPredicates(self):
+        """Predicates decide from the exception instance, falling back to
+        the type rules when they return C{None}."""
+        def _transient(exc):
+            if exc.code == errno.EAGAIN:
+                return True
+            if exc.code == errno.EACCES:
+                return False
+
+        classifier = FailureClassifier(fatal=[_CodedError],
+                                       predicates=[(_CodedError, _transient)])
+        self.assertEqual(RETRY, classifier.classify(
+            _failure(_CodedError(errno.EAGAIN))))
+        self.assertEqual(FAIL, classifier.classify(
+            _failure(_CodedError(errno.EACCES))))
+        self.assertEqual(FAIL, classifier.classify(
+            _failure(_CodedError(errno.ENOENT))))
+
+    def testBaseClassPredicates(self):
+        """Predicates attached to a base class apply to subclasses."""
+        classifier = FailureClassifier(
+            predicates=[(Exception, lambda exc: 'retry' in str(exc))])
+        self.assertEqual(RETRY, classifier.classify(
+            _failure(ValueError('please retry'))))
+        self.assertEqual(FAIL, classifier.classify(
+            _failure(ValueError('no'))))
+
+    def testCached(self):
+        """Each type is compiled only once."""
+        compiled = []
+        classifier = FailureClassifier(retryable=[ValueError])
+        original = classifier._compile
+
+        def _compile(excType):
+            compiled.append(excType)
+            return original(excType)
+
+        classifier._compile = _compile
+        for _ in range(3):
+            classifier.classify(_failure(ValueError()))
+        self.assertEqual([ValueError], compiled)
+
+    def testFailureTesterProtocol(self):
+        """Calling a classifier returns C{None} for retryable failures and
+        the failure otherwise."""
+        classifier = FailureClassifier(retryable=[ValueError])
+        self.assertIdentical(None, classifier(_failure(ValueError())))
+        fail = _failure(KeyError())
+        self.assertIdentical(fail, classifier(fail))
+
+
+    def testHints(self):
+        """Hint rules extract a delay from the exception, most specific
+        type first, skipping rules that return C{None}."""
+        classifier = FailureClassifier(hints=[
+            (_CodedError, lambda exc: exc.code or None),
+            (Exception, lambda exc: 1.5)])
+        self.assertEqual(7, classifier.retryAfter(
+            _failure(_CodedError(7))))
+        self.assertEqual(1.5, classifier.retryAfter(
+            _failure(_CodedError(0))))
+        self.assertEqual(1.5, classifier.retryAfter(_failure(KeyError())))
+        self.assertIdentical(None,
+                             FailureClassifier().retryAfter(
+                                 _failure(KeyError())))
+
+    def testHintsCached(self):
+        """The hint rules for each type are compiled only once."""
+        compiled = []
+        classifier = FailureClassifier(hints=[(ValueError, lambda exc: 2)])
+        original = classifier._compileHints
+
+        def _compileHints(excType):
+            compiled.append(excType)
+            return original(excType)
+
+        classifier._compileHints = _compileHints
+        for _ in range(3):
+            classifier.retryAfter(_failure(ValueError()))
+        self.assertEqual([ValueError], compiled)
+
+
+class TestRetryingCallClassifier(unittest.TestCase):
+    """Test the use of a FailureClassifier as a failure tester."""
+
+    def testRetryThenFatal(self):
+        """Retryable failures are retried and a fatal one ends the call."""
+        errors = [ValueError(), KeyError()]
+
+        def _f():
+            raise errors.pop(0)
+
+        clock = task.Clock()
+        rc = RetryingCall(_f)
+        d = rc.start(backoffIterator=(0.0,) * 5, clock=clock,
+                     failureTester=FailureClassifier(retryable=[ValueError]))
+        clock.pump([0.0, 0.0])
+        self.assertEqual(2, len(rc.failures))
+        self.failUnlessFailure(d, KeyError)
+        return d
+
+    def testOldFailureTesterStillWorks(self):
+        """A plain failure tester function can still be used."""
+        clock = task.Clock()
+        rc = RetryingCall(lambda: defer.fail(KeyError()))
+        d = rc.start(clock=clock,
+                     failureTester=lambda f: f.trap(ValueError))
+        clock.advance(0.0)
+        self.failUnlessFailure(d, KeyError)
+        return d
+
+    def testHintsUsedByRetryAfterHints(self):
+        """A classifier's hints can lengthen the delay before a retry via
+        L{RetryAfterHints}."""
+        errors = [_CodedError(5)]
+
+        def _f():
+            if errors:
+                raise errors.pop(0)
+            return 3
+
+        clock = task.Clock()
+        classifier = FailureClassifier(
+            retryable=[_CodedError],
+            hints=[(_CodedError, lambda exc: exc.code)])
+        rc = RetryingCall(_f)
+        d = rc.start(backoffIterator=(0.0, 1.0), clock=clock,
+                     failureTester=classifier,
+                     retryAfter=RetryAfterHints([classifier.retryAfter]))
+        clock.advance(0.0)
+        self.assertEqual([5.0], [call.getTime()
+                                 for call in clock.getDelayedCalls()])
+        clock.advance(5.0)
+        d.addCallback(lambda result: self.assertEqual(3, result))
+        return d
@@ -0,0 +1,186 @@
+from twisted.trial import unittest
+from twisted.internet import defer, task
+
+from txretry.coalesce import CoalescingRetrier
+
+
+class _Backend(object):
+    """A function that fails a given number of times, then succeeds."""
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.calls = []
+
+    def __call__(self, *args, **kw):
+        self.calls.append((args, kw))
+        if len(self.calls) <= self.failures:
+            raise RuntimeError('unavailable')
+        return sum(args)
+
+
+class TestCoalescingRetrier(unittest.TestCase):
+    """Test the CoalescingRetrier class."""
+
+    def setUp(self):
+        self.clock = task.Clock()
+
+    def _retrier(self, **kw):
+        return CoalescingRetrier(lambda: iter((0.0, 1.0, 1.0)),
+                                 clock=self.clock, **kw)
+
+    def testCoalesced(self):
+        """Concurrent calls with equal arguments share one retry loop."""
+        backend = _Backend(failures=2)
+        retrier = self._retrier()
+        ds = [retrier.call(backend, 1, 2) for _ in range(5)]
+        self.clock.pump([0.0, 1.0, 1.0])
+        self.assertEqual(3, len(backend.calls))
+        self.assertEqual((5, 1, 4), (retrier.calls, retrier.loops,
+                                     retrier.coalesced))
+        d = defer.gatherResults(ds)
+        d.addCallback(self.assertEqual, [3] * 5)
+        return d
+
+    def testDifferentArguments(self):
+        """Calls with different arguments are not coalesced."""
+        backend = _Backend()
+        retrier = self._retrier()
+        retrier.call(backend, 1, 2)
+        retrier.call(backend, 1, 3)
+        retrier.call(backend, 1, 2, extra=True)
+        self.clock.advance(0.0)
+        self.assertEqual(3, len(backend.calls))
+
+    def testUnhashable(self):
+        """Calls with unhashable arguments run on their own."""
+        backend = _Backend()
+        retrier = self._retrier()
+        retrier.call(backend, [1])
+        retrier.call(backend, [1])
+        self.clock.advance(0.0)
+        self.assertEqual((2, 0), (retrier.loops, retrier.coalesced))
+
+    def testStartError(self):
+        """If a call cannot be started, the error is raised, and a later
+        call with equal arguments starts afresh rather than waiting for
+        it."""
+        backend = _Backend()
+        errors = [ValueError()]
+
+        def _factory():
+            if errors:
+                raise errors.pop()
+            return iter((0.0,))
+
+        retrier = CoalescingRetrier(_factory, clock=self.clock)
+        self.assertRaises(ValueError, retrier.call, backend, 1, 2)
+        d = retrier.call(backend, 1, 2)
+        self.clock.advance(0.0)
+        self.assertEqual((2, 0), (retrier.loops, retrier.coalesced))
+        d.addCallback(self.assertEqual, 3)
+        return d
+
+    def testBadStartKeywords(self):
+        """Bad keyword arguments for C{start} do not leave a call that
+        later callers would wait on."""
+        retrier = CoalescingRetrier(clock=self.clock, bogus=1)
+        for _ in range(2):
+            self.assertRaises(TypeError, retrier.call, len, 'abc')
+        self.assertEqual(0, retrier.coalesced)
+
+    def testFailureShared(self):
+        """Every waiting caller gets the failure the shared call gave up
+        with."""
+        backend = _Backend(failures=10)
+        retrier = self._retrier()
+        ds = [retrier.call(backend, 1) for _ in range(2)]
+        self.clock.pump([0.0, 1.0, 1.0])
+        for d in ds:
+            self.failUnlessFailure(d, RuntimeError)
+        return defer.gatherResults(ds)
+
+    def testNoCacheByDefault(self):
+        """Without a C{ttl}, a later call calls the function again."""
+        backend = _Backend()
+        retrier = self._retrier()
+        retrier.call(backend, 1)
+        self.clock.advance(0.0)
+        retrier.call(backend, 1)
+        self.clock.advance(0.0)
+        self.assertEqual(2, len(backend.calls))
+        self.assertEqual(0, retrier.cacheSize())
+
+    def testCache(self):
+        """With a C{ttl}, a successful result is reused until it expires."""
+        backend = _Backend()
+        retrier = self._retrier(ttl=5.0)
+        retrier.call(backend, 1)
+        self.clock.advance(0.0)
+        results = []
+        retrier.call(backend, 1).addCallback(results.append)
+        self.assertEqual([1], results)
+        self.assertEqual((1, 1), (len(backend.calls), retrier.cacheHits))
+        self.clock.advance(5.0)
+        retrier.call(backend, 1)
+        self.clock.advance(0.0)
+        self.assertEqual(2, len(backend.calls))
+
+    def testCacheFailures(self):
+        """Failures are cached only if C{cacheFailures} is C{True}."""
+        backend = _Backend(failures=10)
+        retrier = self._retrier(ttl=5.0)
+        self.failUnlessFailure(retrier.call(backend, 1), RuntimeError)
+        self.clock.pump([0.0, 1.0, 1.0])
+        self.assertEqual(0, retrier.cacheSize())
+
+        retrier = self._retrier(ttl=5.0, cacheFailures=True)
+        self.failUnlessFailure(retrier.call(backend, 1), RuntimeError)
+        self.clock.pump([0.0, 1.0, 1.0])
+        calls = len(backend.calls)
+        d = retrier.call(backend, 1)
+        self.assertEqual(calls, len(backend.calls))
+        return self.failUnlessFailure(d, RuntimeError)
+
+    def testLRU(self):
+        """The least recently used result is evicted when the cache is
+        full."""
+        backend = _Backend()
+        retrier = self._retrier(ttl=60.0, maxSize=2)
+        for value in (1, 2):
+            retrier.call(backend, value)
+        self.clock.advance(0.0)
+        retrier.call(backend, 1)
+        retrier.call(backend, 3)
+        self.clock.advance(0.0)
+        self.assertEqual(2, retrier.cacheSize())
+        retrier.call(backend, 1)
+        retrier.call(backend, 2)
+        self.clock.advance(0.0)
+        self.assertEqual([(1,), (2,), (3,), (2,)],
+                         [args for args, kw in backend.calls])
+
+    def testCancelOneCaller(self):
+        """Cancelling one caller leaves the shared call running for the
+        others."""
+        backend = _Backend()
+        retrier = self._retrier()
+        first = retrier.call(backend, 1)
+        second = retrier.call(backend, 1)
+        first.cancel()
+        self.failUnlessFailure(first, defer.CancelledError)
+        self.clock.advance(0.0)
+        self.assertEqual(1, len(backend.calls))
+        second.addCallback(self.assertEqual, 1)
+        return defer.gatherResults([first, second])
+
+    def testCancelAllCallers(self):
+        """Once every caller has cancelled, the shared call is cancelled
+        and its cancellation is not cached."""
+        backend = _Backend()
+        retrier = self._retrier(ttl=5.0, cacheFailures=True)
+        ds = [retrier.call(backend, 1) for _ in range(2)]
+        for d in ds:
+            d.cancel()
+            self.failUnlessFailure(d, defer.CancelledError)
+        self.assertEqual([], self.clock.getDelayedCalls())
+        self.assertEqual(0, retrier.cacheSize())
+        return defer.gatherResults(ds)
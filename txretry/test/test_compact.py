@@ -0,0 +1,231 @@
+from twisted.trial import unittest
+from twisted.internet import defer, task
+from twisted.logger import globalLogPublisher
+from twisted.python.failure import Failure
+
+from txretry.compact import BackoffSchedule, CompactRetryingCall
+from txretry.retry import RetryingCall, simpleBackoffIterator
+
+
+class _Failing(object):
+    """A function that raises the given exceptions in turn, then returns
+    a result."""
+    def __init__(self, exceptions, result=None):
+        self.exceptions = list(exceptions)
+        self.result = result
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.exceptions:
+            raise self.exceptions.pop(0)()
+        return self.result
+
+
+class TestBackoffSchedule(unittest.TestCase):
+    """Test the BackoffSchedule class."""
+
+    def testSameAsIterator(self):
+        """A schedule has the delays of the equivalent iterator."""
+        for kw in ({}, {'now': False}, {'maxResults': 20, 'maxDelay': 5.0},
+                   {'initDelay': 0.3, 'incFunc': lambda d: d * 1.7}):
+            self.assertEqual(tuple(simpleBackoffIterator(**kw)),
+                             BackoffSchedule(**kw).delays)
+
+    def testIterable(self):
+        """A schedule can be iterated, and has a length."""
+        schedule = BackoffSchedule(maxResults=3, now=False, initDelay=1.0)
+        self.assertEqual([1.0, 2.0, 4.0], list(schedule))
+        self.assertEqual(3, len(schedule))
+
+    def testSlots(self):
+        """A schedule has no instance dictionary."""
+        self.assertFalse(hasattr(BackoffSchedule(), '__dict__'))
+
+
+class TestCompactRetryingCall(unittest.TestCase):
+    """Test the CompactRetryingCall class."""
+
+    def setUp(self):
+        self.clock = task.Clock()
+
+    def _compare(self, exceptions, backoff, failureTester=None):
+        """
+        Run the same call as a L{RetryingCall} and a L{CompactRetryingCall},
+        and check they make the same attempts at the same times and have
+        the same outcome.
+        """
+        outcomes = []
+        for cls in RetryingCall, CompactRetryingCall:
+            clock = task.Clock()
+            times = []
+            f = _Failing(exceptions, result=7)
+
+            def _f(f=f, times=times, clock=clock):
+                times.append(clock.seconds())
+                return f()
+
+            rc = cls(_f)
+            results = []
+            d = rc.start(backoff(), failureTester, clock=clock)
+            d.addBoth(results.append)
+            clock.pump([0.0] + [1.0] * 20)
+            result = results[0]
+            if isinstance(result, Failure):
+                result = result.type
+            outcomes.append((times, result,
+                             [fail.type for fail in rc.failures]))
+        self.assertEqual(outcomes[0], outcomes[1])
+
+    def testSuccessParity(self):
+        """A call that eventually succeeds behaves as for RetryingCall."""
+        self._compare([ValueError] * 3,
+                      lambda: simpleBackoffIterator(initDelay=1.0))
+
+    def testExhaustedParity(self):
+        """A call that runs out of attempts behaves as for RetryingCall."""
+        self._compare([ValueError] * 5,
+                      lambda: simpleBackoffIterator(maxResults=3))
+
+    def testFailureTesterParity(self):
+        """A failure tester stops retries as for RetryingCall."""
+        self._compare([ValueError, KeyError],
+                      lambda: (0.0, 1.0, 1.0, 1.0),
+                      lambda fail: fail.trap(ValueError))
+
+    def testEmptyIteratorParity(self):
+        """An iterator with no delays fails with C{StopIteration}, as for
+        RetryingCall."""
+        self._compare([], lambda: iter([]))
+
+    def testEmptySequenceParity(self):
+        """An empty sequence of delays means the default schedule, as for
+        RetryingCall."""
+        self._compare([ValueError] * 2, lambda: ())
+
+    def testSchedule(self):
+        """A schedule gives the delays between attempts."""
+        f = _Failing([ValueError, ValueError], result=3)
+        rc = CompactRetryingCall(f)
+        schedule = BackoffSchedule(initDelay=1.0)
+        d = rc.start(schedule, clock=self.clock)
+        self.clock.advance(0.0)
+        self.clock.advance(0.9)
+        self.assertEqual(1, f.calls)
+        self.clock.advance(0.1)
+        self.assertEqual(2, f.calls)
+        self.clock.advance(2.0)
+        d.addCallback(self.assertEqual, 3)
+        return d
+
+    def testScheduleExhausted(self):
+        """When a schedule runs out, the first failure is returned."""
+        f = _Failing([KeyError, ValueError, ValueError])
+        d = CompactRetryingCall(f).start(BackoffSchedule(maxResults=2),
+                                         clock=self.clock)
+        self.clock.pump([0.0, 0.01])
+        self.assertEqual(2, f.calls)
+        return self.failUnlessFailure(d, KeyError)
+
+    def testFailureTesterRaises(self):
+        """If the failure tester raises, that is the result."""
+        def _tester(fail):
+            raise IndexError()
+        d = CompactRetryingCall(_Failing([ValueError])).start(
+            failureTester=_tester, clock=self.clock)
+        self.clock.advance(0.0)
+        return self.failUnlessFailure(d, IndexError)
+
+    def testDeferredResult(self):
+        """The function may return a C{Deferred}."""
+        results = [defer.fail(ValueError()), defer.succeed(5)]
+        d = CompactRetryingCall(results.pop, 0).start(
+            (0.0, 1.0), clock=self.clock)
+        self.clock.pump([0.0, 1.0])
+        d.addCallback(self.assertEqual, 5)
+        return d
+
+    def testArguments(self):
+        """Arguments are passed to the function."""
+        d = CompactRetryingCall(lambda x, y: x * y, 6, y=7).start(
+            clock=self.clock)
+        self.clock.advance(0.0)
+        d.addCallback(self.assertEqual, 42)
+        return d
+
+    def testClockAttribute(self):
+        """The clock attribute is used when no clock is given to
+        C{start}."""
+        self.patch(CompactRetryingCall, 'clock', self.clock)
+        d = CompactRetryingCall(lambda: 1).start()
+        self.assertEqual(1, len(self.clock.getDelayedCalls()))
+        self.clock.advance(0.0)
+        return d
+
+    def testSlots(self):
+        """Instances have no instance dictionary, and no failure list until
+        a call fails."""
+        rc = CompactRetryingCall(lambda: None)
+        self.assertFalse(hasattr(rc, '__dict__'))
+        self.assertIdentical(None, rc._failures)
+
+    def testCancelScheduled(self):
+        """Cancelling before an attempt is made stops it being made."""
+        f = _Failing([])
+        d = CompactRetryingCall(f).start(clock=self.clock)
+        d.cancel()
+        self.assertEqual([], self.clock.getDelayedCalls())
+        self.assertEqual(0, f.calls)
+        return self.failUnlessFailure(d, defer.CancelledError)
+
+    def testCancelInFlight(self):
+        """Cancelling during an attempt cancels its C{Deferred} and no
+        further attempts are made."""
+        attempts = []
+
+        def _f():
+            attempts.append(defer.Deferred())
+            return attempts[-1]
+
+        d = CompactRetryingCall(_f).start(clock=self.clock)
+        self.clock.advance(0.0)
+        d.cancel()
+        self.assertTrue(attempts[0].called)
+        self.assertEqual([], self.clock.getDelayedCalls())
+        self.assertEqual(1, len(attempts))
+        return self.failUnlessFailure(d, defer.CancelledError)
+
+    def testCancelClosesGenerator(self):
+        """Cancelling closes a back-off generator."""
+        closed = []
+
+        def _backoff():
+            try:
+                yield 0.0
+            finally:
+                closed.append(True)
+
+        d = CompactRetryingCall(lambda: None).start(_backoff(),
+                                                    clock=self.clock)
+        d.cancel()
+        self.assertEqual([True], closed)
+        return self.failUnlessFailure(d, defer.CancelledError)
+
+    def testRetryLogged(self):
+        """Retries emit the same log event as for RetryingCall."""
+        events = []
+
+        def _observe(event):
+            if event.get('log_namespace') == 'txretry.retry':
+                events.append(event)
+
+        globalLogPublisher.addObserver(_observe)
+        self.addCleanup(globalLogPublisher.removeObserver, _observe)
+        f = _Failing([ValueError], result=1)
+        d = CompactRetryingCall(f).start((0.0, 2.0), clock=self.clock)
+        self.clock.pump([0.0, 2.0])
+        self.assertEqual(1, len(events))
+        self.assertEqual((f, 2, 2.0, ValueError),
+                         (events[0]['function'], events[0]['attempt'],
+                          events[0]['delay'], events[0]['exceptionType']))
+        return d
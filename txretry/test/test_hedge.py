@@ -0,0 +1,151 @@
+from twisted.trial import unittest
+from twisted.internet import defer, task
+
+from txretry.hedge import Hedging
+from txretry.retry import RetryingCall
+
+
+class _Copies(object):
+    """A function that returns a new, saved, C{Deferred} each time it is
+    called, recording cancellations."""
+    def __init__(self):
+        self.copies = []
+        self.cancelled = []
+
+    def __call__(self):
+        d = defer.Deferred(lambda d: self.cancelled.append(d))
+        self.copies.append(d)
+        return d
+
+
+class TestHedging(unittest.TestCase):
+    """Test the Hedging class."""
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.func = _Copies()
+
+    def testNoHedgeWhenFast(self):
+        """A fast call is not hedged and leaves no timer pending."""
+        hedging = Hedging(delay=1.0)
+        d = hedging.run(self.clock, self.func)
+        self.func.copies[0].callback(3)
+        self.assertEqual([], self.clock.getDelayedCalls())
+        self.assertEqual((1, 0, 0), (hedging.attempts, hedging.hedged,
+                                     hedging.hedges))
+        d.addCallback(lambda result: self.assertEqual(3, result))
+        return d
+
+    def testHedgeWins(self):
+        """A slow call is hedged after the delay. If the duplicate finishes
+        first its result is used and the original is cancelled."""
+        hedging = Hedging(delay=1.0)
+        d = hedging.run(self.clock, self.func)
+        self.clock.advance(1.0)
+        self.assertEqual(2, len(self.func.copies))
+        self.func.copies[1].callback(4)
+        self.assertEqual([self.func.copies[0]], self.func.cancelled)
+        self.assertEqual((1, 1, 1), (hedging.hedged, hedging.hedges,
+                                     hedging.hedgeWins))
+        d.addCallback(lambda result: self.assertEqual(4, result))
+        return d
+
+    def testOriginalWins(self):
+        """If the original call finishes first, the duplicate is
+        cancelled."""
+        hedging = Hedging(delay=1.0)
+        d = hedging.run(self.clock, self.func)
+        self.clock.advance(1.0)
+        self.func.copies[0].callback(5)
+        self.assertEqual([self.func.copies[1]], self.func.cancelled)
+        self.assertEqual(0, hedging.hedgeWins)
+        d.addCallback(lambda result: self.assertEqual(5, result))
+        return d
+
+    def testMaxHedges(self):
+        """No more than C{maxHedges} duplicates are launched."""
+        hedging = Hedging(delay=1.0, maxHedges=2)
+        d = hedging.run(self.clock, self.func)
+        self.clock.pump([1.0, 1.0, 1.0, 1.0])
+        self.assertEqual(3, len(self.func.copies))
+        self.assertEqual([], self.clock.getDelayedCalls())
+        self.assertEqual(2, hedging.hedges)
+        self.func.copies[2].callback(None)
+        return d
+
+    def testFailureWaitsForOthers(self):
+        """A failed copy does not fail the attempt while another copy is
+        still in progress."""
+        hedging = Hedging(delay=1.0)
+        d = hedging.run(self.clock, self.func)
+        self.clock.advance(1.0)
+        self.func.copies[0].errback(ValueError())
+        self.assertFalse(d.called)
+        self.func.copies[1].callback(6)
+        d.addCallback(lambda result: self.assertEqual(6, result))
+        return d
+
+    def testAllFail(self):
+        """The attempt fails when all copies launched have failed, and no
+        further duplicate is launched."""
+        hedging = Hedging(delay=1.0, maxHedges=2)
+        d = hedging.run(self.clock, self.func)
+        self.clock.advance(1.0)
+        self.func.copies[0].errback(ValueError())
+        self.func.copies[1].errback(KeyError())
+        self.assertEqual([], self.clock.getDelayedCalls())
+        self.assertEqual(2, len(self.func.copies))
+        self.failUnlessFailure(d, KeyError)
+        return d
+
+    def testCancel(self):
+        """Cancelling the attempt cancels all copies and the timer."""
+        hedging = Hedging(delay=1.0, maxHedges=2)
+        d = hedging.run(self.clock, self.func)
+        self.clock.advance(1.0)
+        d.cancel()
+        self.assertEqual(self.func.copies, self.func.cancelled)
+        self.assertEqual([], self.clock.getDelayedCalls())
+        self.failUnlessFailure(d, defer.CancelledError)
+        return d
+
+    def testPercentileDelay(self):
+        """Once enough latencies have been seen, the hedge delay is the
+        given percentile of them."""
+        hedging = Hedging(delay=1.0, percentile=0.5, minSamples=3)
+        for latency in (0.02, 0.02, 3.0):
+            self.assertEqual(1.0, hedging.hedgeDelay())
+            hedging.latency.record(latency)
+        self.assertEqual(0.025, hedging.hedgeDelay())
+
+
+class TestRetryingCallHedging(unittest.TestCase):
+    """Test the hedging argument to C{RetryingCall.start}."""
+
+    def testHedgedCall(self):
+        """A slow attempt is hedged, and the result of the duplicate is
+        the result of the call."""
+        clock = task.Clock()
+        func = _Copies()
+        hedging = Hedging(delay=0.5)
+        d = RetryingCall(func).start(hedging=hedging, clock=clock)
+        clock.advance(0.0)
+        clock.advance(0.5)
+        func.copies[1].callback(7)
+        d.addCallback(lambda result: self.assertEqual(7, result))
+        d.addCallback(lambda _: self.assertEqual(1, hedging.hedgeWins))
+        return d
+
+    def testFailedAttemptRetried(self):
+        """An attempt whose copies all fail is retried as usual."""
+        clock = task.Clock()
+        func = _Copies()
+        d = RetryingCall(func).start(backoffIterator=(0.0, 0.0),
+                                     hedging=Hedging(delay=0.5), clock=clock)
+        clock.advance(0.0)
+        func.copies[0].errback(ValueError())
+        clock.advance(0.0)
+        self.assertEqual(2, len(func.copies))
+        func.copies[1].callback(8)
+        d.addCallback(lambda result: self.assertEqual(8, result))
+        return d
@@ -0,0 +1,103 @@
+from twisted.trial import unittest
+from twisted.internet import task
+from twisted.python.failure import Failure
+
+from txretry.hints import RetryAfterHints, retryAfterAttribute
+from txretry.retry import RetryingCall
+
+
+class _Throttled(Exception):
+    """An exception carrying a suggested wait."""
+    def __init__(self, retryAfter):
+        Exception.__init__(self, retryAfter)
+        self.retryAfter = retryAfter
+
+
+class TestRetryAfterAttribute(unittest.TestCase):
+    """Test the retryAfterAttribute extractor."""
+
+    def testAttribute(self):
+        """The C{retryAfter} attribute of the exception is returned."""
+        self.assertEqual(3.0, retryAfterAttribute(Failure(_Throttled(3.0))))
+
+    def testNoAttribute(self):
+        """C{None} is returned if the exception has no hint."""
+        self.assertIdentical(None, retryAfterAttribute(Failure(KeyError())))
+
+
+class TestRetryAfterHints(unittest.TestCase):
+    """Test the RetryAfterHints class."""
+
+    def testNoHint(self):
+        """Without a hint, the delay is unchanged."""
+        hints = RetryAfterHints()
+        self.assertEqual(1.0, hints.adjust(Failure(KeyError()), 1.0))
+        self.assertEqual((0, 0), (hints.seen, hints.used))
+
+    def testRaise(self):
+        """A hint longer than the delay raises it."""
+        hints = RetryAfterHints()
+        self.assertEqual(5.0, hints.adjust(Failure(_Throttled(5.0)), 1.0))
+        self.assertEqual((1, 1), (hints.seen, hints.used))
+
+    def testShorterHintIgnored(self):
+        """By default, a hint shorter than the delay is not used."""
+        hints = RetryAfterHints()
+        self.assertEqual(2.0, hints.adjust(Failure(_Throttled(0.5)), 2.0))
+        self.assertEqual((1, 0), (hints.seen, hints.used))
+
+    def testOverride(self):
+        """With C{override}, a shorter hint replaces the delay."""
+        hints = RetryAfterHints(override=True)
+        self.assertEqual(0.5, hints.adjust(Failure(_Throttled(0.5)), 2.0))
+        self.assertEqual(1, hints.used)
+
+    def testCap(self):
+        """Hints are capped at C{maxDelay}."""
+        hints = RetryAfterHints(maxDelay=10.0)
+        self.assertEqual(10.0, hints.adjust(Failure(_Throttled(600)), 1.0))
+        self.assertEqual(1, hints.capped)
+
+    def testExtractors(self):
+        """The first extractor to find a hint is used."""
+        hints = RetryAfterHints(extractors=[lambda f: None,
+                                            lambda f: 4.0,
+                                            lambda f: 9.0])
+        self.assertEqual(4.0, hints.adjust(Failure(KeyError()), 1.0))
+
+
+class TestRetryingCallRetryAfter(unittest.TestCase):
+    """Test the retryAfter argument to C{RetryingCall.start}."""
+
+    def testHintDelaysRetry(self):
+        """A hint carried by a failure delays the next attempt."""
+        clock = task.Clock()
+        calls = []
+
+        def _f():
+            calls.append(clock.seconds())
+            if len(calls) == 1:
+                raise _Throttled(5.0)
+
+        hints = RetryAfterHints()
+        d = RetryingCall(_f).start(backoffIterator=(0.0, 1.0),
+                                   retryAfter=hints, clock=clock)
+        clock.pump([0.0, 1.0, 4.0])
+        self.assertEqual([0.0, 5.0], calls)
+        self.assertEqual(1, hints.used)
+        return d
+
+    def testHintAndDeadline(self):
+        """A hinted delay that would pass the deadline ends the call."""
+        clock = task.Clock()
+
+        def _f():
+            raise _Throttled(60.0)
+
+        rc = RetryingCall(_f)
+        d = rc.start(backoffIterator=(0.0, 1.0), deadline=10.0,
+                     retryAfter=RetryAfterHints(), clock=clock)
+        clock.advance(0.0)
+        self.assertEqual([], clock.getDelayedCalls())
+        self.failUnlessFailure(d, _Throttled)
+        return d
@@ -0,0 +1,102 @@
+from twisted.trial import unittest
+from twisted.internet import defer, task
+from twisted.python.failure import Failure
+
+from txretry.history import FailureHistory
+from txretry.retry import RetryingCall
+
+
+def _failure(excClass):
+    """Make a C{Failure} (with a traceback) for an exception class.
+
+    @param excClass: the exception class to raise.
+    @return: a C{Failure} wrapping an instance of C{excClass}.
+    """
+    try:
+        raise excClass()
+    except excClass:
+        return Failure()
+
+
+class TestFailureHistory(unittest.TestCase):
+    """Test the FailureHistory class."""
+
+    def testEmpty(self):
+        """A new history is empty and false."""
+        history = FailureHistory()
+        self.assertEqual(0, len(history))
+        self.assertFalse(history)
+        self.assertEqual([], list(history))
+        self.assertRaises(IndexError, lambda: history[0])
+
+    def testRetention(self):
+        """The first and the C{keepLast} most recent failures are kept."""
+        history = FailureHistory(keepLast=2)
+        fails = [_failure(ValueError) for _ in range(5)]
+        for fail in fails:
+            history.append(fail)
+        self.assertEqual(3, len(history))
+        self.assertEqual([fails[0], fails[3], fails[4]], list(history))
+        self.assertIs(fails[0], history[0])
+        self.assertIs(fails[4], history[-1])
+        self.assertEqual([fails[3], fails[4]], history[1:])
+
+    def testKeepNoneRecent(self):
+        """With C{keepLast} of zero only the first failure is kept."""
+        history = FailureHistory(keepLast=0)
+        first = _failure(ValueError)
+        history.append(first)
+        history.append(_failure(ValueError))
+        self.assertEqual([first], list(history))
+
+    def testCounts(self):
+        """Every failure is counted, by exception type."""
+        history = FailureHistory(keepLast=0)
+        for excClass in (ValueError, KeyError, ValueError):
+            history.append(_failure(excClass))
+        self.assertEqual(3, history.total)
+        self.assertEqual({ValueError: 2, KeyError: 1}, history.counts)
+
+    def testCleaned(self):
+        """Retained failures hold no traceback or frame references."""
+        history = FailureHistory()
+        history.append(_failure(ValueError))
+        fail = history[0]
+        self.assertIdentical(None, fail.tb)
+        self.assertIdentical(None,
+                             getattr(fail.value, '__traceback__', None))
+        self.assertIn('ValueError', fail.getTraceback())
+
+
+class TestRetryingCallFailureHistory(unittest.TestCase):
+    """Test the keepFailures argument to C{RetryingCall.start}."""
+
+    def testDefaultList(self):
+        """By default all failures are kept in a list."""
+        clock = task.Clock()
+        rc = RetryingCall(lambda: defer.fail(ValueError()))
+        d = rc.start(backoffIterator=(0.0,) * 4, clock=clock)
+        clock.pump([0.0] * 4)
+        self.assertEqual(4, len(rc.failures))
+        self.assertIsInstance(rc.failures, list)
+        self.failUnlessFailure(d, ValueError)
+        return d
+
+    def testBounded(self):
+        """With keepFailures, failures are kept in a bounded history and
+        the first failure is still the one the call fails with."""
+        errors = [KeyError, ValueError, ValueError, ValueError]
+
+        def _f():
+            raise errors.pop(0)()
+
+        clock = task.Clock()
+        rc = RetryingCall(_f)
+        d = rc.start(backoffIterator=(0.0,) * 4, keepFailures=1,
+                     clock=clock)
+        clock.pump([0.0] * 4)
+        self.assertEqual(2, len(rc.failures))
+        self.assertEqual(4, rc.failures.total)
+        self.assertEqual({KeyError: 1, ValueError: 3}, rc.failures.counts)
+        self.failUnlessFailure(d, KeyError)
+        return d
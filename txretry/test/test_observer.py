@@ -0,0 +1,193 @@
+from twisted.trial import unittest
+from twisted.internet import defer, task
+from twisted.python.failure import Failure
+
+from txretry.observer import (
+    LatencyHistogram, ObserverGroup, RetryObserver, RetryStats)
+from txretry.retry import RetryingCall
+
+
+class _RecordingObserver(RetryObserver):
+    """A L{RetryObserver} that records the calls made to it."""
+    def __init__(self):
+        self.events = []
+
+    def attemptStarted(self, func, attempt):
+        self.events.append(('attemptStarted', attempt))
+
+    def attemptFailed(self, func, attempt, fail, latency):
+        self.events.append(('attemptFailed', attempt, fail.type, latency))
+
+    def retryScheduled(self, func, attempt, delay):
+        self.events.append(('retryScheduled', attempt, delay))
+
+    def succeeded(self, func, attempt, latency, elapsed):
+        self.events.append(('succeeded', attempt, latency, elapsed))
+
+    def gaveUp(self, func, attempt, fail, elapsed):
+        self.events.append(('gaveUp', attempt, fail.type, elapsed))
+
+
+class TestLatencyHistogram(unittest.TestCase):
+    """Test the LatencyHistogram class."""
+
+    def testRecord(self):
+        """Durations are counted in the right buckets."""
+        histogram = LatencyHistogram(bounds=(1.0, 2.0))
+        for duration in (0.5, 1.0, 1.5, 3.0):
+            histogram.record(duration)
+        self.assertEqual([2, 1, 1], histogram.counts)
+        self.assertEqual(4, histogram.total)
+        self.assertEqual(6.0, histogram.sum)
+
+    def testPercentile(self):
+        """Percentiles are estimated by bucket upper bounds."""
+        histogram = LatencyHistogram(bounds=(1.0, 2.0))
+        for duration in (0.5, 0.5, 0.5, 1.5):
+            histogram.record(duration)
+        self.assertEqual(1.0, histogram.percentile(0.5))
+        self.assertEqual(2.0, histogram.percentile(0.99))
+
+    def testPercentileEmpty(self):
+        """An empty histogram has no percentiles."""
+        self.assertIdentical(None, LatencyHistogram().percentile(0.5))
+
+
+class TestRetryingCallObserver(unittest.TestCase):
+    """Test the observer argument to C{RetryingCall.start}."""
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.observer = _RecordingObserver()
+
+    def testSuccessAfterRetry(self):
+        """An observer is told about each attempt, the retry and the
+        success."""
+        attempts = []
+
+        def _f():
+            attempts.append(defer.Deferred())
+            return attempts[-1]
+
+        rc = RetryingCall(_f)
+        d = rc.start(backoffIterator=(0.0, 2.0), observer=self.observer,
+                     clock=self.clock)
+        self.clock.advance(0.0)
+        self.clock.advance(1.0)
+        attempts[0].errback(ValueError())
+        self.clock.advance(2.0)
+        self.clock.advance(0.5)
+        attempts[1].callback(None)
+        self.assertEqual([('attemptStarted', 1),
+                          ('attemptFailed', 1, ValueError, 1.0),
+                          ('retryScheduled', 2, 2.0),
+                          ('attemptStarted', 2),
+                          ('succeeded', 2, 0.5, 3.5)],
+                         self.observer.events)
+        return d
+
+    def testGiveUp(self):
+        """An observer is told when the call gives up."""
+        rc = RetryingCall(lambda: defer.fail(KeyError()))
+        d = rc.start(failureTester=lambda f: f, observer=self.observer,
+                     clock=self.clock)
+        self.clock.advance(0.0)
+        self.assertEqual([('attemptStarted', 1),
+                          ('attemptFailed', 1, KeyError, 0.0),
+                          ('gaveUp', 1, KeyError, 0.0)],
+                         self.observer.events)
+        self.failUnlessFailure(d, KeyError)
+        return d
+
+    def testCancel(self):
+        """An observer is told when the call is cancelled."""
+        rc = RetryingCall(lambda: None)
+        d = rc.start(backoffIterator=(1.0,), observer=self.observer,
+                     clock=self.clock)
+        d.cancel()
+        self.assertEqual([('gaveUp', 1, defer.CancelledError, 0.0)],
+                         self.observer.events)
+        self.failUnlessFailure(d, defer.CancelledError)
+        return d
+
+
+class TestObserverGroup(unittest.TestCase):
+    """Test the ObserverGroup class."""
+
+    def testAllObserversTold(self):
+        """Each observer in a group is told everything, in order."""
+        clock = task.Clock()
+        first = _RecordingObserver()
+        second = _RecordingObserver()
+        failing = [ValueError]
+
+        def _f():
+            if failing:
+                raise failing.pop()()
+            return 2
+
+        d = RetryingCall(_f).start(
+            backoffIterator=(0.0, 1.0), clock=clock,
+            observer=ObserverGroup([first, second]))
+        clock.pump([0.0, 1.0])
+        self.assertEqual([('attemptStarted', 1),
+                          ('attemptFailed', 1, ValueError, 0.0),
+                          ('retryScheduled', 2, 1.0),
+                          ('attemptStarted', 2),
+                          ('succeeded', 2, 0.0, 1.0)], first.events)
+        self.assertEqual(first.events, second.events)
+        d.addCallback(lambda result: self.assertEqual(2, result))
+        return d
+
+    def testGaveUp(self):
+        """Each observer in a group is told when a call gives up."""
+        first = _RecordingObserver()
+        second = _RecordingObserver()
+        group = ObserverGroup([first, second])
+        group.gaveUp(None, 3, Failure(KeyError()), 4.0)
+        self.assertEqual([('gaveUp', 3, KeyError, 4.0)], first.events)
+        self.assertEqual(first.events, second.events)
+
+
+class TestRetryStats(unittest.TestCase):
+    """Test the RetryStats aggregator."""
+
+    def testAggregates(self):
+        """Counters and histograms are kept per function."""
+        clock = task.Clock()
+        stats = RetryStats()
+        failing = [ValueError, ValueError]
+
+        def _f():
+            if failing:
+                raise failing.pop()()
+            return 1
+
+        def _g():
+            raise KeyError()
+
+        ds = [RetryingCall(_f).start(backoffIterator=(0.0, 1.0, 1.0),
+                                     observer=stats, clock=clock),
+              RetryingCall(_g).start(backoffIterator=(0.0,),
+                                     observer=stats, clock=clock)]
+        clock.pump([0.0, 1.0, 1.0])
+        self.assertEqual(set([_f, _g]), set(stats.functions()))
+
+        f = stats.forFunction(_f)
+        self.assertEqual(3, f.attempts)
+        self.assertEqual(2, f.failures)
+        self.assertEqual(2, f.retries)
+        self.assertEqual(2.0, f.backoff)
+        self.assertEqual(1, f.successes)
+        self.assertEqual(0, f.giveUps)
+        self.assertEqual({ValueError: 2}, f.exceptions)
+        self.assertEqual(3, f.attemptLatency.total)
+        self.assertEqual(1, f.callLatency.total)
+        self.assertEqual(2.0, f.callLatency.sum)
+
+        g = stats.forFunction(_g)
+        self.assertEqual(1, g.giveUps)
+        self.assertEqual({KeyError: 1}, g.exceptions)
+
+        ds[1].addErrback(lambda fail: fail.trap(KeyError))
+        return defer.gatherResults(ds)
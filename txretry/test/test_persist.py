@@ -0,0 +1,210 @@
+from twisted.trial import unittest
+from twisted.internet import defer, task
+
+from txretry.compact import BackoffSchedule
+from txretry.persist import PersistentRetryQueue, SQLiteRetryStore
+
+
+class TestSQLiteRetryStore(unittest.TestCase):
+    """Test the SQLiteRetryStore class."""
+
+    def setUp(self):
+        self.path = self.mktemp()
+        self.store = SQLiteRetryStore(self.path, batchSize=3)
+        self.addCleanup(self.store.close)
+
+    def testPendingOrder(self):
+        """Retries are returned in the order they are due."""
+        self.store.add('f', (1,), {}, 0, 30.0)
+        self.store.add('g', (), {'x': 2}, 1, 10.0)
+        self.assertEqual([('g', (), {'x': 2}, 1, 10.0),
+                          ('f', (1,), {}, 0, 30.0)],
+                         [row[1:] for row in self.store.pending()])
+
+    def testUpdateAndRemove(self):
+        """Retries can be updated and removed."""
+        first = self.store.add('f', (1,), {}, 0, 30.0)
+        second = self.store.add('f', (2,), {}, 0, 40.0)
+        self.store.update(first, 2, 50.0)
+        self.store.remove(second)
+        self.assertEqual([(first, 'f', (1,), {}, 2, 50.0)],
+                         list(self.store.pending()))
+
+    def testBatchedFlush(self):
+        """Changes are committed once a batch is complete."""
+        self.store.add('f', (), {}, 0, 1.0)
+        self.store.add('f', (), {}, 0, 2.0)
+        self.assertEqual((2, 0), (self.store.unflushed, self.store.flushes))
+        self.store.add('f', (), {}, 0, 3.0)
+        self.assertEqual((0, 1), (self.store.unflushed, self.store.flushes))
+
+    def testUnflushedNotDurable(self):
+        """Only flushed changes are seen by a new connection."""
+        self.store.add('f', (), {}, 0, 1.0)
+        self.assertEqual([], list(SQLiteRetryStore(self.path).pending()))
+        self.store.flush()
+        self.assertEqual(1, len(list(SQLiteRetryStore(self.path).pending())))
+
+
+class _Failing(object):
+    """A function that fails a given number of times, then returns the sum
+    of its arguments."""
+    def __init__(self, failures):
+        self.failures = failures
+        self.calls = []
+
+    def __call__(self, *args, **kw):
+        self.calls.append((args, kw))
+        if len(self.calls) <= self.failures:
+            raise RuntimeError('unavailable')
+        return sum(args) + sum(kw.values())
+
+
+class TestPersistentRetryQueue(unittest.TestCase):
+    """Test the PersistentRetryQueue class."""
+
+    def setUp(self):
+        self.path = self.mktemp()
+        self.clock = task.Clock()
+        self.clock.advance(1000.0)
+        self.schedule = BackoffSchedule(maxResults=4, initDelay=10.0)
+
+    def _queue(self, **kw):
+        store = SQLiteRetryStore(self.path)
+        self.addCleanup(store.close)
+        return PersistentRetryQueue(store, self.schedule, clock=self.clock,
+                                    **kw), store
+
+    def testCall(self):
+        """A call is retried according to the schedule and removed from
+        the store when it succeeds."""
+        f = _Failing(2)
+        queue, store = self._queue()
+        queue.register('f', f)
+        d = queue.call('f', 1, y=2)
+        self.clock.pump([0.0, 10.0, 20.0])
+        self.assertEqual(3, len(f.calls))
+        self.assertEqual(([], 0), (list(store.pending()), queue.pending))
+        d.addCallback(self.assertEqual, 3)
+        return d
+
+    def testUnregistered(self):
+        """Calling an unregistered function raises C{KeyError}."""
+        queue, store = self._queue()
+        self.assertRaises(KeyError, queue.call, 'f')
+
+    def testStoredWhilePending(self):
+        """A pending retry is stored with its next attempt and due time."""
+        queue, store = self._queue()
+        queue.register('f', _Failing(10))
+        queue.call('f', 5)
+        self.clock.advance(0.0)
+        self.assertEqual([('f', (5,), {}, 1, 1010.0)],
+                         [row[1:] for row in store.pending()])
+
+    def testGiveUp(self):
+        """When the schedule runs out the first failure is returned, and
+        the retry is removed."""
+        queue, store = self._queue()
+        queue.register('f', _Failing(10))
+        d = queue.call('f')
+        self.clock.pump([0.0, 10.0, 20.0, 40.0])
+        self.assertEqual([], list(store.pending()))
+        return self.failUnlessFailure(d, RuntimeError)
+
+    def testFailureTester(self):
+        """The failure tester can stop retries."""
+        queue, store = self._queue(
+            failureTester=lambda fail: fail.trap(KeyError))
+        queue.register('f', _Failing(10))
+        d = queue.call('f')
+        self.clock.advance(0.0)
+        self.assertEqual(0, queue.pending)
+        return self.failUnlessFailure(d, RuntimeError)
+
+    def testFlushInterval(self):
+        """Changes are flushed within the flush interval."""
+        queue, store = self._queue(flushInterval=2.0)
+        queue.register('f', _Failing(10))
+        queue.call('f')
+        self.assertEqual(1, store.unflushed)
+        self.clock.advance(2.0)
+        self.assertEqual((0, 1), (store.unflushed, store.flushes))
+
+    def testResume(self):
+        """After a restart, stored retries are made when they are due, and
+        their results reported."""
+        queue, store = self._queue()
+        queue.register('f', _Failing(10))
+        queue.call('f', 1)
+        queue.call('f', 2)
+        self.clock.advance(0.0)
+        queue.stop()
+        self.assertEqual([], self.clock.getDelayedCalls())
+
+        self.clock.advance(5.0)
+        results = []
+        queue, store = self._queue(
+            onResult=lambda *args: results.append(args))
+        f = _Failing(0)
+        queue.register('f', f)
+        self.assertEqual(2, queue.resume())
+        self.clock.advance(4.0)
+        self.assertEqual([], f.calls)
+        self.clock.advance(1.0)
+        self.assertEqual([((1,), {}), ((2,), {})], f.calls)
+        self.assertEqual([('f', (1,), {}, True, 1),
+                          ('f', (2,), {}, True, 2)], results)
+        self.assertEqual([], list(store.pending()))
+
+    def testResumeOverdue(self):
+        """Overdue retries are made at once."""
+        queue, store = self._queue()
+        queue.register('f', _Failing(10))
+        queue.call('f', 1)
+        self.clock.advance(0.0)
+        queue.stop()
+        self.clock.advance(100.0)
+        queue, store = self._queue()
+        f = _Failing(0)
+        queue.register('f', f)
+        queue.resume()
+        self.clock.advance(0.0)
+        self.assertEqual(1, len(f.calls))
+
+    def testResumeUnregistered(self):
+        """Retries of unregistered functions are left in the store."""
+        queue, store = self._queue()
+        queue.register('f', _Failing(10))
+        queue.call('f', 1)
+        queue.stop()
+        queue, store = self._queue()
+        self.assertEqual(0, queue.resume())
+        self.assertEqual(1, len(list(store.pending())))
+
+    def testCancel(self):
+        """Cancelling a call removes its retry."""
+        queue, store = self._queue()
+        f = _Failing(10)
+        queue.register('f', f)
+        d = queue.call('f')
+        d.cancel()
+        # Only the flush timer is left.
+        self.assertEqual(1, len(self.clock.getDelayedCalls()))
+        self.assertEqual(([], 0), (list(store.pending()), queue.pending))
+        self.clock.advance(10.0)
+        self.assertEqual([], f.calls)
+        return self.failUnlessFailure(d, defer.CancelledError)
+
+    def testCancelInProgress(self):
+        """Cancelling a call cancels an attempt in progress."""
+        queue, store = self._queue()
+        attempts = []
+        queue.register('f', lambda: attempts.append(defer.Deferred()) or
+                       attempts[-1])
+        d = queue.call('f')
+        self.clock.advance(0.0)
+        d.cancel()
+        self.assertTrue(attempts[0].called)
+        self.assertEqual([], list(store.pending()))
+        return self.failUnlessFailure(d, defer.CancelledError)
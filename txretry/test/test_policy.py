@@ -0,0 +1,110 @@
+from functools import partial
+
+from twisted.trial import unittest
+from twisted.internet import defer, task
+
+from txretry.policy import RetryPolicy, retrying
+from txretry.retry import simpleBackoffIterator
+
+
+class TestRetryPolicy(unittest.TestCase):
+    """Test the RetryPolicy class."""
+
+    def setUp(self):
+        self.clock = task.Clock()
+
+    def testDefaults(self):
+        """By default, the simple back-off schedule is used and every
+        failure is retried."""
+        policy = RetryPolicy()
+        self.assertIdentical(simpleBackoffIterator,
+                             policy.backoffIteratorFactory)
+        self.assertIdentical(None, policy.failureTester(None))
+        self.assertEqual({}, policy.options())
+
+    def testImmutable(self):
+        """Attributes of a policy cannot be set."""
+        policy = RetryPolicy()
+        self.assertRaises(AttributeError, setattr, policy,
+                          'failureTester', None)
+        self.assertRaises(AttributeError, setattr, policy, 'other', None)
+
+    def testOptionsCopied(self):
+        """Changing the options returned by C{options} does not change the
+        policy."""
+        policy = RetryPolicy(deadline=10.0)
+        policy.options()['deadline'] = 20.0
+        self.assertEqual({'deadline': 10.0}, policy.options())
+
+    def testBackoffIteratorRejected(self):
+        """A single back-off iterator cannot be part of a policy."""
+        self.assertRaises(TypeError, RetryPolicy, backoffIterator=[0.0])
+
+    def testReplace(self):
+        """C{replace} makes a new policy with some values changed."""
+        policy = RetryPolicy(deadline=10.0, attemptTimeout=1.0)
+        changed = policy.replace(deadline=20.0)
+        self.assertEqual({'deadline': 20.0, 'attemptTimeout': 1.0},
+                         changed.options())
+        self.assertEqual({'deadline': 10.0, 'attemptTimeout': 1.0},
+                         policy.options())
+
+    def testCall(self):
+        """A call is retried according to the policy."""
+        calls = []
+
+        def _f(x, y=0):
+            calls.append(self.clock.seconds())
+            if len(calls) < 3:
+                raise RuntimeError()
+            return x + y
+
+        policy = RetryPolicy(partial(iter, (0.0, 1.0, 2.0)),
+                             clock=self.clock)
+        d = policy.call(_f, 1, y=2)
+        self.clock.pump([0.0, 1.0, 2.0])
+        self.assertEqual([0.0, 1.0, 3.0], calls)
+        d.addCallback(self.assertEqual, 3)
+        return d
+
+    def testFailureTester(self):
+        """The policy's failure tester decides which failures are
+        retried."""
+        def _f():
+            raise KeyError()
+
+        policy = RetryPolicy(partial(iter, (0.0, 1.0)),
+                             lambda fail: fail.trap(RuntimeError),
+                             clock=self.clock)
+        d = policy.call(_f)
+        self.clock.advance(0.0)
+        self.assertEqual([], self.clock.getDelayedCalls())
+        return self.failUnlessFailure(d, KeyError)
+
+
+class TestRetrying(unittest.TestCase):
+    """Test the retrying decorator."""
+
+    def testDecorator(self):
+        """A decorated function returns a C{Deferred} for a retried call,
+        and keeps its name and policy."""
+        clock = task.Clock()
+        policy = RetryPolicy(partial(iter, (0.0, 1.0)), clock=clock)
+        calls = []
+
+        @retrying(policy)
+        def double(x):
+            """Double a number."""
+            calls.append(x)
+            if len(calls) == 1:
+                return defer.fail(RuntimeError())
+            return defer.succeed(2 * x)
+
+        d = double(21)
+        clock.pump([0.0, 1.0])
+        self.assertEqual([21, 21], calls)
+        self.assertEqual('double', double.__name__)
+        self.assertEqual('Double a number.', double.__doc__)
+        self.assertIdentical(policy, double.retryPolicy)
+        d.addCallback(self.assertEqual, 42)
+        return d
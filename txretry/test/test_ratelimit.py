@@ -0,0 +1,58 @@
+from random import Random
+
+from twisted.trial import unittest
+from twisted.internet import task
+
+from txretry.ratelimit import EventRateLimiter, EventSampler
+
+
+class TestEventRateLimiter(unittest.TestCase):
+    """Test the EventRateLimiter class."""
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.limiter = EventRateLimiter(maxEvents=2, interval=10.0,
+                                        clock=self.clock)
+
+    def testLimit(self):
+        """At most C{maxEvents} events are allowed per interval, and
+        suppressed events are counted."""
+        self.assertTrue(self.limiter.allow('a'))
+        self.assertTrue(self.limiter.allow('a'))
+        self.assertFalse(self.limiter.allow('a'))
+        self.assertFalse(self.limiter.allow('a'))
+        self.assertEqual({'a': 2}, self.limiter.suppressed)
+
+    def testNewInterval(self):
+        """Events are allowed again once the interval has passed."""
+        self.limiter.allow('a')
+        self.limiter.allow('a')
+        self.clock.advance(10.0)
+        self.assertTrue(self.limiter.allow('a'))
+
+    def testKeys(self):
+        """Each key is limited separately."""
+        self.limiter.allow('a')
+        self.limiter.allow('a')
+        self.assertTrue(self.limiter.allow('b'))
+
+
+class TestEventSampler(unittest.TestCase):
+    """Test the EventSampler class."""
+
+    def testAll(self):
+        """A rate of one allows every event."""
+        sampler = EventSampler(rate=1.0)
+        self.assertTrue(all(sampler.allow('a') for _ in range(100)))
+
+    def testNone(self):
+        """A rate of zero allows no event, and counts them."""
+        sampler = EventSampler(rate=0.0)
+        self.assertFalse(any(sampler.allow('a') for _ in range(100)))
+        self.assertEqual({'a': 100}, sampler.suppressed)
+
+    def testRate(self):
+        """Roughly C{rate} of all events are allowed."""
+        sampler = EventSampler(rate=0.25, randomSource=Random(0))
+        allowed = sum(sampler.allow('a') for _ in range(10000))
+        self.assertTrue(2300 < allowed < 2700)
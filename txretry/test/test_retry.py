@@ -1,11 +1,18 @@
 from operator import add, mul
 from functools import partial
+from random import Random
 
 import six
 from twisted.trial import unittest
-from twisted.internet import defer
+from twisted.internet import defer, task
+from twisted.logger import globalLogPublisher
 
-from txretry.retry import simpleBackoffIterator, RetryingCall
+from txretry.retry import (
+    simpleBackoffIterator, fullJitterBackoffIterator,
+    equalJitterBackoffIterator, decorrelatedJitterBackoffIterator,
+    RetryingCall)
+from txretry.circuit import CircuitBreaker, CircuitOpenError
+from txretry.ratelimit import EventRateLimiter
 
 
 class TestBackoffIterator(unittest.TestCase):
@@ -122,6 +129,60 @@ class TestBackoffIterator(unittest.TestCase):
         self.assertEqual(10.0, six.next(bi))
 
 
+class TestJitterBackoffIterators(unittest.TestCase):
+    """Test the jittered back-off iterators."""
+
+    def testFullJitterBounds(self):
+        """Full jitter delays must lie between zero and the corresponding
+        un-jittered delay."""
+        plain = list(simpleBackoffIterator(now=False, initDelay=1.0))
+        jittered = list(fullJitterBackoffIterator(
+            now=False, initDelay=1.0, randomSource=Random(0)))
+        self.assertEqual(len(plain), len(jittered))
+        for bound, delay in zip(plain, jittered):
+            self.assertTrue(0.0 <= delay <= bound)
+
+    def testEqualJitterBounds(self):
+        """Equal jitter delays must lie between half of and all of the
+        corresponding un-jittered delay."""
+        plain = list(simpleBackoffIterator(now=False, initDelay=1.0))
+        jittered = list(equalJitterBackoffIterator(
+            now=False, initDelay=1.0, randomSource=Random(0)))
+        self.assertEqual(len(plain), len(jittered))
+        for bound, delay in zip(plain, jittered):
+            self.assertTrue(bound / 2.0 <= delay <= bound)
+
+    def testDecorrelatedJitterBounds(self):
+        """Decorrelated jitter delays must lie between C{initDelay} and
+        C{maxDelay}, and never exceed three times the previous delay."""
+        previous = 1.0
+        for delay in decorrelatedJitterBackoffIterator(
+                now=False, initDelay=1.0, maxDelay=20.0, maxResults=50,
+                randomSource=Random(0)):
+            self.assertTrue(1.0 <= delay <= 20.0)
+            self.assertTrue(delay <= previous * 3.0)
+            previous = delay
+
+    def testNow(self):
+        """When now=True, every jittered iterator must first yield zero."""
+        for factory in (fullJitterBackoffIterator, equalJitterBackoffIterator,
+                        decorrelatedJitterBackoffIterator):
+            self.assertEqual(0.0, six.next(factory(now=True)))
+
+    def testMaxResults(self):
+        """Every jittered iterator must respect C{maxResults}."""
+        for factory in (fullJitterBackoffIterator, equalJitterBackoffIterator,
+                        decorrelatedJitterBackoffIterator):
+            self.assertEqual(7, len(list(factory(maxResults=7))))
+
+    def testDeterministic(self):
+        """Identically seeded random sources give identical delays."""
+        for factory in (fullJitterBackoffIterator, equalJitterBackoffIterator,
+                        decorrelatedJitterBackoffIterator):
+            self.assertEqual(list(factory(randomSource=Random(42))),
+                             list(factory(randomSource=Random(42))))
+
+
 class _InitiallyFailing(object):
     """
     Provide a callable that raises an exception for its first C{nFails}
@@ -400,3 +461,294 @@ class TestRetryingCall(unittest.TestCase):
         d = rc.start(backoffIterator=(0.01, 0.01, 0.01))
         self.failUnlessFailure(d, ValueError)
         return d
+
+
+class TestRetryingCallCancellation(unittest.TestCase):
+    """Test cancelling the C{Deferred} returned by C{RetryingCall.start}."""
+
+    def setUp(self):
+        self.clock = task.Clock()
+
+    def testCancelDuringDelay(self):
+        """Cancelling while waiting to make an attempt must cancel the
+        scheduled call, leave no pending calls, and not call the
+        function."""
+        calls = []
+        rc = RetryingCall(lambda: calls.append(None))
+        d = rc.start(backoffIterator=(5.0,), clock=self.clock)
+        d.cancel()
+        self.failUnlessFailure(d, defer.CancelledError)
+        self.assertEqual([], self.clock.getDelayedCalls())
+        self.assertEqual([], calls)
+        return d
+
+    def testCancelDuringRetryDelay(self):
+        """Cancelling while waiting to retry must cancel the scheduled
+        retry and leave no pending calls."""
+        rc = RetryingCall(lambda: defer.fail(ValueError()))
+        d = rc.start(backoffIterator=(0.0, 5.0), clock=self.clock)
+        self.clock.advance(0.0)
+        self.assertEqual(1, len(rc.failures))
+        self.assertEqual(1, len(self.clock.getDelayedCalls()))
+        d.cancel()
+        self.assertEqual([], self.clock.getDelayedCalls())
+        self.failUnlessFailure(d, defer.CancelledError)
+        return d
+
+    def testCancelInFlightAttempt(self):
+        """Cancelling while an attempt is in progress must cancel the
+        C{Deferred} returned by the function, and not retry."""
+        cancelled = []
+        attempts = []
+
+        def _f():
+            attempt = defer.Deferred(cancelled.append)
+            attempts.append(attempt)
+            return attempt
+
+        rc = RetryingCall(_f)
+        d = rc.start(backoffIterator=(0.0, 0.0, 0.0), clock=self.clock)
+        self.clock.advance(0.0)
+        d.cancel()
+        self.assertEqual(attempts, cancelled)
+        self.assertEqual([], self.clock.getDelayedCalls())
+        self.assertEqual([], rc.failures)
+        self.failUnlessFailure(d, defer.CancelledError)
+        return d
+
+    def testCancelWithAttemptTimeout(self):
+        """Cancelling an in-flight attempt must also cancel its timeout."""
+        rc = RetryingCall(defer.Deferred)
+        d = rc.start(attemptTimeout=10.0, clock=self.clock)
+        self.clock.advance(0.0)
+        d.cancel()
+        self.assertEqual([], self.clock.getDelayedCalls())
+        self.failUnlessFailure(d, defer.CancelledError)
+        return d
+
+    def testCancelStopsBackoffIterator(self):
+        """Cancelling must close a generator back-off iterator."""
+        closed = []
+
+        def _backoff():
+            try:
+                yield 5.0
+            finally:
+                closed.append(None)
+
+        rc = RetryingCall(lambda: None)
+        d = rc.start(backoffIterator=_backoff(), clock=self.clock)
+        d.cancel()
+        self.assertEqual([None], closed)
+        self.failUnlessFailure(d, defer.CancelledError)
+        return d
+
+    def testCancelAfterSuccess(self):
+        """Cancelling after the call has succeeded has no effect."""
+        rc = RetryingCall(lambda: 4)
+        d = rc.start(clock=self.clock)
+        self.clock.advance(0.0)
+        d.cancel()
+        d.addCallback(lambda result: self.assertEqual(4, result))
+        return d
+
+
+class TestRetryingCallClock(unittest.TestCase):
+    """Test the clock used by C{RetryingCall}."""
+
+    def testStartClock(self):
+        """The clock passed to C{start} is used to schedule attempts."""
+        clock = task.Clock()
+        rc = RetryingCall(lambda: 5)
+        d = rc.start(backoffIterator=(3.0,), clock=clock)
+        self.assertFalse(d.called)
+        clock.advance(3.0)
+        d.addCallback(lambda result: self.assertEqual(5, result))
+        return d
+
+    def testClockAttribute(self):
+        """If no clock is passed to C{start}, the C{clock} attribute of the
+        C{RetryingCall} is used."""
+        rc = RetryingCall(lambda: 6)
+        rc.clock = task.Clock()
+        d = rc.start(backoffIterator=(3.0,))
+        self.assertFalse(d.called)
+        rc.clock.advance(3.0)
+        d.addCallback(lambda result: self.assertEqual(6, result))
+        return d
+
+    def testLongSimulation(self):
+        """A clock lets a long retry schedule run without real delays."""
+        clock = task.Clock()
+        f = _InitiallyFailing(9, result=7)
+        rc = RetryingCall(f)
+        d = rc.start(backoffIterator=simpleBackoffIterator(
+            initDelay=60.0, maxDelay=3600.0), clock=clock)
+        clock.pump([0.0] + [3600.0] * 9)
+        d.addCallback(lambda result: self.assertEqual(7, result))
+        return d
+
+
+class TestRetryingCallDeadlines(unittest.TestCase):
+    """Test the deadline and attemptTimeout arguments to
+    C{RetryingCall.start}."""
+
+    def setUp(self):
+        self.clock = task.Clock()
+
+    def testDeadlineStopsRetries(self):
+        """No attempt is scheduled if its delay would take us past the
+        deadline, and the call fails with the first failure."""
+        f = _InitiallyFailing(5, exceptionList=[ValueError, NameError])
+        rc = RetryingCall(f)
+        d = rc.start(backoffIterator=(0.0, 1.0, 2.0, 4.0), deadline=3.5,
+                     clock=self.clock)
+        self.clock.pump([0.0, 1.0, 2.0])
+        self.assertEqual(3, len(rc.failures))
+        self.assertEqual([], self.clock.getDelayedCalls())
+        self.failUnlessFailure(d, ValueError)
+        return d
+
+    def testDeadlineNotReached(self):
+        """A call that succeeds before its deadline is unaffected."""
+        f = _InitiallyFailing(2, result=3)
+        rc = RetryingCall(f)
+        d = rc.start(backoffIterator=(0.0, 1.0, 2.0), deadline=3.0,
+                     clock=self.clock)
+        self.clock.pump([0.0, 1.0, 2.0])
+        d.addCallback(lambda result: self.assertEqual(3, result))
+        return d
+
+    def testDeadlineBeforeFirstAttempt(self):
+        """If even the first attempt would be after the deadline, the call
+        fails with C{defer.TimeoutError}."""
+        rc = RetryingCall(lambda: None)
+        d = rc.start(backoffIterator=(5.0,), deadline=1.0, clock=self.clock)
+        self.assertEqual([], self.clock.getDelayedCalls())
+        self.failUnlessFailure(d, defer.TimeoutError)
+        return d
+
+    def testAttemptTimeoutRetries(self):
+        """A slow attempt is cancelled after C{attemptTimeout} seconds and
+        retried, even if the failure tester would not retry it."""
+        attempts = []
+
+        def _f():
+            attempts.append(defer.Deferred())
+            return attempts[-1]
+
+        rc = RetryingCall(_f)
+        d = rc.start(backoffIterator=(0.0, 0.0), attemptTimeout=2.0,
+                     failureTester=lambda f: f, clock=self.clock)
+        self.clock.advance(0.0)
+        self.clock.advance(2.0)
+        self.assertEqual(1, len(rc.failures))
+        self.assertTrue(rc.failures[0].check(defer.TimeoutError))
+        self.clock.advance(0.0)
+        self.assertEqual(2, len(attempts))
+        attempts[1].callback(7)
+        d.addCallback(lambda result: self.assertEqual(7, result))
+        d.addCallback(
+            lambda _: self.assertEqual([], self.clock.getDelayedCalls()))
+        return d
+
+    def testFunctionTimeoutTested(self):
+        """A C{defer.TimeoutError} from the function itself (rather than
+        from C{attemptTimeout}) is given to the failure tester."""
+        def _f():
+            raise defer.TimeoutError()
+
+        rc = RetryingCall(_f)
+        d = rc.start(backoffIterator=(0.0, 0.0), attemptTimeout=2.0,
+                     failureTester=lambda f: f, clock=self.clock)
+        self.clock.advance(0.0)
+        self.assertEqual(1, len(rc.failures))
+        self.assertEqual([], self.clock.getDelayedCalls())
+        self.failUnlessFailure(d, defer.TimeoutError)
+        return d
+
+    def testAttemptTimeoutNotReached(self):
+        """A fast attempt is not affected by C{attemptTimeout} and leaves
+        no timeout pending."""
+        rc = RetryingCall(lambda: 8)
+        d = rc.start(attemptTimeout=2.0, clock=self.clock)
+        self.clock.advance(0.0)
+        self.assertEqual([], self.clock.getDelayedCalls())
+        d.addCallback(lambda result: self.assertEqual(8, result))
+        return d
+
+    def testAttemptTimeoutsExhaustIterator(self):
+        """When every attempt times out, the call fails with the first
+        C{defer.TimeoutError} once the back-off iterator is exhausted."""
+        rc = RetryingCall(defer.Deferred)
+        d = rc.start(backoffIterator=(0.0, 0.0), attemptTimeout=1.0,
+                     clock=self.clock)
+        self.clock.pump([0.0, 1.0, 0.0, 1.0])
+        self.assertEqual(2, len(rc.failures))
+        self.failUnlessFailure(d, defer.TimeoutError)
+        return d
+
+
+class TestRetryingCallLogging(unittest.TestCase):
+    """Test the log events emitted by C{RetryingCall}."""
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.events = []
+        globalLogPublisher.addObserver(self._observe)
+        self.addCleanup(globalLogPublisher.removeObserver, self._observe)
+
+    def _observe(self, event):
+        """Keep the retry events emitted by C{RetryingCall}."""
+        if event.get('log_namespace') == 'txretry.retry':
+            self.events.append(event)
+
+    def testRetryEvent(self):
+        """A retry emits an event with structured fields."""
+        f = _InitiallyFailing(1, result=3, exceptionList=[ValueError])
+        rc = RetryingCall(f)
+        d = rc.start(backoffIterator=(0.0, 2.0), clock=self.clock)
+        self.clock.pump([0.0, 2.0])
+        self.assertEqual(1, len(self.events))
+        event = self.events[0]
+        self.assertIs(f, event['function'])
+        self.assertEqual(2, event['attempt'])
+        self.assertEqual(2.0, event['delay'])
+        self.assertIs(ValueError, event['exceptionType'])
+        self.assertIs(rc.failures[0], event['failure'])
+        d.addCallback(lambda result: self.assertEqual(3, result))
+        return d
+
+    def testGiveUpEvent(self):
+        """Running out of attempts emits an event."""
+        rc = RetryingCall(lambda: defer.fail(ValueError()))
+        d = rc.start(backoffIterator=(0.0,), clock=self.clock)
+        self.clock.advance(0.0)
+        self.assertEqual(1, len(self.events))
+        self.assertIn('ran out of attempts', self.events[0]['log_format'])
+        self.failUnlessFailure(d, ValueError)
+        return d
+
+    def testLogLimiter(self):
+        """A log limiter suppresses retry and give-up events."""
+        limiter = EventRateLimiter(maxEvents=2, clock=self.clock)
+        f = _InitiallyFailing(5, result=3)
+        rc = RetryingCall(f)
+        d = rc.start(backoffIterator=(0.0,) * 6, logLimiter=limiter,
+                     clock=self.clock)
+        self.clock.pump([0.0] * 6)
+        self.assertEqual(2, len(self.events))
+        self.assertEqual({f: 3}, limiter.suppressed)
+        d.addCallback(lambda result: self.assertEqual(3, result))
+        # Giving up is suppressed too, e.g., while a breaker is open.
+        breaker = CircuitBreaker(minimumCalls=1, windowSize=1,
+                                 clock=self.clock)
+        breaker.recordFailure()
+        ds = [RetryingCall(f).start(circuitBreaker=breaker,
+                                    logLimiter=limiter, clock=self.clock)
+              for _ in range(3)]
+        self.assertEqual(2, len(self.events))
+        self.assertEqual({f: 6}, limiter.suppressed)
+        for giveUp in ds:
+            self.failUnlessFailure(giveUp, CircuitOpenError)
+        return defer.gatherResults([d] + ds)
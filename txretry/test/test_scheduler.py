@@ -0,0 +1,149 @@
+from twisted.trial import unittest
+from twisted.internet import defer, task
+
+from txretry.retry import RetryingCall
+from txretry.scheduler import AttemptScheduler
+
+
+class TestAttemptScheduler(unittest.TestCase):
+    """Test the AttemptScheduler class."""
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.scheduler = AttemptScheduler(2, clock=self.clock)
+        self.pending = {}
+
+    def _call(self, name):
+        """Make a function that returns a new C{Deferred}, saved under
+        C{name} in C{self.pending}."""
+        def _f():
+            d = self.pending[name] = defer.Deferred()
+            return d
+        return _f
+
+    def testRunsImmediately(self):
+        """Calls run immediately while there is room."""
+        d = self.scheduler.run(1, lambda: 3)
+        d.addCallback(lambda result: self.assertEqual(3, result))
+        self.assertEqual(0, self.scheduler.inFlight)
+        return d
+
+    def testLimit(self):
+        """Calls beyond the limit wait until there is room."""
+        self.scheduler.run(1, self._call('a'))
+        self.scheduler.run(1, self._call('b'))
+        d = self.scheduler.run(1, self._call('c'))
+        self.assertEqual(2, self.scheduler.inFlight)
+        self.assertEqual(1, self.scheduler.queueDepth)
+        self.assertNotIn('c', self.pending)
+        self.clock.advance(3.0)
+        self.pending['a'].callback(None)
+        self.assertIn('c', self.pending)
+        self.assertEqual(0, self.scheduler.queueDepth)
+        self.assertEqual(1, self.scheduler.maxQueueDepth)
+        self.assertEqual(3, self.scheduler.started)
+        self.assertEqual(3.0, self.scheduler.waitTimes.sum)
+        self.pending['c'].callback(5)
+        d.addCallback(lambda result: self.assertEqual(5, result))
+        return d
+
+    def testPriority(self):
+        """Waiting calls run in priority order, then in arrival order."""
+        order = []
+        self.scheduler.run(1, self._call('a'))
+        self.scheduler.run(1, self._call('b'))
+        for priority, name in ((3, 'retry'), (1, 'first1'), (2, 'second'),
+                               (1, 'first2')):
+            self.scheduler.run(priority, lambda name=name: order.append(name))
+        self.pending['a'].callback(None)
+        self.assertEqual(['first1', 'first2', 'second', 'retry'], order)
+
+    def testCancelQueued(self):
+        """Cancelling a waiting call removes it from the queue."""
+        calls = []
+        self.scheduler.run(1, self._call('a'))
+        self.scheduler.run(1, self._call('b'))
+        d = self.scheduler.run(1, lambda: calls.append(None))
+        d.cancel()
+        self.assertEqual(0, self.scheduler.queueDepth)
+        self.pending['a'].callback(None)
+        self.assertEqual([], calls)
+        self.assertEqual(1, self.scheduler.inFlight)
+        self.failUnlessFailure(d, defer.CancelledError)
+        return d
+
+    def testCancelInProgress(self):
+        """Cancelling a call in progress cancels it and frees its slot."""
+        d = self.scheduler.run(1, self._call('a'))
+        d.cancel()
+        self.assertEqual(0, self.scheduler.inFlight)
+        self.failUnlessFailure(d, defer.CancelledError)
+        return d
+
+    def testFailure(self):
+        """A failing call frees its slot and passes on its failure."""
+        d = self.scheduler.run(1, lambda: defer.fail(ValueError()))
+        self.assertEqual(0, self.scheduler.inFlight)
+        self.failUnlessFailure(d, ValueError)
+        return d
+
+    def testSynchronousQueue(self):
+        """A long queue of synchronous calls is drained without
+        recursion."""
+        self.scheduler.run(1, self._call('a'))
+        self.scheduler.run(1, self._call('b'))
+        ds = [self.scheduler.run(1, lambda: None) for _ in range(5000)]
+        self.pending['a'].callback(None)
+        self.assertEqual(0, self.scheduler.queueDepth)
+        return defer.gatherResults(ds)
+
+
+class TestRetryingCallScheduler(unittest.TestCase):
+    """Test the scheduler argument to C{RetryingCall.start}."""
+
+    def testRetriesWait(self):
+        """Attempts beyond the limit are queued, and first attempts run
+        before retries."""
+        clock = task.Clock()
+        scheduler = AttemptScheduler(1, clock=clock)
+        calls = []
+        blocker = defer.Deferred()
+
+        def _block():
+            calls.append('block')
+            return blocker
+
+        def _retry():
+            calls.append('retry')
+            if calls.count('retry') == 1:
+                raise ValueError()
+
+        ds = [RetryingCall(_retry).start(
+            backoffIterator=(0.0, 1.0), scheduler=scheduler, clock=clock)]
+        clock.advance(0.0)
+        ds.append(RetryingCall(_block).start(scheduler=scheduler,
+                                             clock=clock))
+        clock.advance(0.0)
+        clock.advance(1.0)
+        ds.append(RetryingCall(lambda: calls.append('first')).start(
+            scheduler=scheduler, clock=clock))
+        clock.advance(0.0)
+        self.assertEqual(['retry', 'block'], calls)
+        self.assertEqual(2, scheduler.queueDepth)
+        blocker.callback(None)
+        self.assertEqual(['retry', 'block', 'first', 'retry'], calls)
+        return defer.gatherResults(ds)
+
+    def testCancelQueuedAttempt(self):
+        """Cancelling a retrying call whose attempt is queued removes the
+        attempt from the queue."""
+        clock = task.Clock()
+        scheduler = AttemptScheduler(1, clock=clock)
+        RetryingCall(defer.Deferred).start(scheduler=scheduler, clock=clock)
+        d = RetryingCall(lambda: None).start(scheduler=scheduler, clock=clock)
+        clock.advance(0.0)
+        self.assertEqual(1, scheduler.queueDepth)
+        d.cancel()
+        self.assertEqual(0, scheduler.queueDepth)
+        self.failUnlessFailure(d, defer.CancelledError)
+        return d
@@ -0,0 +1,229 @@
+from twisted.trial import unittest
+from twisted.internet import defer, task
+
+from txretry.retry import RetryingCall
+from txretry.storm import StormDetector
+
+
+class TestStormDetector(unittest.TestCase):
+    """Test the StormDetector class."""
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.detector = StormDetector(window=10.0, minAttempts=4,
+                                      retryThreshold=0.5,
+                                      recoveryThreshold=0.1, multiplier=3.0,
+                                      shedAfter=2, clock=self.clock)
+
+    def _storm(self):
+        """Record enough retries to start a storm."""
+        self.detector.recordAttempt(False)
+        for _ in range(3):
+            self.detector.recordAttempt(True)
+            self.detector.recordFailure()
+
+    def testNoStormBelowMinimum(self):
+        """A storm needs a minimum number of attempts in the window."""
+        for _ in range(3):
+            self.detector.recordAttempt(True)
+        self.assertFalse(self.detector.storming)
+
+    def testNoStormWithFewRetries(self):
+        """Mostly first attempts do not make a storm."""
+        for retry in (False, False, True, False, True):
+            self.detector.recordAttempt(retry)
+        self.assertFalse(self.detector.storming)
+
+    def testStorm(self):
+        """A storm begins when too many attempts are retries."""
+        self._storm()
+        self.assertEqual((True, 1), (self.detector.storming,
+                                     self.detector.storms))
+
+    def testWindow(self):
+        """Events that have left the window are forgotten."""
+        for _ in range(3):
+            self.detector.recordAttempt(True)
+        self.clock.advance(10.0)
+        self.detector.recordAttempt(True)
+        self.assertFalse(self.detector.storming)
+
+    def testRecovery(self):
+        """A storm ends when the failure rate drops to the recovery
+        threshold."""
+        self._storm()
+        self.clock.advance(5.0)
+        for _ in range(26):
+            self.detector.recordSuccess()
+        self.assertTrue(self.detector.storming)
+        self.detector.recordSuccess()
+        self.assertFalse(self.detector.storming)
+
+    def testStretch(self):
+        """Delays are stretched only during a storm."""
+        self.assertEqual(2.0, self.detector.stretch(2.0))
+        self._storm()
+        self.assertEqual(6.0, self.detector.stretch(2.0))
+        self.assertEqual(1, self.detector.stretched)
+
+    def testShed(self):
+        """Only retries beyond C{shedAfter} are shed, and only during a
+        storm."""
+        self.assertFalse(self.detector.shouldShed(3))
+        self._storm()
+        self.assertFalse(self.detector.shouldShed(2))
+        self.assertTrue(self.detector.shouldShed(3))
+        self.assertEqual(1, self.detector.shed)
+
+    def testStretchWaiting(self):
+        """When a storm begins, retries already waiting have their
+        remaining delay stretched."""
+        calls = []
+        self.detector.track(self.clock.callLater(4.0, calls.append, 1),
+                            self.clock)
+        self.clock.advance(2.0)
+        self._storm()
+        self.clock.advance(5.0)
+        self.assertEqual([], calls)
+        self.clock.advance(1.0)
+        self.assertEqual([1], calls)
+
+    def testStretchWaitingLatest(self):
+        """A waiting retry is not stretched beyond the latest time given
+        for it."""
+        calls = []
+        self.detector.track(self.clock.callLater(4.0, calls.append, 1),
+                            self.clock, 5.0)
+        self.detector.track(self.clock.callLater(4.0, calls.append, 2),
+                            self.clock, 4.0)
+        self.clock.advance(2.0)
+        self._storm()
+        self.assertEqual(1, self.detector.stretched)
+        self.clock.advance(2.0)
+        self.assertEqual([2], calls)
+        self.clock.advance(1.0)
+        self.assertEqual([2, 1], calls)
+
+    def testPrune(self):
+        """Calls that have been made are eventually forgotten."""
+        for _ in range(200):
+            self.detector.track(self.clock.callLater(0.0, lambda: None),
+                                self.clock)
+            self.clock.advance(0.0)
+        self.assertTrue(len(self.detector._waiting) < 70)
+
+
+class TestRetryingCallStorm(unittest.TestCase):
+    """Test RetryingCall with a StormDetector."""
+
+    def setUp(self):
+        self.clock = task.Clock()
+
+    def _failing(self):
+        raise RuntimeError('unavailable')
+
+    def testEventsCounted(self):
+        """Attempts, retries and outcomes are counted."""
+        detector = StormDetector(clock=self.clock)
+        results = iter([RuntimeError(), None])
+
+        def _f():
+            result = next(results)
+            if result is not None:
+                raise result
+
+        d = RetryingCall(_f).start(backoffIterator=(0.0, 1.0),
+                                   stormDetector=detector, clock=self.clock)
+        self.clock.pump([0.0, 1.0])
+        self.assertEqual([None, 2, 1, 1, 1], detector._totals)
+        return d
+
+    def testClassAttribute(self):
+        """The class attribute is used when no detector is passed."""
+        detector = StormDetector(clock=self.clock)
+        self.patch(RetryingCall, 'stormDetector', detector)
+        d = RetryingCall(lambda: None).start(clock=self.clock)
+        self.clock.advance(0.0)
+        self.assertEqual(1, detector._totals[1])
+        return d
+
+    def testStretchAndShed(self):
+        """During a storm, retry delays are stretched and later retries
+        are shed."""
+        detector = StormDetector(minAttempts=2, retryThreshold=0.4,
+                                 multiplier=10.0, shedAfter=2,
+                                 clock=self.clock)
+        calls = []
+
+        def _f():
+            calls.append(self.clock.seconds())
+            raise RuntimeError()
+
+        ds = [RetryingCall(_f).start(backoffIterator=(0.0, 1.0, 1.0, 1.0),
+                                     stormDetector=detector,
+                                     clock=self.clock) for _ in range(2)]
+        self.clock.advance(0.0)
+        # Both retries are scheduled, and the second starts the storm,
+        # stretching the first.
+        self.assertTrue(detector.storming)
+        self.clock.advance(1.0)
+        self.assertEqual([0.0, 0.0], calls)
+        self.clock.advance(9.0)
+        self.assertEqual([0.0, 0.0, 10.0, 10.0], calls)
+        # Third attempts are shed.
+        self.assertEqual([], self.clock.getDelayedCalls())
+        self.assertEqual(2, detector.shed)
+        for d in ds:
+            self.failUnlessFailure(d, RuntimeError)
+        return ds[1]
+
+    def testCallClock(self):
+        """Retries are scheduled with the call's clock, not the detector's,
+        and can still be stretched."""
+        callClock = task.Clock()
+        detector = StormDetector(minAttempts=2, retryThreshold=0.4,
+                                 multiplier=10.0, clock=self.clock)
+        self.patch(RetryingCall, 'stormDetector', detector)
+        calls = []
+
+        def _f():
+            calls.append(callClock.seconds())
+            if len(calls) < 3:
+                raise RuntimeError()
+
+        ds = [RetryingCall(_f).start(backoffIterator=(0.0, 1.0),
+                                     clock=callClock) for _ in range(2)]
+        callClock.advance(0.0)
+        self.assertTrue(detector.storming)
+        self.assertEqual([], self.clock.getDelayedCalls())
+        self.assertEqual(2, len(callClock.getDelayedCalls()))
+        callClock.advance(10.0)
+        self.assertEqual([0.0, 0.0, 10.0, 10.0], calls)
+        return ds[0]
+
+    def testStretchKeepsDeadline(self):
+        """Retries stretched when a storm begins are not made after their
+        call's deadline, and retries that would be are not made."""
+        detector = StormDetector(minAttempts=2, retryThreshold=0.4,
+                                 multiplier=10.0, clock=self.clock)
+        calls = []
+
+        def _f():
+            calls.append(self.clock.seconds())
+            raise RuntimeError()
+
+        ds = [RetryingCall(_f).start(backoffIterator=(0.0, 1.0, 1.0),
+                                     deadline=3.0, stormDetector=detector,
+                                     clock=self.clock) for _ in range(3)]
+        self.clock.advance(0.0)
+        self.assertTrue(detector.storming)
+        # The third retry starts the storm. Without the deadline, all
+        # three would be stretched to t=10.
+        self.assertEqual([3.0] * 3, [call.getTime() for call
+                                     in self.clock.getDelayedCalls()])
+        self.clock.advance(3.0)
+        self.assertEqual([0.0] * 3 + [3.0] * 3, calls)
+        self.assertEqual([], self.clock.getDelayedCalls())
+        for d in ds:
+            self.failUnlessFailure(d, RuntimeError)
+        return defer.gatherResults(ds)
@@ -0,0 +1,178 @@
+import threading
+
+from twisted.trial import unittest
+from twisted.internet import defer, task
+from twisted.python import failure, threadpool
+
+from txretry.retry import RetryingCall
+from txretry.threads import ThreadPoolRunner
+
+
+class _FakeReactor(task.Clock):
+    """A clock that also delivers calls from threads at once."""
+
+    def callFromThread(self, f, *args, **kw):
+        f(*args, **kw)
+
+
+class _FakeThreadPool(object):
+    """A thread pool whose work is run only when the test says so."""
+    max = 2
+
+    def __init__(self):
+        self.work = []
+
+    def callInThreadWithCallback(self, onResult, func, *args, **kw):
+        self.work.append((onResult, func, args, kw))
+
+    def runNext(self):
+        """Run the oldest piece of work, as a pool thread would."""
+        onResult, func, args, kw = self.work.pop(0)
+        try:
+            result = func(*args, **kw)
+        except:
+            onResult(False, failure.Failure())
+        else:
+            onResult(True, result)
+
+
+class TestThreadPoolRunner(unittest.TestCase):
+    """Test the ThreadPoolRunner class."""
+
+    def setUp(self):
+        self.reactor = _FakeReactor()
+        self.pool = _FakeThreadPool()
+
+    def testRun(self):
+        """A call runs in the pool and its result is delivered."""
+        runner = ThreadPoolRunner(self.pool, reactor=self.reactor)
+        d = runner.run(lambda x, y: x + y, 1, y=2)
+        self.assertFalse(d.called)
+        self.assertEqual((1, 1), (runner.started, runner.running))
+        self.pool.runNext()
+        self.assertEqual(0, runner.running)
+        d.addCallback(self.assertEqual, 3)
+        return d
+
+    def testFailure(self):
+        """An exception raised in the pool fails the C{Deferred}."""
+        runner = ThreadPoolRunner(self.pool, reactor=self.reactor)
+        d = runner.run(lambda: 1 / 0)
+        self.pool.runNext()
+        return self.failUnlessFailure(d, ZeroDivisionError)
+
+    def testConcurrencyLimit(self):
+        """Calls beyond the concurrency limit wait for a running call to
+        finish."""
+        runner = ThreadPoolRunner(self.pool, maxConcurrent=1,
+                                  reactor=self.reactor)
+        first = runner.run(lambda: 1)
+        second = runner.run(lambda: 2)
+        self.assertEqual((1, 1), (len(self.pool.work), runner.waiting))
+        self.pool.runNext()
+        self.assertEqual((1, 0), (len(self.pool.work), runner.waiting))
+        self.pool.runNext()
+        return defer.gatherResults([first, second]).addCallback(
+            self.assertEqual, [1, 2])
+
+    def testDefaultLimit(self):
+        """By default, the limit is the size of the pool."""
+        runner = ThreadPoolRunner(self.pool, reactor=self.reactor)
+        for _ in range(3):
+            runner.run(lambda: None)
+        self.assertEqual((2, 1), (len(self.pool.work), runner.waiting))
+
+    def testTimeout(self):
+        """A call that runs too long fails with C{TimeoutError}, and its
+        late result is discarded, freeing its place only then."""
+        runner = ThreadPoolRunner(self.pool, maxConcurrent=1, timeout=5.0,
+                                  reactor=self.reactor)
+        d = runner.run(lambda: 1)
+        second = runner.run(lambda: 2)
+        self.reactor.advance(5.0)
+        self.failUnlessFailure(d, defer.TimeoutError)
+        self.assertEqual((1, 1), (runner.timedOut, runner.waiting))
+        self.pool.runNext()
+        self.assertEqual((1, 0), (runner.abandoned, runner.waiting))
+        self.pool.runNext()
+        second.addCallback(self.assertEqual, 2)
+        return defer.gatherResults([d, second])
+
+    def testNoTimeoutAfterResult(self):
+        """The timeout is cancelled when the call finishes."""
+        runner = ThreadPoolRunner(self.pool, timeout=5.0,
+                                  reactor=self.reactor)
+        d = runner.run(lambda: 1)
+        self.pool.runNext()
+        self.assertEqual([], self.reactor.getDelayedCalls())
+        return d
+
+    def testCancelWaiting(self):
+        """Cancelling a call waiting for its turn means it never runs."""
+        runner = ThreadPoolRunner(self.pool, maxConcurrent=1,
+                                  reactor=self.reactor)
+        first = runner.run(lambda: 1)
+        second = runner.run(lambda: 2)
+        second.cancel()
+        self.assertEqual(0, runner.waiting)
+        self.pool.runNext()
+        self.assertEqual([], self.pool.work)
+        self.failUnlessFailure(second, defer.CancelledError)
+        return defer.gatherResults([first, second])
+
+    def testCancelRunning(self):
+        """Cancelling a running call abandons its result."""
+        runner = ThreadPoolRunner(self.pool, timeout=5.0,
+                                  reactor=self.reactor)
+        d = runner.run(lambda: 1)
+        d.cancel()
+        self.assertEqual([], self.reactor.getDelayedCalls())
+        self.pool.runNext()
+        self.assertEqual((1, 0), (runner.abandoned, runner.running))
+        return self.failUnlessFailure(d, defer.CancelledError)
+
+    def testWrap(self):
+        """A wrapped function runs in the pool and keeps its name."""
+        runner = ThreadPoolRunner(self.pool, reactor=self.reactor)
+
+        def blocking(x):
+            return x * 2
+
+        wrapped = runner.wrap(blocking)
+        self.assertEqual('blocking', wrapped.__name__)
+        d = wrapped(21)
+        self.pool.runNext()
+        d.addCallback(self.assertEqual, 42)
+        return d
+
+    def testRetryingCall(self):
+        """A RetryingCall retries a call that times out in the pool, with
+        its back-off scheduled by the reactor."""
+        runner = ThreadPoolRunner(self.pool, timeout=5.0,
+                                  reactor=self.reactor)
+        results = iter([None, 7])
+        d = RetryingCall(runner.wrap(lambda: next(results))).start(
+            backoffIterator=(0.0, 1.0), clock=self.reactor)
+        self.reactor.advance(0.0)
+        self.reactor.advance(5.0)
+        self.reactor.advance(1.0)
+        self.assertEqual(2, len(self.pool.work))
+        self.pool.runNext()
+        self.pool.runNext()
+        self.assertEqual(1, runner.abandoned)
+        d.addCallback(self.assertEqual, 7)
+        return d
+
+
+class TestThreadPoolRunnerThreads(unittest.TestCase):
+    """Test the ThreadPoolRunner class with real threads."""
+
+    def testRealPool(self):
+        """Calls run in the pool's threads, not the reactor thread."""
+        pool = threadpool.ThreadPool(1, 2)
+        pool.start()
+        self.addCleanup(pool.stop)
+        runner = ThreadPoolRunner(pool)
+        d = runner.run(threading.current_thread)
+        d.addCallback(self.assertNotIdentical, threading.current_thread())
+        return d
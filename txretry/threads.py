@@ -0,0 +1,172 @@
+# Copyright 2011 Fluidinfo Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you
+# may not use this file except in compliance with the License.  You
+# may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.  See the License for the specific language governing
+# permissions and limitations under the License.
+
+
+from functools import partial, wraps
+
+from twisted.internet import defer, threads
+from twisted.python import failure
+
+from txretry.retry import _defaultClock
+
+
+class ThreadPoolRunner(object):
+    """
+    Run blocking functions in a thread pool, so that retrying them with a
+    L{RetryingCall} does not block the reactor. Only the attempts run in
+    the pool; back-off delays are still scheduled by the reactor::
+
+        runner = ThreadPoolRunner(pool, maxConcurrent=4, timeout=10.0)
+        d = RetryingCall(runner.wrap(blockingFunc), arg).start()
+
+    At most C{maxConcurrent} calls run at once, and the others wait in the
+    reactor thread for their turn. A call still running after C{timeout}
+    seconds fails with C{defer.TimeoutError} (which the L{RetryingCall}
+    can retry), and its result is discarded when its thread eventually
+    finishes. Python threads cannot be stopped, so an abandoned call keeps
+    its place in the concurrency limit until then.
+
+    @ivar started: the number of calls started in the pool.
+    @ivar running: the number of calls running in the pool, including
+        abandoned ones.
+    @ivar timedOut: the number of calls that timed out.
+    @ivar abandoned: the number of results (of calls that timed out or
+        were cancelled) that have been discarded.
+    @param threadPool: a C{twisted.python.threadpool.ThreadPool}.
+    @param maxConcurrent: the greatest number of calls to run in the pool
+        at once. Default: the size of the pool.
+    @param timeout: if not C{None}, the number of seconds after which a
+        running call is abandoned.
+    @param reactor: the reactor, used to schedule timeouts and to receive
+        results from the pool. Default: the global reactor.
+    """
+    def __init__(self, threadPool, maxConcurrent=None, timeout=None,
+                 reactor=None):
+        self._threadPool = threadPool
+        self._semaphore = defer.DeferredSemaphore(maxConcurrent or
+                                                  threadPool.max)
+        self.timeout = timeout
+        self._reactor = reactor or _defaultClock()
+        self.started = 0
+        self.running = 0
+        self.timedOut = 0
+        self.abandoned = 0
+
+    @property
+    def waiting(self):
+        """
+        The number of calls waiting for their turn to run.
+        """
+        return len(self._semaphore.waiting)
+
+    def run(self, func, *args, **kw):
+        """
+        Call a function in the thread pool.
+
+        @param func: The function to call.
+        @param args: Positional arguments to pass to the function.
+        @param kw: Keyword arguments to pass to the function.
+        @return: a C{Deferred} that fires with the result of the call or
+            fails with its failure (or C{defer.TimeoutError}). Cancelling
+            it abandons the call.
+        """
+        return _ThreadedCall(self, partial(func, *args, **kw)).deferred
+
+    def wrap(self, func):
+        """
+        Make a function that calls C{func} in the thread pool.
+
+        @param func: a blocking function.
+        @return: a function with the same arguments as C{func} that returns
+            a C{Deferred}, as for L{run}.
+        """
+        @wraps(func)
+        def wrapper(*args, **kw):
+            return self.run(func, *args, **kw)
+        return wrapper
+
+
+class _ThreadedCall(object):
+    """
+    A single call of a function in the thread pool of a
+    L{ThreadPoolRunner}.
+    """
+    def __init__(self, runner, func):
+        self._runner = runner
+        self._func = func
+        self._timer = None
+        self._done = False
+        self.deferred = defer.Deferred(self._cancel)
+        self._acquiring = runner._semaphore.acquire()
+        # A cancelled acquisition fails, and is of no further interest.
+        self._acquiring.addCallbacks(self._dispatch, lambda _: None)
+
+    def _dispatch(self, _):
+        """
+        Start the call in the pool, now that it is our turn.
+        """
+        self._acquiring = None
+        runner = self._runner
+        runner.started += 1
+        runner.running += 1
+        if runner.timeout is not None:
+            self._timer = runner._reactor.callLater(runner.timeout,
+                                                    self._timedOut)
+        d = threads.deferToThreadPool(runner._reactor, runner._threadPool,
+                                      self._func)
+        d.addBoth(self._finished)
+
+    def _finished(self, result):
+        """
+        The call has returned (in the reactor thread).
+
+        @param result: the result of the call, or a C{Failure}.
+        """
+        runner = self._runner
+        runner.running -= 1
+        runner._semaphore.release()
+        if self._done:
+            runner.abandoned += 1
+            return
+        self._done = True
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if isinstance(result, failure.Failure):
+            self.deferred.errback(result)
+        else:
+            self.deferred.callback(result)
+
+    def _timedOut(self):
+        """
+        The call has run for too long. Abandon it.
+        """
+        self._timer = None
+        self._done = True
+        self._runner.timedOut += 1
+        self.deferred.errback(defer.TimeoutError(
+            'Call of %r in thread pool timed out.' % (self._func.func,)))
+
+    def _cancel(self, deferred):
+        """
+        Stop waiting for a turn, or abandon the running call.
+
+        @param deferred: our deferred, which is being cancelled.
+        """
+        self._done = True
+        if self._acquiring is not None:
+            self._acquiring.cancel()
+        elif self._timer is not None:
+            self._timer.cancel()
+            self._timer = None